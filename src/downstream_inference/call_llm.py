@@ -6,9 +6,19 @@ import pdb
 from vllm import LLM, SamplingParams
 import os 
 import argparse
+import sys
 import anthropic
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "table2graph"))
+from retrieval_modules.records import LLMOutput, encode_line
+from retrieval_modules.table_store import iter_retrieval_results
+from retrieval_modules.column_stats import ColumnCatalog
 # from evaluation import Evaluator
 
+# Optional column catalog: tables with more than summary_min_rows rows are shown as column summaries (set in main)
+column_catalog = None
+summary_min_rows = None
+
 def get_few_shot_prompt(task_name: str):
     few_shot_prompt_list = {
         "tabfact":
@@ -76,6 +86,10 @@ def table_to_html(table_data: dict) -> str:
     caption = table_data.get("caption", "")
     header = table_data["table"]["header"]
     rows = table_data["table"]["rows"]
+    if column_catalog is not None and len(rows) > summary_min_rows and table_data.get("table_idx") in column_catalog.position:
+        # Large table: column types, ranges and frequent values instead of every row.
+        summary = column_catalog.summary(table_data["table_idx"])
+        return f"<h3>{caption}</h3>\n<pre>{len(rows)} rows. Columns (type, values, range or distinct count): frequent values\n{summary}</pre>"
     df = pd.DataFrame(rows, columns=header)
     
     html_table = df.to_html(index=False, escape=False) ##NOTE: You can also use other formats like markdown, json, latex, etc.
@@ -227,6 +241,15 @@ if __name__ == "__main__":
     parser.add_argument("--starting_idx", type=int, default=0, help="Starting index")
     parser.add_argument("--testing_num", type=int, required=True, help="testing_num of the queries")
     parser.add_argument("--embedding_method", type=str, default="contriever", help="Embedding method used during retrieval process")
+    parser.add_argument("--table_file", type=str, default=None,
+                        help="Table JSONL used to resolve reference-format retrieval output "
+                             "(default: ../table2graph/data/{dataset}/{dataset}_table.jsonl)")
+    parser.add_argument("--summary_min_rows", type=int, default=None,
+                        help="Show tables with more rows than this as column summaries from the column catalog "
+                             "(default: always full rows)")
+    parser.add_argument("--column_catalog_file", type=str, default=None,
+                        help="Column catalog (.npz) for --summary_min_rows "
+                             "(default: ../table2graph/data/{dataset}/{dataset}_column_catalog.npz)")
 
     args = parser.parse_args()
     topk = args.topk
@@ -235,6 +258,7 @@ if __name__ == "__main__":
     model = args.model
     starting_idx = args.starting_idx
     testing_num = args.testing_num
+    embedding_method = args.embedding_method
     
     print(f"args: {args}")
     
@@ -243,9 +267,12 @@ if __name__ == "__main__":
     output_dir = f"./output/{dataset}/{model}/"
     output_file = f"{output_dir}/output_{testing_num}_{topk}.jsonl"
     key_file = "./key.json"
-    
-    with open(retrieve_table_file, "r") as f:
-        retrieve_instances = f.readlines()
+    table_file = args.table_file or f"../table2graph/data/{dataset}/{dataset}_table.jsonl"
+    if args.summary_min_rows is not None:
+        summary_min_rows = args.summary_min_rows
+        column_catalog = ColumnCatalog.load(args.column_catalog_file or
+                                            f"../table2graph/data/{dataset}/{dataset}_column_catalog.npz")
+        print(f"Column catalog: {column_catalog.stats()}")
     
     if "gpt" in model:
         key_type = "openai"
@@ -260,8 +287,8 @@ if __name__ == "__main__":
     print("Constructing prompts...")
     groundtruths = []
     querys = []
-    for line in tqdm(retrieve_instances):
-        retrieve_instance = json.loads(line)
+    # Streamed record by record; reference-format output gets its tables from the table store.
+    for retrieve_instance in tqdm(iter_retrieval_results(retrieve_table_file, table_file)):
         groundtruths.append(retrieve_instance["query_label"])
         querys.append(retrieve_instance["query"])
         if "gpt" in model:
@@ -293,17 +320,13 @@ if __name__ == "__main__":
         outputs = llm.generate(prompts, sampling_params)
         
         
-        with open(output_file, "a") as f:            
+        with open(output_file, "a", encoding="utf-8") as f:            
             for i, output in tqdm(enumerate(outputs)):
                 prompt = output.prompt
                 generated_text = output.outputs[0].text
-                output = {
-                    "query": querys[i],
-                    "groundtruth": groundtruths[i],
-                    "output": generated_text,
-                }
+                output = LLMOutput(query=querys[i], groundtruth=groundtruths[i], output=generated_text)
 
-                f.write(json.dumps(output) + "\n")
+                f.write(encode_line(output) + "\n")
                 
     elif mode == "API":
         with open(key_file, "r") as f:
@@ -311,12 +334,9 @@ if __name__ == "__main__":
             api_key = key[key_type]
         
         if "gpt" in model:
-            with open(retrieve_table_file, "r") as f:
-                retrieve_instances = f.readlines()
-
             client = openai.OpenAI(api_key=api_key)
 
-            with open(output_file, "a") as f:  # Open file for writing API responses
+            with open(output_file, "a", encoding="utf-8") as f:  # Open file for writing API responses
                 for i, prompt in tqdm(enumerate(prompts), total=len(prompts), desc="Processing Prompts"):
                     if i < starting_idx:
                         continue
@@ -332,27 +352,20 @@ if __name__ == "__main__":
 
                         generated_text = response.choices[0].message.content.strip()
                         
-                        output = {
-                            "query": querys[i],
-                            "groundtruth": groundtruths[i],
-                            "output": generated_text,
-                        }
+                        output = LLMOutput(query=querys[i], groundtruth=groundtruths[i], output=generated_text)
                         
                         if i < 5:
                             print(generated_text)
                         
-                        f.write(json.dumps(output) + "\n")
+                        f.write(encode_line(output) + "\n")
 
                     except Exception as e:
                         print(f"Error calling OpenAI API: {e}")
             
         elif "claude" in model:
-            with open(retrieve_table_file, "r") as f:
-                retrieve_instances = f.readlines()
-
             client = anthropic.Anthropic(api_key=api_key)
 
-            with open(output_file, "a") as f:  # Open file for writing API responses
+            with open(output_file, "a", encoding="utf-8") as f:  # Open file for writing API responses
                 for i, prompt in tqdm(enumerate(prompts), total=len(prompts), desc="Processing Prompts"):
                     if i < starting_idx:
                         continue
@@ -367,16 +380,12 @@ if __name__ == "__main__":
                         
                         generated_text = response.content[0].text.strip()
                         print(generated_text)
-                        output = {
-                            "query": querys[i],
-                            "groundtruth": groundtruths[i],
-                            "output": generated_text,
-                        }
+                        output = LLMOutput(query=querys[i], groundtruth=groundtruths[i], output=generated_text)
                         
                         if i < 5:
                             print(generated_text)
                         
-                        f.write(json.dumps(output) + "\n")
+                        f.write(encode_line(output) + "\n")
 
                     except Exception as e:
                         print(f"Error calling Anthropic API: {e}")
@@ -29,6 +29,10 @@ import argparse
 import os
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "table2graph"))
+from retrieval_modules.records import encode_line
+from retrieval_modules.table_store import iter_retrieval_results
+
 # Import adaptive modules
 from adaptive_modules.query_decomposer import (
     analyze_and_decompose_query,
@@ -191,6 +195,9 @@ def main():
     parser.add_argument("--testing_num", type=int, required=True, help="Number of test queries")
     parser.add_argument("--embedding_method", type=str, default="contriever",
                         help="Embedding method used during retrieval")
+    parser.add_argument("--table_file", type=str, default=None,
+                        help="Table JSONL used to resolve reference-format retrieval output "
+                             "(default: ../table2graph/data/{dataset}/{dataset}_table.jsonl)")
 
     # V1 new argument
     parser.add_argument("--use_decomposition", action="store_true",
@@ -244,10 +251,13 @@ def main():
         print(f"  python scripts/subgraph_retrieve_run.py")
         sys.exit(1)
 
-    with open(retrieve_table_file, "r") as f:
-        retrieve_instances = [json.loads(line) for line in f]
+    # Streamed record by record; reference-format output gets its tables from the table store.
+    table_file = args.table_file or f"../table2graph/data/{args.dataset}/{args.dataset}_table.jsonl"
+    with open(retrieve_table_file, "rb") as f:
+        num_instances = sum(1 for _ in f)
+    retrieve_instances = iter_retrieval_results(retrieve_table_file, table_file)
 
-    print(f"Loaded {len(retrieve_instances)} instances\n")
+    print(f"Found {num_instances} instances\n")
 
     # V1: Initialize decomposition logging
     decomposition_log = []
@@ -263,7 +273,7 @@ def main():
     print("Processing queries...")
     results = []
 
-    for idx, line in enumerate(tqdm(retrieve_instances, desc="Inference")):
+    for idx, line in enumerate(tqdm(retrieve_instances, total=num_instances, desc="Inference")):
         retrieve_instance = line
         query = retrieve_instance["query"]
         groundtruth = retrieve_instance["query_label"]
@@ -357,18 +367,18 @@ def main():
     # SAVE RESULTS
     # =================================================================
     print(f"\nSaving results to: {output_file}")
-    with open(output_file, "w") as f:
+    with open(output_file, "w", encoding="utf-8") as f:
         for result in results:
-            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            f.write(encode_line(result) + "\n")
 
     # V1: Save decomposition log
     if args.use_decomposition:
         decomposition_log_file = f"{output_dir}/decomposition_log_{args.testing_num}_{args.topk}.jsonl"
         print(f"Saving decomposition log to: {decomposition_log_file}")
 
-        with open(decomposition_log_file, "w") as f:
+        with open(decomposition_log_file, "w", encoding="utf-8") as f:
             for entry in decomposition_log:
-                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.write(encode_line(entry) + "\n")
 
         # Calculate final statistics
         if decomposition_stats["total_queries"] > 0:
@@ -16,6 +16,8 @@ import sys
 import os
 sys.path.append(os.path.abspath("utils"))
 from wtq_evaluate import *
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "table2graph"))
+from retrieval_modules.records import LLMOutput, iter_jsonl
 
 def str_normalize(user_input, recognition_types=None):
     """A string normalizer which recognize and normalize value based on recognizers_suite"""
@@ -577,16 +579,12 @@ if __name__ == "__main__":
         
     evaluator=Evaluator()
     
-    with open (file_path, "r") as f:
-        data = f.readlines()
-    
     outputs = []
     golds = []
     predictions = []
     queries = []
-    for line in data:
-        line = json.loads(line)
-        outputs.append(line["output"])
+    for line in iter_jsonl(file_path, LLMOutput):
+        outputs.append(line["output"] or "")
         golds.append(line["groundtruth"])
         queries.append(line["query"])
 
@@ -10,6 +10,16 @@ import json
 import pdb
 from tqdm import tqdm
 import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from retrieval_modules import EmbeddingProjector
+from retrieval_modules.corpus import CORPUS_FORMATS, read_columns, read_records, write_records
+from retrieval_modules.records import QueryRecord
+from retrieval_modules.ooc_kmeans import MemmapKMeans, write_memmap, iter_chunks, select_typical_indices_chunked
+from retrieval_modules.knn_graph import normalize_rows
+from retrieval_modules.routing_tree import RoutingTree, ROUTING_SCORES
 
 # -----------------------
 # Global objects
@@ -18,11 +28,21 @@ import argparse
 nlp = spacy.load("en_core_web_sm")
 # Load Sentence Transformer for semantic similarity
 model = SentenceTransformer('all-MiniLM-L6-v2')
+# Optional projection of semantic embeddings (set in main when --reduce_dim is given)
+projector = None
 
 # -----------------------
 # Utility functions
 # -----------------------
 
+def project_embeddings(embeddings):
+    """
+    Apply the fitted dimensionality reduction (if any) to semantic embeddings.
+    """
+    if projector is None:
+        return embeddings
+    return projector.transform(embeddings)
+
 def extract_structure_features(sentence):
     """
     Extract structural features from a sentence.
@@ -64,6 +84,11 @@ def cluster_sentences(sentences, n_clusters=5):
     
     print("Computing semantic embeddings...")
     semantic_embeddings = model.encode(sentences)
+    if projector is not None:
+        if not projector.is_fitted:
+            print(f"Fitting {projector.method} projection to {projector.n_components} dimensions...")
+            projector.fit(semantic_embeddings)
+        semantic_embeddings = project_embeddings(semantic_embeddings)
     
     features_dict = {
         "structure": struct_features,
@@ -86,6 +111,58 @@ def cluster_sentences(sentences, n_clusters=5):
 
     return kmeans_models, features_dict, sentence_indices
 
+def cluster_sentences_out_of_core(sentences, n_clusters=5, memmap_prefix="./memmap/features", chunk_size=4096):
+    """
+    Out-of-core variant of cluster_sentences for corpora whose feature matrices do not fit in memory.
+    Each feature matrix is computed chunk by chunk into a memory-mapped .npy file
+    ({memmap_prefix}_{metric}.npy), clustered with a chunked KMeans and its labels are
+    written next to it ({memmap_prefix}_{metric}_labels.npy).
+    Returns the same triple as cluster_sentences, with memmaps in place of in-memory arrays.
+    """
+    n_sentences = len(sentences)
+    print("Extracting structural features (out-of-core)...")
+    struct_features = write_memmap(
+        f"{memmap_prefix}_structure.npy", n_sentences,
+        iter_chunks(sentences, chunk_size, lambda chunk: np.array([extract_structure_features(sent) for sent in chunk])))
+    
+    print("Computing TF-IDF features (out-of-core)...")
+    tfidf_vectorizer = TfidfVectorizer().fit(sentences)
+    tfidf_features = write_memmap(
+        f"{memmap_prefix}_TFIDF.npy", n_sentences,
+        iter_chunks(sentences, chunk_size, lambda chunk: tfidf_vectorizer.transform(chunk).toarray()))
+    
+    print("Computing semantic embeddings (out-of-core)...")
+    def encode_chunk(chunk):
+        embeddings = model.encode(chunk)
+        if projector is not None and not projector.is_fitted:
+            # Fit on the first chunk so the full embedding matrix is never resident.
+            print(f"Fitting {projector.method} projection to {projector.n_components} dimensions on {len(chunk)} sentences...")
+            projector.fit(embeddings)
+        return project_embeddings(embeddings)
+    semantic_embeddings = write_memmap(
+        f"{memmap_prefix}_semantic.npy", n_sentences, iter_chunks(sentences, chunk_size, encode_chunk))
+    
+    features_dict = {
+        "structure": struct_features,
+        "TFIDF": tfidf_features,
+        "semantic": semantic_embeddings
+    }
+    
+    kmeans_models = {}
+    sentence_indices = {}
+    print(f"Clustering sentences into {n_clusters} clusters for each metric (chunk size {chunk_size})...")
+    for metric, features in features_dict.items():
+        kmeans = MemmapKMeans(n_clusters=n_clusters, chunk_size=chunk_size, random_state=42).fit(
+            features, labels_path=f"{memmap_prefix}_{metric}_labels.npy")
+        kmeans_models[metric] = kmeans
+        
+        cluster_dict = defaultdict(list)
+        for idx, cluster_id in enumerate(kmeans.labels_):
+            cluster_dict[int(cluster_id)].append(idx)
+        sentence_indices[metric] = cluster_dict
+
+    return kmeans_models, features_dict, sentence_indices
+
 def select_typical_sentences(sentences, features_dict, kmeans_models, k=3):
     """
     For each metric and for each cluster, select k sentences that are most
@@ -98,6 +175,14 @@ def select_typical_sentences(sentences, features_dict, kmeans_models, k=3):
         kmeans = kmeans_models[metric]
         cluster_centers = kmeans.cluster_centers_
         cluster_labels = kmeans.labels_
+        
+        if isinstance(kmeans, MemmapKMeans):
+            # Memory-mapped features: stream chunks instead of slicing whole clusters.
+            typical_indices = select_typical_indices_chunked(features, cluster_labels, cluster_centers,
+                                                             k, chunk_size=kmeans.chunk_size)
+            for cluster_id, top_k_indices in typical_indices.items():
+                typical_sentences[metric][cluster_id] = [sentences[i] for i in top_k_indices]
+            continue
     
         # For TFIDF, normalize for cosine similarity
         if metric == "TFIDF":
@@ -127,7 +212,7 @@ def compute_similarity(new_query, typical_embeddings):
     Returns a dict mapping metric -> dict of {cluster_id: average similarity score}.
     """
     scores = {}
-    sem_new = model.encode([new_query])
+    sem_new = project_embeddings(model.encode([new_query]))
     for metric, cluster_data in typical_embeddings.items():
         scores[metric] = {}
         for cluster_id, emb in cluster_data.items():
@@ -151,21 +236,46 @@ def find_best_cluster(new_query, typical_embeddings):
 # Pipeline functions
 # -----------------------
 
-def process_dataset(sentences, n_clusters=10, k=100):
+def process_dataset(sentences, n_clusters=10, k=100, memmap_prefix=None, chunk_size=4096):
     """
     Given a list of sentences, run clustering and select typical sentences.
+    If memmap_prefix is given, features are clustered out-of-core from memory-mapped files.
     Returns:
       kmeans_models, features_dict, sentence_indices, typical_embeddings.
     """
-    kmeans_models, features_dict, sentence_indices = cluster_sentences(sentences, n_clusters=n_clusters)
+    if memmap_prefix is not None:
+        kmeans_models, features_dict, sentence_indices = cluster_sentences_out_of_core(
+            sentences, n_clusters=n_clusters, memmap_prefix=memmap_prefix, chunk_size=chunk_size)
+    else:
+        kmeans_models, features_dict, sentence_indices = cluster_sentences(sentences, n_clusters=n_clusters)
     typical_sents = select_typical_sentences(sentences, features_dict, kmeans_models, k=k)
     typical_embeddings = {metric: {} for metric in typical_sents.keys()}
     print("Precomputing typical sentence embeddings...")
     for metric, clusters in typical_sents.items():
         for cluster_id, sent_list in clusters.items():
-            typical_embeddings[metric][cluster_id] = model.encode(sent_list)
+            typical_embeddings[metric][cluster_id] = project_embeddings(model.encode(sent_list))
     return kmeans_models, features_dict, sentence_indices, typical_embeddings
 
+def route_queries(query_data, source_ids, routing_tree, table_embeddings, beam_width=4, routing_score="centroid"):
+    """
+    Candidate tables for each query from the leaf beam of a routing tree over the
+    table schema embeddings, in place of the flat per-metric clusters.
+    Returns a dictionary mapping each query key to its clustered_tables (set) and size,
+    and the number of queries whose source table is among their candidates.
+    """
+    tables_shared = {}
+    total_correct = 0
+    for query in tqdm(query_data, desc="Routing queries"):
+        query_norm = normalize_rows(np.asarray(project_embeddings(model.encode([query["query"]])), dtype=np.float32))[0]
+        positions = routing_tree.route(query_norm, beam_width=beam_width, score=routing_score,
+                                       embeddings=table_embeddings)["positions"]
+        clustered_tables = set(positions.tolist())
+        if any(source_ids[i] == query["source_table_idx"] for i in clustered_tables):
+            total_correct += 1
+        query_key = f"{query['source_table_idx']}_{query['query']}"
+        tables_shared[query_key] = {"clustered_tables": clustered_tables, "size": len(clustered_tables)}
+    return tables_shared, total_correct
+
 def evaluate_queries(query_data, source_ids, kmeans_models, features_dict, sentence_indices, typical_embeddings):
     """
     Evaluate the given clustering setup on a list of testing queries.
@@ -253,6 +363,25 @@ if __name__ == "__main__":
     parser.add_argument("--dataset", type=str, required=True, help="Name of the dataset")
     parser.add_argument("--n_clusters", type=int, help="number of clusters")
     parser.add_argument("--k", type=int, help="number of typical sentences per cluster")
+    parser.add_argument("--reduce_dim", type=int, default=None,
+                        help="Project semantic embeddings to this dimension before clustering (default: no reduction)")
+    parser.add_argument("--reduce_method", type=str, default="pca", choices=["pca", "random"],
+                        help="Dimensionality reduction method used with --reduce_dim")
+    parser.add_argument("--out_of_core", action="store_true",
+                        help="Cluster from memory-mapped feature files in chunks instead of in-memory matrices")
+    parser.add_argument("--memmap_dir", type=str, default=None,
+                        help="Directory for memory-mapped features and labels (default: ./data/{dataset}/memmap_sentencetransformer/)")
+    parser.add_argument("--chunk_size", type=int, default=4096,
+                        help="Rows per chunk for --out_of_core feature extraction, KMeans and label assignment")
+    parser.add_argument("--corpus_format", type=str, default="jsonl", choices=CORPUS_FORMATS,
+                        help="Format of the clustered-tables output (arrow / parquet: columnar file next to the .jsonl path)")
+    parser.add_argument("--tree_branching", type=int, default=0,
+                        help="Write clustered_tables from the leaf beam of a hierarchical KMeans tree over the table "
+                             "schema embeddings, with this many children per split (0: union of the flat clusters)")
+    parser.add_argument("--leaf_size", type=int, default=256, help="Largest routing-tree leaf")
+    parser.add_argument("--beam_width", type=int, default=4, help="Routing-tree nodes kept per level")
+    parser.add_argument("--routing_score", type=str, default="centroid", choices=ROUTING_SCORES,
+                        help="Score tree nodes by centroid or by their typical tables")
     args = parser.parse_args()
     
     # --- File paths (adjust as needed) ---
@@ -267,49 +396,52 @@ if __name__ == "__main__":
     testing_query_file = f"./data/{dataset}/{dataset}_query.jsonl"
     output_file = f"./data/{dataset}/{dataset}_clustered_tables_sentencetransformer.jsonl"
     
+    projector_file = None
+    if args.reduce_dim is not None:
+        projector = EmbeddingProjector(args.reduce_dim, method=args.reduce_method)
+        projector_file = f"./data/{dataset}/{dataset}_projector_sentencetransformer_{args.reduce_method}{args.reduce_dim}.npz"
+    
+    memmap_dir = args.memmap_dir or f"./data/{dataset}/memmap_sentencetransformer/"
+    ts_memmap_prefix = os.path.join(memmap_dir, "table_schema") if args.out_of_core else None
+    eq_memmap_prefix = os.path.join(memmap_dir, "example_query") if args.out_of_core else None
+    
     print(f"Dataset: {dataset}")
     
     # --- Load table schema data ---
-    table_schema_data = []
-    with open(table_schema_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                table_schema_data.append(json.loads(line))
-    table_schema_sentences = [item["table_schema"] for item in table_schema_data]
-    table_schema_source_ids = [item["source_table_idx"] for item in table_schema_data]
+    # Reads {dataset}_schema.arrow / .parquet instead when data_process.py wrote one.
+    table_schema_data = read_columns(table_schema_file, ["table_schema", "source_table_idx"])
+    table_schema_sentences = table_schema_data["table_schema"]
+    table_schema_source_ids = table_schema_data["source_table_idx"]
     print(f"Loaded {len(table_schema_sentences)} table schema sentences.")
     
     # --- Load example query data ---
-    example_query_data = []
-    with open(example_query_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                example_query_data.append(json.loads(line))
-    example_query_sentences = [item["example_query"] for item in example_query_data]
-    example_query_source_ids = [item["source_table_idx"] for item in example_query_data]
+    example_query_data = read_columns(example_query_file, ["example_query", "source_table_idx"])
+    example_query_sentences = example_query_data["example_query"]
+    example_query_source_ids = example_query_data["source_table_idx"]
     print(f"Loaded {len(example_query_sentences)} example query sentences.")
     
     # --- Load testing queries ---
-    query_data = []
-    with open(testing_query_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                query_data.append(json.loads(line))
+    query_data = read_records(testing_query_file, record_type=QueryRecord)
     print(f"Loaded {len(query_data)} testing queries.")
         
     # --- Process and evaluate table schema data ---
     print("\n=== Processing Table Schema Data ===")
-    ts_kmeans, ts_features, ts_sentence_indices, ts_typical_embeddings = process_dataset(table_schema_sentences, n_clusters, k)
+    ts_kmeans, ts_features, ts_sentence_indices, ts_typical_embeddings = process_dataset(
+        table_schema_sentences, n_clusters, k, memmap_prefix=ts_memmap_prefix, chunk_size=args.chunk_size)
+    if projector is not None:
+        report = projector.report()
+        print(f"Projection: {report['method']} {report['input_dim']} -> {report['n_components']} dims, "
+              f"variance retained: {report['variance_retained']:.4f}")
+        projector.save(projector_file)
+        print(f"Saved projector to {projector_file}")
     print("Evaluating Table Schema Data...")
     ts_counters, ts_total_tables_shared = evaluate_queries(query_data, table_schema_source_ids, 
                                                            ts_kmeans, ts_features, ts_sentence_indices, ts_typical_embeddings)
     
     # --- Process and evaluate example query data ---
     print("\n=== Processing Example Query Data ===")
-    eq_kmeans, eq_features, eq_sentence_indices, eq_typical_embeddings = process_dataset(example_query_sentences, n_clusters, k)
+    eq_kmeans, eq_features, eq_sentence_indices, eq_typical_embeddings = process_dataset(
+        example_query_sentences, n_clusters, k, memmap_prefix=eq_memmap_prefix, chunk_size=args.chunk_size)
     print("Evaluating Example Query Data...")
     eq_counters, eq_total_tables_shared = evaluate_queries(query_data, example_query_source_ids, 
                                                            eq_kmeans, eq_features, eq_sentence_indices, eq_typical_embeddings)
@@ -343,6 +475,17 @@ if __name__ == "__main__":
         overall_tables_shared[query_key] = {"clustered_tables": union_tables, "size": len(union_tables)}
 
     
+    if args.tree_branching:
+        # The leaf beam replaces the flat cluster unions as each query's clustered_tables.
+        print(f"\n=== Routing Queries with a KMeans Tree (branching {args.tree_branching}, beam {args.beam_width}) ===")
+        table_embeddings = normalize_rows(np.asarray(ts_features["semantic"], dtype=np.float32))
+        routing_tree = RoutingTree.build(table_embeddings, branching=args.tree_branching, leaf_size=args.leaf_size,
+                                         chunk_size=args.chunk_size)
+        print(f"Routing tree: {routing_tree.stats()}")
+        overall_tables_shared, overall_total_correct = route_queries(
+            query_data, table_schema_source_ids, routing_tree, table_embeddings,
+            beam_width=args.beam_width, routing_score=args.routing_score)
+    
     # --- Print results ---
     print("\n==================== Evaluation Results ====================")
     print("\n--- Table Schema Data ---")
@@ -377,16 +520,18 @@ if __name__ == "__main__":
     avg_tables_per_query_overall = total_tables_overall / overall_total_correct if overall_total_correct > 0 else 0
     print("Average Clustered Tables per Query (Overall):", f"{avg_tables_per_query_overall:.2f}")
     
-    with open(output_file, "w") as out_f:
-        for query in query_data:  
-            query_key = f"{query['source_table_idx']}_{query['query']}"
-            if query_key in overall_tables_shared:
-                query_result = overall_tables_shared[query_key]
-                query_result["clustered_tables"] = list(query_result["clustered_tables"])
-                store_structure = {
-                    "source_table_idx": query["source_table_idx"],
-                    "query": query["query"],
-                    "label": query["label"],
-                    "clustered_tables": query_result
-                }
-                out_f.write(json.dumps(store_structure) + "\n")
+    clustered_records = []
+    for query in query_data:  
+        query_key = f"{query['source_table_idx']}_{query['query']}"
+        if query_key in overall_tables_shared:
+            query_result = overall_tables_shared[query_key]
+            query_result["clustered_tables"] = list(query_result["clustered_tables"])
+            store_structure = {
+                "source_table_idx": query["source_table_idx"],
+                "query": query["query"],
+                "label": query["label"],
+                "clustered_tables": query_result
+            }
+            clustered_records.append(store_structure)
+    output_file = write_records(output_file, clustered_records, args.corpus_format)
+    print(f"Saved {len(clustered_records)} clustered queries to {output_file}")
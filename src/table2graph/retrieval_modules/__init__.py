@@ -0,0 +1,86 @@
+"""
+Shared index and retrieval modules for T-RAG table2graph
+
+Submodules are imported on first attribute access, so importing one leaf
+module (e.g. retrieval_modules.records to read JSONL) does not pull in
+torch, scikit-learn or pyarrow through the rest of the package.
+"""
+
+import importlib
+
+# public name -> submodule defining it
+_EXPORTS = {
+    'EmbeddingProjector': 'dim_reduction',
+    'MemmapKMeans': 'ooc_kmeans',
+    'write_memmap': 'ooc_kmeans',
+    'select_typical_indices_chunked': 'ooc_kmeans',
+    'RoutingTree': 'routing_tree',
+    'KnnTableGraph': 'knn_graph',
+    'build_knn_graph': 'knn_graph',
+    'sparse_similarity_from_embeddings': 'sparse_graph',
+    'sparse_row_normalize': 'sparse_graph',
+    'scipy_to_torch_sparse': 'sparse_graph',
+    'run_pagerank_batched': 'pagerank',
+    'solve_pagerank': 'pagerank',
+    'PageRankResult': 'pagerank',
+    'PAGERANK_SOLVERS': 'pagerank',
+    'slice_similarity': 'shrinking',
+    'restrict_distribution': 'shrinking',
+    'shrink_and_rank': 'shrinking',
+    'NumpyBackend': 'backends',
+    'TorchBackend': 'backends',
+    'select_backend': 'backends',
+    'benchmark_backends': 'backends',
+    'RunJournal': 'run_journal',
+    'StageTimer': 'timing',
+    'TableRecord': 'records',
+    'ClusteredQuery': 'records',
+    'RetrievalResult': 'records',
+    'RecordDecodeError': 'records',
+    'encode_line': 'records',
+    'read_columns': 'corpus',
+    'iter_records': 'corpus',
+    'write_records': 'corpus',
+    'TableStore': 'table_store',
+    'iter_retrieval_results': 'table_store',
+    'BM25Index': 'lexical',
+    'prune_query_batch': 'lexical',
+    'CellIndex': 'cell_index',
+    'cell_candidates': 'cell_index',
+    'ColumnCatalog': 'column_stats',
+    'extract_constraints': 'column_stats',
+    'prune_by_constraints': 'column_stats',
+    'ScoreCutoff': 'cutoff',
+    'fit_calibration': 'cutoff',
+    'kept_count_report': 'cutoff',
+    'TableRetriever': 'retriever',
+    'MicroBatchScheduler': 'scheduler',
+    'iter_query_batches': 'batching',
+    'iter_keyed_query_batches': 'batching',
+    'group_by_candidate_set': 'batching',
+    'prefetch': 'batching',
+    'worker_pool': 'parallel',
+    'imap_ordered': 'parallel',
+    'share_knn_graph': 'parallel',
+    'attach_knn_graph': 'parallel',
+    'run_benchmark': 'benchmark',
+    'compare_reports': 'benchmark',
+    'StubEncoder': 'benchmark',
+}
+
+__all__ = list(_EXPORTS)
+
+__version__ = '1.0.0'
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,302 @@
+"""
+Graph Backends - NumPy/SciPy and torch implementations of the retrieval graph stage
+(similarity, transition matrix, personalization, PageRank, survivor slicing)
+
+Torch pays a per-op dispatch cost that dominates on CPU for graphs of a few
+hundred tables; select_backend() picks NumPy below a measured crossover size.
+Run `python -m retrieval_modules.backends` to re-measure it on a machine.
+"""
+
+import argparse
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg
+import torch
+import torch.nn.functional as F
+
+from .knn_graph import build_knn_graph, normalize_rows
+from .pagerank import PageRankResult, forward_push, solve_pagerank, PAGERANK_SOLVERS
+from .shrinking import slice_similarity, restrict_distribution
+from .sparse_graph import sparse_similarity_from_embeddings, sparse_row_normalize, scipy_to_torch_sparse
+
+# find_crossover over benchmark_backends' default sizes (50 to 12000 tables, dense power iteration): torch
+# was not faster at any size, so CPU candidate sets always use NumPy unless a crossover is measured and passed.
+DEFAULT_SIZES = (50, 100, 200, 500, 1000, 2000, 4096, 8192, 12000)
+DEFAULT_CROSSOVER: Optional[int] = None
+
+
+class TorchBackend:
+    """The original torch path; runs on any device."""
+
+    name = "torch"
+    solvers = tuple(PAGERANK_SOLVERS)
+
+    def __init__(self, device=None):
+        self.device = torch.device(device) if device is not None else torch.device("cpu")
+
+    def asarray(self, x) -> torch.Tensor:
+        if isinstance(x, torch.Tensor):
+            return x.to(self.device)
+        return torch.as_tensor(np.asarray(x), device=self.device)
+
+    def stack(self, rows: Sequence) -> torch.Tensor:
+        return torch.stack([self.asarray(row) for row in rows], dim=0)
+
+    def normalize_rows(self, R: torch.Tensor) -> torch.Tensor:
+        return F.normalize(R, p=2, dim=1)
+
+    def similarity(self, R_norm: torch.Tensor, similarity_threshold: float = 0.3,
+                   sparse: bool = False, top_k: int = 20) -> torch.Tensor:
+        if sparse:
+            return sparse_similarity_from_embeddings(R_norm, top_k=top_k, similarity_threshold=similarity_threshold)
+        S = R_norm @ R_norm.T
+        return torch.where(S < similarity_threshold, torch.zeros_like(S), S)
+
+    def from_scipy(self, S: sp.spmatrix, sparse: bool = False) -> torch.Tensor:
+        if sparse:
+            return scipy_to_torch_sparse(S, device=self.device)
+        return torch.from_numpy(S.toarray()).to(self.device)
+
+    def transition(self, S: torch.Tensor) -> torch.Tensor:
+        if S.is_sparse:
+            return sparse_row_normalize(S)
+        return S / (S.sum(dim=1, keepdim=True) + 1e-10)
+
+    def personalization(self, R_norm: torch.Tensor, query_repr) -> torch.Tensor:
+        query_repr = self.asarray(query_repr)
+        query_norm = F.normalize(query_repr.reshape(-1, R_norm.shape[1]), p=2, dim=1)
+        sims = (R_norm @ query_norm.T).clamp(min=0)
+        return restrict_distribution(sims)
+
+    def pagerank(self, P, personalization, solver: str = "power", alpha: float = 0.85, max_iter: int = 50,
+                 tol: float = 1e-6, **solver_kwargs) -> PageRankResult:
+        return solve_pagerank(P, personalization, solver=solver, alpha=alpha, max_iter=max_iter, tol=tol, **solver_kwargs)
+
+    def arange(self, n: int) -> torch.Tensor:
+        return torch.arange(n, device=self.device)
+
+    def slice(self, S: torch.Tensor, keep: torch.Tensor) -> torch.Tensor:
+        return slice_similarity(S, keep)
+
+    def restrict(self, v: torch.Tensor, keep: Optional[torch.Tensor] = None) -> torch.Tensor:
+        return restrict_distribution(v, keep)
+
+    def topk(self, v: torch.Tensor, k: int):
+        """(values, indices) of the k largest entries, best first."""
+        return torch.topk(v, k)
+
+    def tolist(self, x) -> List:
+        return x.cpu().tolist()
+
+
+class NumpyBackend:
+    """NumPy (dense) and SciPy CSR (sparse) implementation for CPU workers."""
+
+    name = "numpy"
+    solvers = ("power", "linear", "push")
+
+    def asarray(self, x) -> np.ndarray:
+        if isinstance(x, torch.Tensor):
+            x = x.detach().cpu().numpy()
+        return np.asarray(x, dtype=np.float32)
+
+    def stack(self, rows: Sequence) -> np.ndarray:
+        return np.stack([self.asarray(row) for row in rows], axis=0)
+
+    def normalize_rows(self, R: np.ndarray) -> np.ndarray:
+        return normalize_rows(R)
+
+    def similarity(self, R_norm: np.ndarray, similarity_threshold: float = 0.3,
+                   sparse: bool = False, top_k: int = 20):
+        if sparse:
+            return build_knn_graph(R_norm, k=top_k, similarity_threshold=similarity_threshold)
+        S = R_norm @ R_norm.T
+        S[S < similarity_threshold] = 0.0
+        return S
+
+    def from_scipy(self, S: sp.spmatrix, sparse: bool = False):
+        return S.tocsr() if sparse else S.toarray()
+
+    def transition(self, S):
+        row_sum = np.asarray(S.sum(axis=1)).reshape(-1, 1)
+        if sp.issparse(S):
+            return sp.diags(1.0 / (row_sum.ravel() + 1e-10)).astype(np.float32) @ S
+        return S / (row_sum + 1e-10)
+
+    def personalization(self, R_norm: np.ndarray, query_repr) -> np.ndarray:
+        query_norm = normalize_rows(self.asarray(query_repr).reshape(-1, R_norm.shape[1]))
+        return self.restrict(np.clip(R_norm @ query_norm.T, 0.0, None))
+
+    def pagerank(self, P, personalization, solver: str = "power", alpha: float = 0.85, max_iter: int = 50,
+                 tol: float = 1e-6, x0=None, push_epsilon: float = 1e-4, P_csr=None, check_every: int = 1,
+                 **_) -> PageRankResult:
+        """
+        Same contract as solve_pagerank: power iteration (per-column early
+        stop, like run_pagerank_batched), BiCGSTAB on the linear system (like
+        solve_linear, but per column through SciPy), or forward push.
+
+        check_every is accepted for call compatibility and ignored: a NumPy
+        convergence test costs no device sync, so every iteration is tested.
+        """
+        p = np.asarray(personalization, dtype=np.float32)
+        squeeze = p.ndim == 1
+        if squeeze:
+            p = p[:, None]
+        P_T = P.T.tocsr() if sp.issparse(P) else P.T
+
+        if solver == "power":
+            x = p.copy() if x0 is None else np.array(x0, dtype=np.float32).reshape(p.shape)
+            cols = np.arange(p.shape[1])
+            iterations = 0
+            for iterations in range(1, max_iter + 1):
+                x_new = (1 - alpha) * p[:, cols] + alpha * (P_T @ x[:, cols])
+                delta = np.abs(x_new - x[:, cols]).sum(axis=0)
+                x[:, cols] = x_new
+                cols = cols[delta >= tol]
+                if len(cols) == 0:
+                    break
+        elif solver == "linear":
+            # Iterative, not a direct solve: factorizing a dense candidate graph is O(N^3).
+            n = p.shape[0]
+            P_T64 = P_T.astype(np.float64)
+            A = scipy.sparse.linalg.LinearOperator((n, n), matvec=lambda v: v - alpha * (P_T64 @ v), dtype=np.float64)
+            start = p if x0 is None else np.asarray(x0, dtype=np.float32).reshape(p.shape)
+            x = np.empty_like(p)
+            iterations = 0
+            for column in range(p.shape[1]):
+                steps = []
+                # An L2 residual below tol / sqrt(n) keeps the L1 residual below tol.
+                solution, _ = scipy.sparse.linalg.bicgstab(A, (1 - alpha) * p[:, column].astype(np.float64),
+                                                           x0=start[:, column].astype(np.float64), rtol=0.0,
+                                                           atol=tol / np.sqrt(n), maxiter=max_iter,
+                                                           callback=steps.append)
+                x[:, column] = solution
+                iterations = max(iterations, len(steps))
+        elif solver == "push":
+            estimate, iterations = forward_push(P_csr if P_csr is not None else sp.csr_matrix(P), p, alpha=alpha, max_iter=max_iter,
+                                                tol=tol, push_epsilon=push_epsilon)
+            x = estimate.astype(np.float32)
+        else:
+            raise ValueError(f"Solver {solver} is not available in the numpy backend. Choose from {self.solvers}")
+
+        residual = x - alpha * (P_T @ x) - (1 - alpha) * p
+        return PageRankResult(x[:, 0] if squeeze else x, int(iterations), float(np.abs(residual).sum(axis=0).max()))
+
+    def arange(self, n: int) -> np.ndarray:
+        return np.arange(n)
+
+    def slice(self, S, keep: np.ndarray):
+        if sp.issparse(S):
+            return S.tocsr()[keep][:, keep]
+        return S[np.ix_(keep, keep)]
+
+    def restrict(self, v: np.ndarray, keep: Optional[np.ndarray] = None) -> np.ndarray:
+        if keep is not None:
+            v = v[keep]
+        totals = v.sum(axis=0, keepdims=True)
+        uniform = np.full_like(v, 1.0 / v.shape[0])
+        return np.where(totals > 0, v / np.maximum(totals, 1e-30), uniform)
+
+    def topk(self, v: np.ndarray, k: int):
+        """(values, indices) of the k largest entries, best first."""
+        top = np.argpartition(-v, k - 1)[:k] if k < len(v) else np.arange(len(v))
+        top = top[np.argsort(-v[top], kind="stable")]
+        return v[top], top
+
+    def tolist(self, x) -> List:
+        return np.asarray(x).tolist()
+
+
+BACKENDS = {"torch": TorchBackend, "numpy": NumpyBackend}
+
+
+def select_backend(n_nodes: int, device=None, solver: str = "power", preferred: str = "auto",
+                   crossover: Optional[int] = DEFAULT_CROSSOVER):
+    """
+    Pick the backend for one candidate graph.
+
+    Args:
+        n_nodes: Candidate-set size
+        device: Torch device the encoders run on; GPUs always use torch
+        solver: PageRank solver; falls back to torch if NumPy lacks it
+        preferred: "auto", "torch" or "numpy"
+        crossover: Size from which torch is used on CPU (None: never)
+
+    Returns:
+        A TorchBackend or NumpyBackend instance
+    """
+    if preferred not in ("auto", *BACKENDS):
+        raise ValueError(f"Unknown backend: {preferred}. Choose from {['auto', *BACKENDS]}")
+    on_gpu = device is not None and torch.device(device).type != "cpu"
+    below_crossover = crossover is None or n_nodes < crossover
+    if preferred == "numpy" or (preferred == "auto" and not on_gpu and below_crossover):
+        if solver in NumpyBackend.solvers:
+            return NumpyBackend()
+    return TorchBackend(device)
+
+
+def benchmark_backends(sizes: Sequence[int] = DEFAULT_SIZES, dim: int = 128,
+                       n_queries: int = 1, repeats: int = 5, sparse: bool = False,
+                       solver: str = "power", seed: int = 0) -> List[Dict]:
+    """
+    Time the full per-candidate-set graph stage (similarity, transition,
+    personalization, PageRank, top-k) for each backend on CPU.
+
+    Returns:
+        One dict per size with the median seconds per backend
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in sizes:
+        R = rng.normal(size=(n, dim)).astype(np.float32) + 0.5
+        queries = rng.normal(size=(n_queries, dim)).astype(np.float32) + 0.5
+        row = {"n_nodes": n}
+        for name, backend_cls in BACKENDS.items():
+            backend = backend_cls()
+            timings = []
+            for _ in range(repeats + 1):
+                start = time.perf_counter()
+                R_norm = backend.normalize_rows(backend.asarray(R))
+                P = backend.transition(backend.similarity(R_norm, 0.3, sparse=sparse))
+                p = backend.personalization(R_norm, queries)
+                scores = backend.pagerank(P, p, solver=solver).scores
+                backend.topk(scores[:, 0], min(10, n))
+                timings.append(time.perf_counter() - start)
+            row[name] = float(np.median(timings[1:]))  # first run is warm-up
+        results.append(row)
+    return results
+
+
+def find_crossover(results: List[Dict]) -> Optional[int]:
+    """Smallest benchmarked size from which torch is faster at every larger size."""
+    crossover = None
+    for row in reversed(results):
+        if row["torch"] < row["numpy"]:
+            crossover = row["n_nodes"]
+        else:
+            break
+    return crossover
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark the NumPy and torch graph backends on CPU.")
+    parser.add_argument("--sizes", type=str, default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--n_queries", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--sparse", action="store_true")
+    parser.add_argument("--solver", type=str, default="power", choices=list(NumpyBackend.solvers))
+    args = parser.parse_args()
+
+    results = benchmark_backends([int(n) for n in args.sizes.split(",")], dim=args.dim, n_queries=args.n_queries,
+                                 repeats=args.repeats, sparse=args.sparse, solver=args.solver)
+    print(f"{'nodes':>8} {'numpy (ms)':>12} {'torch (ms)':>12}")
+    for row in results:
+        print(f"{row['n_nodes']:>8} {row['numpy'] * 1e3:>12.2f} {row['torch'] * 1e3:>12.2f}")
+    crossover = find_crossover(results)
+    print(f"Crossover (torch faster from): {crossover}")
+    if crossover is not None:
+        print(f"Pass --backend_crossover {crossover} to the retrieval scripts to use torch from that size.")
@@ -0,0 +1,118 @@
+"""
+Query Batching - Read clustered queries in batches and group them by candidate set
+"""
+
+import hashlib
+import queue
+import threading
+from collections import OrderedDict
+from typing import Container, Dict, Iterable, Iterator, List, Tuple
+
+from .corpus import iter_records
+from .records import ClusteredQuery
+
+
+def query_key(line_no: int, clustered_data: Dict) -> str:
+    """Stable id of a clustered-query record: its line number plus a digest of the query text."""
+    digest = hashlib.sha1(clustered_data["query"].encode("utf-8")).hexdigest()[:12]
+    return f"{line_no}:{digest}"
+
+
+def iter_keyed_query_batches(clustered_table_file: str, testing_num: int, batch_size: int = 1,
+                             done_keys: Container[str] = ()) -> Iterator[Tuple[List[str], List[ClusteredQuery]]]:
+    """
+    Yield (keys, records) batches of up to batch_size clustered-query records,
+    in file order, stopping after testing_num lines. Records whose query_key
+    is in done_keys (already completed by a resumed run) are skipped.
+    """
+    keys, batch = [], []
+    for idx, clustered_data in enumerate(iter_records(clustered_table_file, record_type=ClusteredQuery), 1):
+        if idx > testing_num:
+            break
+        key = query_key(idx, clustered_data)
+        if key in done_keys:
+            continue
+        keys.append(key)
+        batch.append(clustered_data)
+        if len(batch) == batch_size:
+            yield keys, batch
+            keys, batch = [], []
+    if batch:
+        yield keys, batch
+
+
+def iter_query_batches(clustered_table_file: str, testing_num: int,
+                       batch_size: int = 1) -> Iterator[List[ClusteredQuery]]:
+    """
+    Yield lists of up to batch_size clustered-query records, in file order,
+    stopping after testing_num records.
+    """
+    for _, batch in iter_keyed_query_batches(clustered_table_file, testing_num, batch_size):
+        yield batch
+
+
+def prefetch(items: Iterable, depth: int) -> Iterator:
+    """
+    Iterate items with up to depth of them produced ahead by a background
+    thread, so reading and decoding the next batches overlaps with ranking
+    the current one. depth 0 iterates inline. An exception in the producer
+    is raised in the consumer; leaving the loop early stops the producer.
+    """
+    if depth <= 0:
+        yield from items
+        return
+    buffer: "queue.Queue[Tuple[bool, object]]" = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((True, item)):
+                    return
+        except BaseException as error:
+            put((False, error))
+            return
+        put((False, None))
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            is_item, value = buffer.get()
+            if is_item:
+                yield value
+            elif value is None:
+                return
+            else:
+                raise value
+    finally:
+        stop.set()
+        thread.join()
+
+
+def candidate_key(clustered_data: Dict) -> frozenset:
+    """Queries with the same key share one candidate set (and one similarity graph)."""
+    return frozenset(clustered_data["clustered_tables"]["clustered_tables"])
+
+
+def group_by_candidate_set(query_batch: List[Dict]) -> List[List[int]]:
+    """
+    Group batch positions by candidate set, preserving first-seen order.
+
+    Returns:
+        A list of groups, each a list of positions into query_batch
+    """
+    groups: "OrderedDict[frozenset, List[int]]" = OrderedDict()
+    for pos, clustered_data in enumerate(query_batch):
+        groups.setdefault(candidate_key(clustered_data), []).append(pos)
+    return list(groups.values())
+
@@ -0,0 +1,379 @@
+"""
+Retrieval Benchmark - Offline end-to-end timing on synthetic MultiTableQA-shaped corpora
+Generates table / query / schema files with the real field layout, encodes
+them with a deterministic stub encoder and times corpus loading, clustering,
+candidate generation and subgraph retrieval. Reports are JSON and can be
+compared against a saved baseline to catch regressions.
+
+Run from src/table2graph:
+    python -m retrieval_modules.benchmark --n_tables 10k --report bench.json
+    python -m retrieval_modules.benchmark --n_tables 10k --baseline bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .corpus import read_columns, write_records
+from .knn_graph import KnnTableGraph
+from .lexical import BM25Index, recall_curve
+from .retriever import TableRetriever
+from .table_store import TableStore
+
+REPORT_VERSION = 1
+
+# Metric path -> direction: "lower" (seconds, latency) or "higher" (throughput, recall).
+COMPARED_METRICS = {
+    "stages.load_s": "lower",
+    "stages.encode_tables_s": "lower",
+    "stages.knn_graph_s": "lower",
+    "stages.clustering_s": "lower",
+    "stages.candidates_s": "lower",
+    "stages.retrieval_s": "lower",
+    "retrieval.qps": "higher",
+    "retrieval.latency_ms.p50": "lower",
+    "retrieval.latency_ms.p99": "lower",
+    "quality.recall": "higher",
+    "quality.candidate_recall": "higher",
+}
+
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "si", "de", "po", "an", "el", "or", "us", "ix", "ber"]
+# Template words the stub encoder skips, as a real encoder largely ignores them.
+_STOP_WORDS = frozenset(["caption", "headers", "which", "has", "the", "highest", "what", "is", "of"])
+_HEADER_WORDS = ["year", "name", "team", "city", "country", "score", "rank", "total", "date", "party",
+                 "album", "election", "population", "revenue", "votes", "points", "award", "title"]
+
+
+def parse_count(value: str) -> int:
+    """'57k' -> 57000, '1m' -> 1000000, '250' -> 250."""
+    value = value.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    return int(float(value[:-1] if scale > 1 else value) * scale)
+
+
+def _vocabulary(size: int, rng: random.Random) -> List[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(_SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+def generate_corpus(out_dir: str, dataset: str, n_tables: int, n_queries: int, tables_per_source: int = 3,
+                    n_rows: int = 8, seed: int = 0) -> Dict[str, str]:
+    """
+    Write a synthetic corpus in the layout utils/data_process.py produces:
+    {dataset}_table.jsonl, _query.jsonl, _schema.jsonl, _example_query.jsonl
+    and _table_match.json. Each source table is split into tables_per_source
+    sub-tables sharing its topic words; queries are phrased from a source's
+    topic, so its sub-tables are the ground truth.
+
+    Returns:
+        file kind -> path
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    n_sources = max(1, -(-n_tables // tables_per_source))
+    vocabulary = _vocabulary(max(500, n_sources), rng)
+    topics = [rng.sample(vocabulary, 3) for _ in range(n_sources)]
+
+    tables, schemas, example_queries, table_match = [], [], [], {}
+    for table_idx in range(n_tables):
+        source_table_idx = table_idx // tables_per_source
+        topic = topics[source_table_idx]
+        header = rng.sample(topic, 2) + rng.sample(_HEADER_WORDS, 2)
+        rows = [[str(rng.randint(1900, 2024)), rng.choice(vocabulary), f"{rng.random():.2f}",
+                 str(rng.randint(0, 9999))] for _ in range(n_rows)]
+        caption = f"{topic[0]} {topic[1]} {rng.choice(_HEADER_WORDS)}"
+        example_query = [f"what is the {rng.choice(header)} of {topic[0]}"]
+        tables.append({"split": "test", "source_table_idx": source_table_idx, "table_idx": table_idx,
+                       "caption": caption, "table": {"header": header, "rows": rows},
+                       "example_query": example_query})
+        schemas.append({"table_schema": f"Caption: {caption}; Headers: {header};",
+                        "source_table_idx": source_table_idx, "table_idx": table_idx})
+        example_queries.append({"example_query": example_query[0], "source_table_idx": source_table_idx,
+                                "table_idx": table_idx})
+        table_match.setdefault(source_table_idx, []).append(table_idx)
+
+    queries = []
+    for _ in range(n_queries):
+        source_table_idx = rng.randrange(n_sources)
+        topic = topics[source_table_idx]
+        queries.append({"query": f"which {topic[0]} {topic[1]} has the highest {topic[2]} {rng.choice(_HEADER_WORDS)}",
+                        "source_table_idx": source_table_idx, "label": "yes"})
+
+    prefix = os.path.join(out_dir, dataset)
+    files = {kind: write_records(f"{prefix}_{kind}.jsonl", records)
+             for kind, records in [("table", tables), ("query", queries), ("schema", schemas),
+                                   ("example_query", example_queries)]}
+    files["table_match"] = f"{prefix}_table_match.json"
+    with open(files["table_match"], "w", encoding="utf-8") as f:
+        json.dump(table_match, f)
+    return files
+
+
+class StubEncoder:
+    """
+    Deterministic bag-of-words encoder: every token maps to a fixed random
+    vector (seeded by its CRC32) and a text is the sum of its tokens. Texts
+    sharing topic words are similar, so retrieval quality is meaningful, and
+    no model download is needed.
+    """
+
+    def __init__(self, dim: int = 64, seed: int = 0):
+        self.dim = dim
+        self.seed = seed
+        self._vectors: Dict[str, np.ndarray] = {}
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._vectors.get(token)
+        if vector is None:
+            rng = np.random.default_rng([self.seed, zlib.crc32(token.encode("utf-8"))])
+            vector = self._vectors[token] = rng.standard_normal(self.dim).astype(np.float32)
+        return vector
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in text.lower().replace(";", " ").replace(":", " ").replace(",", " ").split():
+                token = token.strip("[]'\"")
+                if token not in _STOP_WORDS:
+                    embeddings[i] += self._token_vector(token)
+        return embeddings
+
+
+def _percentiles(values: Sequence[float]) -> Dict:
+    p50, p90, p99 = np.percentile(np.asarray(values, dtype=np.float64), [50, 90, 99])
+    return {"mean": float(np.mean(values)), "p50": float(p50), "p90": float(p90), "p99": float(p99)}
+
+
+def run_benchmark(out_dir: str, n_tables: int = 1000, n_queries: int = 200, tables_per_source: int = 3,
+                  dim: int = 64, n_clusters: int = 32, nprobe: int = 4, knn_k: int = 20,
+                  filter_topks: Sequence[int] = (50, 10), query_batch_size: int = 16, backend: str = "numpy",
+                  tree_branching: int = 0, leaf_size: int = 256, beam_width: int = 4,
+                  bm25_top_ms: Sequence[int] = (25, 50, 100, 200), repeats: int = 1, seed: int = 0,
+                  regenerate: bool = False) -> Dict:
+    """
+    Generate (or reuse) a synthetic corpus and time the retrieval pipeline.
+
+    Stages: load (table index + schema columns), encode_tables (stub
+    encoder), knn_graph, clustering (flat KMeans router, or the routing
+    tree when tree_branching is set), candidates (query
+    encoding + routing) and retrieval (TableRetriever.retrieve_batch, best
+    of repeats). bm25_index times building the BM25 schema index, whose
+    pruning recall over the routed candidate sets is reported for each of
+    bm25_top_ms. The candidate sets are also written as
+    {dataset}_clustered_tables_stub.jsonl so the batch retrieval scripts can
+    run on the same corpus.
+
+    Returns:
+        The report dict
+    """
+    dataset = f"synth{n_tables}"
+    data_dir = os.path.join(out_dir, dataset)
+    prefix = os.path.join(data_dir, dataset)
+    stages = {}
+
+    start = time.perf_counter()
+    if regenerate or not os.path.exists(f"{prefix}_table_match.json"):
+        generate_corpus(data_dir, dataset, n_tables, n_queries, tables_per_source=tables_per_source, seed=seed)
+    stages["generate_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index_file = f"{prefix}_table.jsonl.idx.npz"
+    if os.path.exists(index_file):
+        os.remove(index_file)  # time a cold index build
+    table_store = TableStore(f"{prefix}_table.jsonl")
+    schemas = read_columns(f"{prefix}_schema.jsonl", ["table_schema", "table_idx"])
+    queries = read_columns(f"{prefix}_query.jsonl", ["query", "source_table_idx"])
+    with open(f"{prefix}_table_match.json", "r", encoding="utf-8") as f:
+        table_match = json.load(f)
+    stages["load_s"] = time.perf_counter() - start
+
+    encoder = StubEncoder(dim=dim, seed=seed)
+    start = time.perf_counter()
+    table_embeddings = encoder(schemas["table_schema"])
+    stages["encode_tables_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    knn_graph = KnnTableGraph.build(schemas["table_idx"], table_embeddings, k=knn_k, similarity_threshold=0.3)
+    stages["knn_graph_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    retriever = TableRetriever(knn_graph, encoder, filter_topks=filter_topks, n_clusters=n_clusters, nprobe=nprobe,
+                               backend=backend, tables=table_store, tree_branching=tree_branching,
+                               leaf_size=leaf_size, beam_width=beam_width)
+    stages["clustering_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    query_norms = retriever.encode(queries["query"])
+    candidate_sets = [retriever.candidates(query_norm) for query_norm in query_norms]
+    stages["candidates_s"] = time.perf_counter() - start
+
+    ground_truths = [set(table_match[str(source)]) for source in queries["source_table_idx"]]
+    candidate_recall = [len(truth & {knn_graph.table_ids[i] for i in positions}) / len(truth)
+                        for truth, positions in zip(ground_truths, candidate_sets)]
+    write_records(f"{prefix}_clustered_tables_stub.jsonl", [
+        {"source_table_idx": source, "query": query, "label": "yes",
+         "clustered_tables": {"clustered_tables": [knn_graph.table_ids[i] for i in positions],
+                              "size": len(positions)}}
+        for query, source, positions in zip(queries["query"], queries["source_table_idx"], candidate_sets)])
+
+    lexical = None
+    if bm25_top_ms:
+        start = time.perf_counter()
+        lexical_index = BM25Index.build(schemas["table_schema"], schemas["table_idx"])
+        stages["bm25_index_s"] = time.perf_counter() - start
+        lexical = recall_curve(lexical_index, queries["query"],
+                               [[knn_graph.table_ids[i] for i in positions] for positions in candidate_sets],
+                               [table_match[str(source)] for source in queries["source_table_idx"]], bm25_top_ms)
+
+    retriever.warm_up(queries["query"][:1])
+    best = None
+    for _ in range(repeats):
+        latencies, results = [], []
+        start = time.perf_counter()
+        for batch_start in range(0, len(queries["query"]), query_batch_size):
+            batch = queries["query"][batch_start:batch_start + query_batch_size]
+            batch_start_time = time.perf_counter()
+            results.extend(retriever.retrieve_batch(batch))
+            latencies.append((time.perf_counter() - batch_start_time) * 1e3)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, latencies, results)
+    elapsed, latencies, results = best
+    stages["retrieval_s"] = elapsed
+
+    recall = [len(truth & set(result["table_idx"])) / len(truth) for truth, result in zip(ground_truths, results)]
+    return {
+        "version": REPORT_VERSION,
+        "config": {"dataset": dataset, "n_tables": n_tables, "n_queries": len(results),
+                   "tables_per_source": tables_per_source, "dim": dim, "n_clusters": n_clusters, "nprobe": nprobe,
+                   "knn_k": knn_k, "filter_topks": list(filter_topks), "query_batch_size": query_batch_size,
+                   "backend": backend, "tree_branching": tree_branching, "leaf_size": leaf_size,
+                   "beam_width": beam_width, "bm25_top_ms": list(bm25_top_ms), "repeats": repeats, "seed": seed},
+        "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                        "machine": platform.machine(), "cpu_count": os.cpu_count()},
+        "stages": stages,
+        "retrieval": {"qps": len(results) / elapsed, "latency_ms": _percentiles(latencies),
+                      "candidate_sizes": _percentiles([len(positions) for positions in candidate_sets])},
+        "quality": {"recall": float(np.mean(recall)), "candidate_recall": float(np.mean(candidate_recall))},
+        "lexical": lexical,
+        "index": knn_graph.stats(),
+        "routing_tree": retriever.routing_tree.stats() if retriever.routing_tree is not None else None,
+    }
+
+
+def _lookup(report: Dict, path: str) -> Optional[float]:
+    value = report
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare_reports(report: Dict, baseline: Dict, tolerance: float = 0.25, noise_floor_s: float = 0.01,
+                    quality_tolerance: float = 0.01) -> List[Dict]:
+    """
+    Compare a report with a baseline, metric by metric.
+
+    A timing metric regresses when it is more than tolerance (relative)
+    worse than the baseline; timings below noise_floor_s in both reports are
+    not judged. Quality metrics regress when they drop by more than
+    quality_tolerance (absolute).
+
+    Returns:
+        One row per metric present in both: metric, baseline, current, ratio (current / baseline), regression
+    """
+    if report.get("config") != baseline.get("config"):
+        print("Warning: benchmark configurations differ; comparing anyway.")
+    rows = []
+    for metric, direction in COMPARED_METRICS.items():
+        current, previous = _lookup(report, metric), _lookup(baseline, metric)
+        if current is None or previous is None:
+            continue
+        ratio = current / previous if previous else float("inf")
+        if metric.startswith("quality."):
+            regression = previous - current > quality_tolerance
+        elif metric.endswith("_s") and max(current, previous) < noise_floor_s:
+            regression = False
+        elif direction == "lower":
+            regression = ratio > 1 + tolerance
+        else:
+            regression = ratio < 1 / (1 + tolerance)
+        rows.append({"metric": metric, "baseline": previous, "current": current, "ratio": ratio,
+                     "regression": regression})
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark on a synthetic corpus with a stub encoder.")
+    parser.add_argument("--out_dir", type=str, default="./data/benchmark",
+                        help="Corpora are generated under out_dir/synth{n_tables}/ and reused on later runs.")
+    parser.add_argument("--n_tables", type=str, default="1k", help="Corpus size, e.g. 1k, 10k, 57k")
+    parser.add_argument("--n_queries", type=int, default=200)
+    parser.add_argument("--tables_per_source", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=64, help="Stub embedding dimension")
+    parser.add_argument("--n_clusters", type=int, default=32, help="KMeans router clusters")
+    parser.add_argument("--nprobe", type=int, default=4)
+    parser.add_argument("--knn_k", type=int, default=20)
+    parser.add_argument("--filter_topks", type=str, default="50,10")
+    parser.add_argument("--query_batch_size", type=int, default=16)
+    parser.add_argument("--backend", type=str, default="numpy", choices=["auto", "torch", "numpy"])
+    parser.add_argument("--tree_branching", type=int, default=0,
+                        help="Route with a hierarchical KMeans tree instead of --n_clusters (0: flat routing)")
+    parser.add_argument("--leaf_size", type=int, default=256)
+    parser.add_argument("--beam_width", type=int, default=4)
+    parser.add_argument("--bm25_top_ms", type=str, default="25,50,100,200",
+                        help="BM25 pruning depths to report candidate recall for ('' to skip)")
+    parser.add_argument("--repeats", type=int, default=1, help="Retrieval passes; the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--regenerate", action="store_true", help="Regenerate the corpus even if it exists")
+    parser.add_argument("--report", type=str, default=None, help="Write the JSON report here")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Compare with this saved report; exits with status 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.out_dir, n_tables=parse_count(args.n_tables), n_queries=args.n_queries,
+                           tables_per_source=args.tables_per_source, dim=args.dim, n_clusters=args.n_clusters,
+                           nprobe=args.nprobe, knn_k=args.knn_k,
+                           filter_topks=[int(k) for k in args.filter_topks.split(",")],
+                           query_batch_size=args.query_batch_size, backend=args.backend,
+                           tree_branching=args.tree_branching, leaf_size=args.leaf_size,
+                           beam_width=args.beam_width,
+                           bm25_top_ms=[int(m) for m in args.bm25_top_ms.split(",") if m],
+                           repeats=args.repeats,
+                           seed=args.seed, regenerate=args.regenerate)
+    for stage, seconds in report["stages"].items():
+        print(f"{stage:>16}: {seconds:8.3f}s")
+    latency = report["retrieval"]["latency_ms"]
+    print(f"Retrieval: {report['retrieval']['qps']:.1f} queries/s, batch latency p50 {latency['p50']:.2f} ms, "
+          f"p99 {latency['p99']:.2f} ms; recall {report['quality']['recall']:.3f}, "
+          f"candidate recall {report['quality']['candidate_recall']:.3f}")
+    if report["lexical"] is not None:
+        print(f"BM25 pruning of the routed candidates (unpruned recall {report['lexical']['unpruned']:.3f}): " +
+              ", ".join(f"top {point['top_m']} -> {point['recall']:.3f}" for point in report["lexical"]["curve"]))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved report to {args.report}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare_reports(report, baseline, tolerance=args.tolerance)
+        print(f"\n{'metric':>28} {'baseline':>12} {'current':>12} {'ratio':>7}")
+        for row in rows:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['metric']:>28} {row['baseline']:>12.4f} {row['current']:>12.4f} {row['ratio']:>7.2f}{flag}")
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
@@ -0,0 +1,261 @@
+"""
+Cell Index - Inverted index from normalized cell values to tables
+Every distinct cell phrase of table.rows (lowercased, punctuation folded,
+at most max_phrase_tokens words) maps to the tables containing it. Posting
+lists are sorted table rows, delta-encoded as LEB128 varints in one byte
+array. A query is matched by looking up its word n-grams, which gives
+high-precision candidates for entity-style questions
+
+Build and measure (run from src/table2graph):
+    python -m retrieval_modules.cell_index --dataset MultiTableQA --cluster_embedding_method contriever
+"""
+
+import argparse
+import copy
+import heapq
+import json
+import math
+import re
+import time
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from .corpus import iter_records
+from .records import ClusteredQuery, ClusteredTables, TableRecord
+
+CELL_MODES = ("add", "restrict")
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_cell(value) -> str:
+    """Lowercase, fold punctuation and whitespace runs to single spaces."""
+    return _NON_WORD.sub(" ", str(value).lower()).strip()
+
+
+def encode_postings(rows: np.ndarray) -> bytes:
+    """Delta + LEB128 varint encoding of a sorted array of non-negative ints."""
+    deltas = np.diff(np.asarray(rows, dtype=np.int64), prepend=0)
+    out = bytearray()
+    for delta in deltas.tolist():
+        while delta >= 0x80:
+            out.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_postings(data: np.ndarray) -> np.ndarray:
+    """Inverse of encode_postings for a uint8 slice, vectorized."""
+    if len(data) == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = data < 0x80
+    value_id = np.concatenate([[0], np.cumsum(ends[:-1])])
+    starts = np.flatnonzero(np.concatenate([[True], ends[:-1]]))
+    shift = 7 * (np.arange(len(data)) - starts[value_id])
+    deltas = np.zeros(int(ends.sum()), dtype=np.int64)
+    np.add.at(deltas, value_id, (data & 0x7F).astype(np.int64) << shift)
+    return np.cumsum(deltas)
+
+
+class CellIndex:
+    """
+    Normalized cell phrase -> sorted table rows (positions into table_ids).
+
+    Phrases are kept in a sorted array with a dict for lookups; postings are
+    byte ranges of one uint8 array (posting_ptr) with their lengths (df).
+    """
+
+    def __init__(self, table_ids: Sequence, phrases: Sequence[str], posting_ptr: np.ndarray, postings: np.ndarray,
+                 df: np.ndarray, max_phrase_tokens: int = 6):
+        self.table_ids = list(table_ids)
+        self.phrases = list(phrases)
+        self.phrase_id: Dict[str, int] = {phrase: i for i, phrase in enumerate(self.phrases)}
+        self.posting_ptr = posting_ptr
+        self.postings = postings
+        self.df = df
+        self.max_phrase_tokens = max_phrase_tokens
+        # Lookups decode the short posting lists in pure Python, which beats numpy's per-call overhead.
+        self._posting_bytes = np.asarray(postings, dtype=np.uint8).tobytes()
+        self._posting_ptr = posting_ptr.tolist()
+        self._df = df.tolist()
+
+    @classmethod
+    def build(cls, tables: Iterable[Tuple], max_phrase_tokens: int = 6, min_chars: int = 2) -> "CellIndex":
+        """
+        Args:
+            tables: (table_idx, table record) pairs, e.g. TableStore.items()
+            max_phrase_tokens: Longer cells (sentences, lists) are not indexed
+            min_chars: Shorter cells (single letters, "-") are not indexed
+        """
+        table_ids, rows_by_phrase = [], {}
+        for row, (table_idx, table) in enumerate(tables):
+            table_ids.append(table_idx)
+            phrases = set()
+            for cells in table["table"]["rows"]:
+                for cell in cells:
+                    phrase = normalize_cell(cell)
+                    if len(phrase) >= min_chars and phrase.count(" ") < max_phrase_tokens:
+                        phrases.add(phrase)
+            for phrase in phrases:
+                rows_by_phrase.setdefault(phrase, []).append(row)
+        phrases = sorted(rows_by_phrase)
+        encoded = [encode_postings(rows_by_phrase[phrase]) for phrase in phrases]
+        posting_ptr = np.zeros(len(phrases) + 1, dtype=np.int64)
+        posting_ptr[1:] = np.cumsum([len(data) for data in encoded])
+        postings = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        df = np.array([len(rows_by_phrase[phrase]) for phrase in phrases], dtype=np.int32)
+        return cls(table_ids, phrases, posting_ptr, postings, df, max_phrase_tokens)
+
+    @classmethod
+    def from_table_file(cls, table_file: str, **kwargs) -> "CellIndex":
+        """Index the rows of {dataset}_table.jsonl (or its columnar sibling) in one streaming pass."""
+        tables = ((table.table_idx, table) for table in iter_records(table_file, record_type=TableRecord)
+                  if "table" in table)
+        return cls.build(tables, **kwargs)
+
+    def rows(self, phrase: str) -> np.ndarray:
+        """Decoded posting list of one normalized phrase (empty if unknown)."""
+        phrase_id = self.phrase_id.get(phrase)
+        if phrase_id is None:
+            return np.empty(0, dtype=np.int64)
+        return decode_postings(self.postings[self.posting_ptr[phrase_id]:self.posting_ptr[phrase_id + 1]])
+
+    def lookup(self, query: str, top_e: int = 20, max_df: int = 100, min_tokens: int = 1) -> List[Tuple]:
+        """
+        Tables whose cells appear verbatim in the query.
+
+        Every query n-gram of min_tokens..max_phrase_tokens words is looked
+        up. Phrases in more than max_df tables (years, "yes", small numbers)
+        are ignored as unselective. A table scores the sum over its matched
+        phrases of n_words * log(N / df), so long, rare matches rank first.
+
+        Returns:
+            Up to top_e (table_idx, score) pairs, best first
+        """
+        words = normalize_cell(query).split()
+        n_tables = len(self.table_ids)
+        scores: Dict[int, float] = {}
+        for n in range(min_tokens, min(self.max_phrase_tokens, len(words)) + 1):
+            for start in range(len(words) - n + 1):
+                phrase_id = self.phrase_id.get(" ".join(words[start:start + n]))
+                if phrase_id is None or self._df[phrase_id] > max_df:
+                    continue
+                weight = n * math.log(n_tables / self._df[phrase_id])
+                row = value = shift = 0
+                for byte in self._posting_bytes[self._posting_ptr[phrase_id]:self._posting_ptr[phrase_id + 1]]:
+                    value |= (byte & 0x7F) << shift
+                    if byte < 0x80:
+                        row += value
+                        scores[row] = scores.get(row, 0.0) + weight
+                        value = shift = 0
+                    else:
+                        shift += 7
+        ranked = heapq.nsmallest(top_e, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(self.table_ids[row], score) for row, score in ranked]
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            table_ids=np.array(self.table_ids),
+            phrases=np.array(self.phrases),
+            posting_ptr=self.posting_ptr,
+            postings=self.postings,
+            df=self.df,
+            max_phrase_tokens=np.array(self.max_phrase_tokens),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "CellIndex":
+        data = np.load(path)
+        return cls(data["table_ids"].tolist(), data["phrases"].tolist(), data["posting_ptr"], data["postings"],
+                   data["df"], int(data["max_phrase_tokens"]))
+
+    def stats(self) -> Dict:
+        return {
+            "n_tables": len(self.table_ids),
+            "n_phrases": len(self.phrases),
+            "n_postings": int(self.df.sum()),
+            "posting_bytes": int(len(self.postings)),
+            "bytes_per_posting": float(len(self.postings) / max(int(self.df.sum()), 1)),
+        }
+
+
+def cell_candidates(query_batch: List, cell_index: CellIndex, top_e: int, mode: str = "add",
+                    max_df: int = 100) -> List:
+    """
+    Copies of clustered-query records with their candidate sets changed by cell matches.
+
+    mode "add" appends the query's matched tables that are not yet
+    candidates; "restrict" replaces the candidate set of a query with
+    matches by those tables. Queries without a match are left as they are.
+    """
+    if mode not in CELL_MODES:
+        raise ValueError(f"Unknown cell candidate mode {mode}. Choose from {CELL_MODES}")
+    updated_batch = []
+    for clustered_data in query_batch:
+        matches = [table_idx for table_idx, _ in cell_index.lookup(clustered_data["query"], top_e, max_df)]
+        if not matches:
+            updated_batch.append(clustered_data)
+            continue
+        candidates = list(clustered_data["clustered_tables"]["clustered_tables"])
+        if mode == "add":
+            present = set(candidates)
+            candidates += [table_idx for table_idx in matches if table_idx not in present]
+        else:
+            candidates = matches
+        updated = copy.copy(clustered_data)
+        updated["clustered_tables"] = ClusteredTables(clustered_tables=candidates, size=len(candidates))
+        updated_batch.append(updated)
+    return updated_batch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the cell-value index and measure its entity matches.")
+    parser.add_argument("--dataset", type=str, required=True, help="Name of the dataset")
+    parser.add_argument("--cluster_embedding_method", type=str, default="contriever",
+                        help="Which {dataset}_clustered_tables_{method}.jsonl to compare against")
+    parser.add_argument("--cell_index_file", type=str, default=None,
+                        help="Default ./data/{dataset}/{dataset}_cell_index.npz (built if missing)")
+    parser.add_argument("--cell_top_e", type=int, default=20)
+    parser.add_argument("--cell_max_df", type=int, default=100)
+    parser.add_argument("--testing_num", type=int, default=None, help="Only the first N clustered queries")
+    args = parser.parse_args()
+
+    data_dir = f"./data/{args.dataset}/"
+    index_file = args.cell_index_file or f"{data_dir}{args.dataset}_cell_index.npz"
+    try:
+        cell_index = CellIndex.load(index_file)
+    except FileNotFoundError:
+        start = time.perf_counter()
+        cell_index = CellIndex.from_table_file(f"{data_dir}{args.dataset}_table.jsonl")
+        cell_index.save(index_file)
+        print(f"Built in {time.perf_counter() - start:.1f}s, saved to {index_file}")
+    print(f"Cell index: {cell_index.stats()}")
+
+    with open(f"{data_dir}{args.dataset}_table_match.json", "r", encoding="utf-8") as f:
+        table_match = json.load(f)
+    clustered_file = f"{data_dir}{args.dataset}_clustered_tables_{args.cluster_embedding_method}.jsonl"
+    n_queries = n_matched = n_hits = n_matches = n_new = 0
+    lookup_seconds = []
+    for clustered_data in iter_records(clustered_file, record_type=ClusteredQuery):
+        if args.testing_num is not None and n_queries >= args.testing_num:
+            break
+        n_queries += 1
+        start = time.perf_counter()
+        matches = [t for t, _ in cell_index.lookup(clustered_data.query, args.cell_top_e, args.cell_max_df)]
+        lookup_seconds.append(time.perf_counter() - start)
+        if not matches:
+            continue
+        truth = set(table_match[str(clustered_data.source_table_idx)])
+        n_matched += 1
+        n_matches += len(matches)
+        n_hits += len(truth & set(matches))
+        n_new += len((truth & set(matches)) - set(clustered_data.clustered_tables.clustered_tables))
+
+    print(f"{n_queries} queries, {n_matched} with cell matches; match precision "
+          f"{n_hits / max(n_matches, 1):.4f}, ground-truth tables found outside the clustered set: {n_new}")
+    if lookup_seconds:
+        p50, p99 = np.percentile(np.array(lookup_seconds) * 1e6, [50, 99])
+        print(f"Lookup latency: p50 {p50:.1f} us, p99 {p99:.1f} us")
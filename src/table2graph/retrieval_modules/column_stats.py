@@ -0,0 +1,303 @@
+"""
+Column Statistics - Per-column catalog of inferred types, numeric ranges and frequent values
+Built in one pass over the table file with infer_column_type. Retrieval uses
+the numeric / year ranges to drop candidate tables that cannot satisfy a
+query's numeric or year constraints, and inference can show a table as a
+compact column summary instead of its full rows
+
+Build and measure (run from src/table2graph):
+    python -m retrieval_modules.column_stats --dataset MultiTableQA --cluster_embedding_method contriever
+"""
+
+import argparse
+import copy
+import json
+import math
+import re
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from .corpus import iter_records
+from .records import ClusteredQuery, ClusteredTables, TableRecord
+
+COLUMN_TYPES = ("text", "real")
+YEAR_RANGE = (1800, 2099)
+
+_NUMBER = re.compile(r"^\d+[\d,]*\.?\d*$")
+_QUERY_NUMBER = r"(\d[\d,]*\.?\d*)"
+_BETWEEN = re.compile(rf"\bbetween {_QUERY_NUMBER} and {_QUERY_NUMBER}")
+_LOWER_BOUND = re.compile(rf"\b(?:after|since|more than|over|greater than|at least|above|larger than) {_QUERY_NUMBER}")
+_UPPER_BOUND = re.compile(rf"\b(?:before|less than|under|fewer than|at most|below|smaller than) {_QUERY_NUMBER}")
+_YEAR = re.compile(r"\b(1[89]\d{2}|20\d{2})\b")
+
+
+def infer_column_type(column_values) -> str:
+    """Efficiently determine whether a column is 'real' (numeric) or 'text'."""
+    if len(column_values) == 0:
+        return "text"
+    num_count = sum(
+        1 for val in column_values
+        if isinstance(val, (int, float)) or re.match(r"^\d+[\d,]*\.?\d*$", str(val))
+    )
+    return "real" if num_count / len(column_values) > 0.5 else "text"
+
+
+def parse_number(value):
+    """float of a numeric cell ("1,234", 12, "3.5"), or None."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    text = str(value).strip()
+    return float(text.replace(",", "")) if _NUMBER.match(text) else None
+
+
+def estimate_distinct(values: Iterable[str], sketch_size: int = 64) -> int:
+    """
+    Distinct-value count from a k-minimum-values sketch of 32-bit hashes:
+    exact up to sketch_size distinct values, an estimate above.
+    """
+    hashes = np.unique(np.fromiter((zlib.crc32(v.encode("utf-8")) for v in values), dtype=np.uint64))
+    if len(hashes) <= sketch_size:
+        return int(len(hashes))
+    kth = float(hashes[sketch_size - 1]) + 1.0
+    return int(round((sketch_size - 1) * 2.0 ** 32 / kth))
+
+
+class NumericConstraint(NamedTuple):
+    kind: str  # "year" or "number"
+    low: float
+    high: float
+
+
+def extract_constraints(query: str) -> List[NumericConstraint]:
+    """
+    Numeric and year constraints stated in a query: "between A and B",
+    "after / more than X", "before / less than X", and bare years from
+    1800 on ("in 2008"). Bounds that are integers in YEAR_RANGE are year
+    constraints.
+    """
+    text = query.lower()
+    constraints, used = [], []
+
+    def kind(*numbers):
+        return "year" if all(n.is_integer() and YEAR_RANGE[0] <= n <= YEAR_RANGE[1] for n in numbers) else "number"
+
+    for match in _BETWEEN.finditer(text):
+        low, high = sorted((float(match.group(1).replace(",", "")), float(match.group(2).replace(",", ""))))
+        constraints.append(NumericConstraint(kind(low, high), low, high))
+        used.append(match.span())
+    for pattern, bounded_below in ((_LOWER_BOUND, True), (_UPPER_BOUND, False)):
+        for match in pattern.finditer(text):
+            if any(start <= match.start() < end for start, end in used):
+                continue
+            value = float(match.group(1).replace(",", ""))
+            constraints.append(NumericConstraint(kind(value), value, math.inf) if bounded_below
+                               else NumericConstraint(kind(value), -math.inf, value))
+            used.append(match.span())
+    for match in _YEAR.finditer(text):
+        if not any(start <= match.start() < end for start, end in used):
+            year = float(match.group(1))
+            constraints.append(NumericConstraint("year", year, year))
+    return constraints
+
+
+class ColumnCatalog:
+    """
+    Column statistics for every table, stored as flat arrays.
+
+    Columns of table i are rows col_ptr[i]:col_ptr[i + 1]; the frequent
+    values of column j are top_ptr[j]:top_ptr[j + 1]. Text columns have NaN
+    min / max.
+    """
+
+    def __init__(self, table_ids: Sequence, arrays: Dict[str, np.ndarray]):
+        self.table_ids = list(table_ids)
+        self.position: Dict = {table_idx: i for i, table_idx in enumerate(self.table_ids)}
+        self.arrays = arrays
+        for name, values in arrays.items():
+            setattr(self, name, values)
+
+    @classmethod
+    def build(cls, tables: Iterable[Tuple], top_values: int = 3, sketch_size: int = 64,
+              max_value_chars: int = 48) -> "ColumnCatalog":
+        """
+        Args:
+            tables: (table_idx, table record) pairs, e.g. TableStore.items()
+            top_values: Most frequent values kept per column
+            sketch_size: KMV sketch size for distinct counts
+            max_value_chars: Frequent values are truncated to this length (the arrays are fixed-width)
+        """
+        table_ids, col_ptr = [], [0]
+        columns = {name: [] for name in ("headers", "types", "is_year", "n_values", "min", "max", "n_distinct")}
+        top_ptr, top_value_list, top_counts = [0], [], []
+        for table_idx, table in tables:
+            table_ids.append(table_idx)
+            header = list(table["table"]["header"])
+            rows = table["table"]["rows"]
+            for col, name in enumerate(header):
+                values = [row[col] for row in rows if col < len(row) and row[col] not in (None, "")]
+                column_type = infer_column_type(values)
+                numbers = [n for n in map(parse_number, values) if n is not None] if column_type == "real" else []
+                columns["headers"].append(str(name)[:max_value_chars])
+                columns["types"].append(COLUMN_TYPES.index(column_type))
+                columns["is_year"].append(bool(numbers) and all(n.is_integer() and YEAR_RANGE[0] <= n <= YEAR_RANGE[1]
+                                                                 for n in numbers))
+                columns["n_values"].append(len(values))
+                columns["min"].append(min(numbers) if numbers else math.nan)
+                columns["max"].append(max(numbers) if numbers else math.nan)
+                text_values = [str(v) for v in values]
+                columns["n_distinct"].append(estimate_distinct(text_values, sketch_size))
+                for value, count in Counter(text_values).most_common(top_values):
+                    top_value_list.append(value[:max_value_chars])
+                    top_counts.append(count)
+                top_ptr.append(len(top_value_list))
+            col_ptr.append(len(columns["headers"]))
+        arrays = {
+            "col_ptr": np.array(col_ptr, dtype=np.int64),
+            "headers": np.array(columns["headers"], dtype=str),
+            "types": np.array(columns["types"], dtype=np.uint8),
+            "is_year": np.array(columns["is_year"], dtype=bool),
+            "n_values": np.array(columns["n_values"], dtype=np.int32),
+            "min": np.array(columns["min"], dtype=np.float64),
+            "max": np.array(columns["max"], dtype=np.float64),
+            "n_distinct": np.array(columns["n_distinct"], dtype=np.int32),
+            "top_ptr": np.array(top_ptr, dtype=np.int64),
+            "top_values": np.array(top_value_list, dtype=str),
+            "top_counts": np.array(top_counts, dtype=np.int32),
+        }
+        return cls(table_ids, arrays)
+
+    @classmethod
+    def from_table_file(cls, table_file: str, **kwargs) -> "ColumnCatalog":
+        """Catalog the tables of {dataset}_table.jsonl (or its columnar sibling) in one streaming pass."""
+        tables = ((table.table_idx, table) for table in iter_records(table_file, record_type=TableRecord)
+                  if "table" in table)
+        return cls.build(tables, **kwargs)
+
+    def _column_range(self, table_idx) -> range:
+        position = self.position[table_idx]
+        return range(self.col_ptr[position], self.col_ptr[position + 1])
+
+    def columns(self, table_idx) -> List[Dict]:
+        """The catalog entries of one table's columns."""
+        entries = []
+        for col in self._column_range(table_idx):
+            top = range(self.top_ptr[col], self.top_ptr[col + 1])
+            entry = {"header": str(self.headers[col]), "type": COLUMN_TYPES[self.types[col]],
+                     "is_year": bool(self.is_year[col]), "n_values": int(self.n_values[col]),
+                     "n_distinct": int(self.n_distinct[col]),
+                     "top_values": [(str(self.top_values[i]), int(self.top_counts[i])) for i in top]}
+            if not math.isnan(self.min[col]):
+                entry["min"], entry["max"] = float(self.min[col]), float(self.max[col])
+            entries.append(entry)
+        return entries
+
+    def summary(self, table_idx) -> str:
+        """One line per column: type, range or distinct count, frequent values."""
+        lines = []
+        for entry in self.columns(table_idx):
+            kind = "year" if entry["is_year"] else entry["type"]
+            if "min" in entry:
+                detail = f"{entry['min']:g} to {entry['max']:g}"
+            else:
+                detail = f"{entry['n_distinct']} distinct"
+            examples = ", ".join(value for value, _ in entry["top_values"])
+            lines.append(f"{entry['header']} ({kind}, {entry['n_values']} values, {detail}): {examples}")
+        return "\n".join(lines)
+
+    def can_satisfy(self, table_idx, constraints: Sequence[NumericConstraint]) -> bool:
+        """
+        False only when the table has columns of a constraint's kind (year
+        columns for years, other numeric columns for numbers) and none of
+        their [min, max] ranges meets the constraint. Unknown tables pass.
+        """
+        if table_idx not in self.position:
+            return True
+        cols = self._column_range(table_idx)
+        for constraint in constraints:
+            relevant = [col for col in cols if self.types[col] == 1 and
+                        bool(self.is_year[col]) == (constraint.kind == "year")]
+            if relevant and not any(self.min[col] <= constraint.high and self.max[col] >= constraint.low
+                                    for col in relevant):
+                return False
+        return True
+
+    def save(self, path: str) -> None:
+        np.savez(path, table_ids=np.array(self.table_ids), **self.arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "ColumnCatalog":
+        data = np.load(path)
+        return cls(data["table_ids"].tolist(), {name: data[name] for name in data.files if name != "table_ids"})
+
+    def stats(self) -> Dict:
+        return {
+            "n_tables": len(self.table_ids),
+            "n_columns": int(len(self.headers)),
+            "real_columns": int((self.types == 1).sum()),
+            "year_columns": int(self.is_year.sum()),
+            "bytes": int(sum(values.nbytes for values in self.arrays.values())),
+        }
+
+
+def prune_by_constraints(query_batch: List, catalog: ColumnCatalog) -> List:
+    """
+    Copies of clustered-query records without the candidates that cannot
+    satisfy the query's numeric / year constraints. Records without
+    constraints, or whose every candidate would be dropped, are left as they are.
+    """
+    pruned_batch = []
+    for clustered_data in query_batch:
+        constraints = extract_constraints(clustered_data["query"])
+        candidates = clustered_data["clustered_tables"]["clustered_tables"]
+        kept = [table_idx for table_idx in candidates if catalog.can_satisfy(table_idx, constraints)] \
+            if constraints else candidates
+        if not kept or len(kept) == len(candidates):
+            pruned_batch.append(clustered_data)
+            continue
+        pruned = copy.copy(clustered_data)
+        pruned["clustered_tables"] = ClusteredTables(clustered_tables=kept, size=len(kept))
+        pruned_batch.append(pruned)
+    return pruned_batch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the column statistics catalog and measure constraint pruning.")
+    parser.add_argument("--dataset", type=str, required=True, help="Name of the dataset")
+    parser.add_argument("--cluster_embedding_method", type=str, default="contriever",
+                        help="Which {dataset}_clustered_tables_{method}.jsonl to measure")
+    parser.add_argument("--column_catalog_file", type=str, default=None,
+                        help="Default ./data/{dataset}/{dataset}_column_catalog.npz (built if missing)")
+    parser.add_argument("--testing_num", type=int, default=None, help="Only the first N clustered queries")
+    args = parser.parse_args()
+
+    data_dir = f"./data/{args.dataset}/"
+    catalog_file = args.column_catalog_file or f"{data_dir}{args.dataset}_column_catalog.npz"
+    try:
+        catalog = ColumnCatalog.load(catalog_file)
+    except FileNotFoundError:
+        catalog = ColumnCatalog.from_table_file(f"{data_dir}{args.dataset}_table.jsonl")
+        catalog.save(catalog_file)
+        print(f"Saved column catalog to {catalog_file}")
+    print(f"Column catalog: {catalog.stats()}")
+
+    with open(f"{data_dir}{args.dataset}_table_match.json", "r", encoding="utf-8") as f:
+        table_match = json.load(f)
+    clustered_file = f"{data_dir}{args.dataset}_clustered_tables_{args.cluster_embedding_method}.jsonl"
+    n_queries = n_constrained = before = after = truth_before = truth_after = 0
+    for clustered_data in iter_records(clustered_file, record_type=ClusteredQuery):
+        if args.testing_num is not None and n_queries >= args.testing_num:
+            break
+        n_queries += 1
+        candidates = clustered_data.clustered_tables.clustered_tables
+        kept = prune_by_constraints([clustered_data], catalog)[0].clustered_tables.clustered_tables
+        if kept is candidates:
+            continue
+        n_constrained += 1
+        truth = set(table_match[str(clustered_data.source_table_idx)])
+        before, after = before + len(candidates), after + len(kept)
+        truth_before, truth_after = truth_before + len(truth & set(candidates)), truth_after + len(truth & set(kept))
+    print(f"{n_queries} queries, {n_constrained} pruned by numeric / year constraints: "
+          f"{before} -> {after} candidates, ground-truth tables kept {truth_after} of {truth_before}")
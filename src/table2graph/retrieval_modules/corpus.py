@@ -0,0 +1,223 @@
+"""
+Corpus Files - Columnar (Arrow IPC / Parquet) corpus files with a JSONL fallback
+
+Stages keep naming the JSONL path they always used ({dataset}_table.jsonl,
+{dataset}_schema.jsonl, ...). If a file with the same stem and an .arrow or
+.parquet suffix exists and is current it is read instead, and only the
+requested columns are materialized. A columnar file records the size and
+mtime of the JSONL it was written next to; once the JSONL changes (or, for
+files without that stamp, is newer) the stale columnar file is ignored. Arrow IPC files are memory-mapped, so a column read is
+zero-copy until it is converted to Python objects. Rows can be returned as
+typed records (see records.py) instead of dicts. pyarrow is only imported once
+a columnar file is read or written, so JSONL-only readers never load it.
+"""
+
+import json
+import os
+import warnings
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Sequence, Type
+
+import msgspec
+
+from .records import convert_record, encode_line, get_decoder, iter_jsonl
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+CORPUS_FORMATS = ("jsonl", "arrow", "parquet")
+COLUMNAR_FORMATS = ("arrow", "parquet")
+
+# Schema metadata key listing the columns stored as JSON text (values with no single Arrow type).
+JSON_COLUMNS_KEY = b"json_columns"
+# Schema metadata key holding [size, mtime_ns] of the JSONL file next to a columnar file when it was written.
+SOURCE_STAMP_KEY = b"source_stamp"
+
+
+def _arrow():
+    """pyarrow with its ipc and parquet submodules, imported on first use."""
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    return pyarrow
+
+
+def corpus_file(path: str, corpus_format: str) -> str:
+    """The path of a corpus file in the given format: same stem, format-specific suffix."""
+    if corpus_format not in CORPUS_FORMATS:
+        raise ValueError(f"Unknown corpus format {corpus_format}. Choose from {CORPUS_FORMATS}")
+    return f"{os.path.splitext(path)[0]}.{corpus_format}"
+
+
+def _file_stamp(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _schema_metadata(columnar: str) -> Dict[bytes, bytes]:
+    pa = _arrow()
+    if columnar.endswith(".arrow"):
+        schema = pa.ipc.open_file(pa.memory_map(columnar, "r")).schema
+    else:
+        schema = pa.parquet.read_schema(columnar)
+    return schema.metadata or {}
+
+
+def is_current(columnar: str, path: str) -> bool:
+    """
+    Whether a columnar file still reflects the JSONL corpus file at path:
+    its source stamp matches the JSONL's size and mtime, or, without a
+    stamp, it is not older than the JSONL. True when there is no JSONL.
+    """
+    if not os.path.exists(path):
+        return True
+    stamp = _schema_metadata(columnar).get(SOURCE_STAMP_KEY)
+    if stamp is not None:
+        return json.loads(stamp) == _file_stamp(path)
+    return os.stat(columnar).st_mtime_ns >= os.stat(path).st_mtime_ns
+
+
+def find_columnar_file(path: str, formats: Sequence[str] = COLUMNAR_FORMATS) -> Optional[str]:
+    """The existing, current .arrow (preferred) or .parquet sibling of a corpus path, if any."""
+    for corpus_format in formats:
+        candidate = corpus_file(path, corpus_format)
+        if os.path.exists(candidate):
+            if is_current(candidate, path):
+                return candidate
+            warnings.warn(f"Ignoring {candidate}: {path} changed after it was written. "
+                          f"Re-export it or remove it.")
+    return None
+
+
+def records_to_arrow(records: Sequence[Dict]) -> "pa.Table":
+    """
+    Build an Arrow table from row dicts. Columns whose values do not share
+    one Arrow type (e.g. table rows mixing numbers and strings) are stored
+    as JSON text and decoded again by the readers.
+    """
+    pa = _arrow()
+    names: Dict[str, None] = {}
+    for record in records:
+        names.update(dict.fromkeys(record))
+    arrays, json_columns = [], []
+    for name in names:
+        values = [record.get(name) for record in records]
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays.append(pa.array([None if v is None else encode_line(v) for v in values], type=pa.large_string()))
+            json_columns.append(name)
+    table = pa.Table.from_arrays(arrays, names=list(names))
+    return table.replace_schema_metadata({JSON_COLUMNS_KEY: json.dumps(json_columns).encode()})
+
+
+def _json_columns(table: "pa.Table") -> List[str]:
+    metadata = table.schema.metadata or {}
+    return json.loads(metadata.get(JSON_COLUMNS_KEY, b"[]"))
+
+
+def write_records(path: str, records: Sequence[Any], corpus_format: str = "jsonl") -> str:
+    """
+    Write records (dicts or typed records) as JSONL or as a columnar file next to path.
+
+    Returns:
+        The file written
+    """
+    out_file = corpus_file(path, corpus_format)
+    if corpus_format == "jsonl":
+        with open(out_file, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(encode_line(record) + "\n")
+        return out_file
+    table = records_to_arrow(msgspec.to_builtins(list(records)))
+    if os.path.exists(path) and path != out_file:
+        # Stamp the JSONL this file sits next to, so readers can tell when the export goes stale.
+        table = table.replace_schema_metadata({**table.schema.metadata,
+                                               SOURCE_STAMP_KEY: json.dumps(_file_stamp(path)).encode()})
+    pa = _arrow()
+    if corpus_format == "arrow":
+        with pa.OSFile(out_file, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pa.parquet.write_table(table, out_file)
+    return out_file
+
+
+def read_arrow_table(path: str, columns: Optional[Sequence[str]] = None) -> "pa.Table":
+    """Open an .arrow (memory-mapped, zero-copy) or .parquet corpus file, optionally selecting columns."""
+    pa = _arrow()
+    if path.endswith(".arrow"):
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        return table.select(list(columns)) if columns is not None else table
+    return pa.parquet.read_table(path, columns=list(columns) if columns is not None else None, memory_map=True)
+
+
+def _decode_rows(rows: List[Dict], json_columns: Iterable[str]) -> List[Dict]:
+    decoder = get_decoder()
+    for name in json_columns:
+        for row in rows:
+            if row.get(name) is not None:
+                row[name] = decoder.decode(row[name])
+    return rows
+
+
+def read_columns(path: str, columns: Sequence[str]) -> Dict[str, List]:
+    """
+    Read whole columns of a corpus file as Python lists.
+
+    Args:
+        path: The stage's JSONL path; a columnar sibling is used when present
+        columns: Column names to return
+
+    Returns:
+        column name -> list of values, in row order
+    """
+    columnar = find_columnar_file(path)
+    if columnar is not None:
+        table = read_arrow_table(columnar, columns)
+        data = table.to_pydict()
+        decoder = get_decoder()
+        for name in set(_json_columns(table)) & set(columns):
+            data[name] = [None if v is None else decoder.decode(v) for v in data[name]]
+        return data
+    data = {name: [] for name in columns}
+    for record in iter_jsonl(path):
+        for name in columns:
+            data[name].append(record[name])
+    return data
+
+
+def iter_records(path: str, columns: Optional[Sequence[str]] = None, batch_size: int = 1024,
+                 record_type: Optional[Type] = None) -> Iterator[Any]:
+    """
+    Stream records from a corpus file in row order (columnar sibling first,
+    then the JSONL file itself). Blank JSONL lines are skipped.
+
+    Args:
+        path: The stage's JSONL path
+        columns: Optional subset of fields per row (dict rows only)
+        batch_size: Rows converted per Arrow record batch
+        record_type: Optional records.py schema; rows are validated and returned as that type
+    """
+    if columns is not None and record_type is not None:
+        raise ValueError("Pass either columns (dict rows) or record_type (typed rows), not both")
+    columnar = find_columnar_file(path)
+    if columnar is not None:
+        table = read_arrow_table(columnar, columns)
+        json_columns = [name for name in _json_columns(table) if name in table.column_names]
+        row_no = 0
+        for batch in table.to_batches(max_chunksize=batch_size):
+            for row in _decode_rows(batch.to_pylist(), json_columns):
+                row_no += 1
+                yield convert_record(row, record_type, columnar, row_no)
+        return
+    for record in iter_jsonl(path, record_type):
+        yield record if columns is None else {name: record.get(name) for name in columns}
+
+
+def read_records(path: str, columns: Optional[Sequence[str]] = None, record_type: Optional[Type] = None) -> List[Any]:
+    return list(iter_records(path, columns, record_type=record_type))
+
+
+def convert_corpus_file(path: str, corpus_format: str) -> str:
+    """Rewrite an existing JSONL corpus file in another format next to it; returns the new file."""
+    return write_records(path, read_records(path), corpus_format)
@@ -0,0 +1,200 @@
+"""
+Score Cutoff - Per-query number of final tables from the PageRank scores
+Instead of always passing the last filter_topks count downstream, the final
+ranked list is cut where its scores say the relevant tables end: at the
+sharpest score drop (gap), once the kept tables hold a share of the score
+mass (mass), or where a calibrated relevance probability falls below a
+threshold (probability). Every mode respects a min floor and a max cap
+
+Fit a calibration and compare the modes on a reference-format run (run from src/table2graph):
+    python -m retrieval_modules.cutoff --retrieved_file ./data/MultiTableQA/MultiTableQA_retrieved_tables_schema_1000_10_contriever.jsonl \
+        --calibration_file ./data/MultiTableQA/MultiTableQA_cutoff_calibration.json
+"""
+
+import argparse
+import json
+from collections import Counter
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from .corpus import iter_records
+from .records import RetrievalResult
+
+CUTOFF_MODES = ("gap", "mass", "probability")
+
+
+def score_features(scores: Sequence[float]) -> np.ndarray:
+    """log of each score's share relative to a uniform share, so lists of any length are comparable."""
+    scores = np.maximum(np.asarray(scores, dtype=np.float64), 0.0)
+    total = scores.sum()
+    if total <= 0:
+        return np.zeros(len(scores))
+    return np.log(np.maximum(scores * len(scores) / total, 1e-12))
+
+
+def fit_calibration(score_lists: Sequence[Sequence[float]], relevance_lists: Sequence[Sequence[bool]],
+                    l2: float = 1e-3, max_iter: int = 50) -> Dict:
+    """
+    Platt scaling: a logistic regression of relevance on score_features,
+    fitted by Newton's method (a small L2 penalty keeps separable data finite).
+
+    Args:
+        score_lists: Final ranked scores of each query, best first
+        relevance_lists: Whether each ranked table is a ground-truth table
+
+    Returns:
+        {"slope", "intercept", "n_samples", "positive_rate"}
+    """
+    features = np.concatenate([score_features(scores) for scores in score_lists])
+    labels = np.concatenate([np.asarray(relevance, dtype=np.float64) for relevance in relevance_lists])
+    X = np.stack([features, np.ones_like(features)], axis=1)
+    w = np.zeros(2)
+    for _ in range(max_iter):
+        p = 1.0 / (1.0 + np.exp(-(X @ w)))
+        gradient = X.T @ (p - labels) + l2 * w
+        hessian = (X * (p * (1 - p))[:, None]).T @ X + l2 * np.eye(2)
+        step = np.linalg.solve(hessian, gradient)
+        w -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    return {"slope": float(w[0]), "intercept": float(w[1]), "n_samples": int(len(labels)),
+            "positive_rate": float(labels.mean()) if len(labels) else 0.0}
+
+
+class ScoreCutoff:
+    """
+    Number of tables to keep from one query's ranked scores.
+
+    Args:
+        mode: "gap", "mass" or "probability"
+        min_keep: Floor on the kept count
+        max_keep: Cap on the kept count (None: the whole ranked list)
+        gap: gap mode cuts before the sharpest drop if the next score is at most gap * the previous one
+        mass: mass mode keeps the fewest tables holding this share of the list's score mass
+        probability: probability mode keeps the tables whose calibrated probability is at least this
+        calibration: fit_calibration output, required by probability mode
+    """
+
+    def __init__(self, mode: str, min_keep: int = 1, max_keep: Optional[int] = None, gap: float = 0.5,
+                 mass: float = 0.8, probability: float = 0.5, calibration: Optional[Dict] = None):
+        if mode not in CUTOFF_MODES:
+            raise ValueError(f"Unknown cutoff mode {mode}. Choose from {CUTOFF_MODES}")
+        if mode == "probability" and calibration is None:
+            raise ValueError("The probability cutoff needs a calibration (python -m retrieval_modules.cutoff)")
+        self.mode = mode
+        self.min_keep = min_keep
+        self.max_keep = max_keep
+        self.gap = gap
+        self.mass = mass
+        self.probability = probability
+        self.calibration = calibration
+
+    def probabilities(self, scores: Sequence[float]) -> np.ndarray:
+        z = self.calibration["slope"] * score_features(scores) + self.calibration["intercept"]
+        return 1.0 / (1.0 + np.exp(-z))
+
+    def keep_count(self, scores: Sequence[float]) -> int:
+        """Tables to keep from scores (best first), between min_keep and max_keep."""
+        scores = np.asarray(scores, dtype=np.float64)
+        cap = len(scores) if self.max_keep is None else min(len(scores), self.max_keep)
+        floor = min(max(self.min_keep, 1), cap)
+        if cap <= floor:
+            return cap
+        if self.mode == "gap":
+            # ratios[i - floor]: score of table i relative to table i - 1, i.e. the drop when keeping i tables.
+            previous = scores[floor - 1:cap - 1]
+            ratios = np.where(previous > 0, scores[floor:cap] / np.where(previous > 0, previous, 1.0), 1.0)
+            sharpest = int(np.argmin(ratios))
+            count = floor + sharpest if ratios[sharpest] <= self.gap else cap
+        elif self.mode == "mass":
+            total = np.maximum(scores, 0.0).sum()
+            if total <= 0:
+                return cap
+            cumulative = np.cumsum(np.maximum(scores, 0.0)) / total
+            count = int(np.searchsorted(cumulative, self.mass - 1e-12)) + 1
+        else:
+            count = int((self.probabilities(scores) >= self.probability).sum())
+        return min(max(count, floor), cap)
+
+
+def kept_count_report(kept_counts: Counter) -> Dict:
+    """Summary of a Counter of kept-table counts per query: mean, percentiles and histogram."""
+    if not kept_counts:
+        return {"queries": 0}
+    counts = np.repeat(np.array(list(kept_counts.keys())), list(kept_counts.values()))
+    p50, p90 = np.percentile(counts, [50, 90])
+    return {
+        "queries": int(len(counts)),
+        "mean": float(counts.mean()),
+        "min": int(counts.min()),
+        "p50": float(p50),
+        "p90": float(p90),
+        "max": int(counts.max()),
+        "histogram": {int(count): kept_counts[count] for count in sorted(kept_counts)},
+    }
+
+
+def evaluate_cutoff(score_cutoff: ScoreCutoff, score_lists: Sequence[Sequence[float]],
+                    relevance_lists: Sequence[Sequence[bool]], n_truths: Sequence[int]) -> Dict:
+    """
+    Kept counts and ground-truth coverage of a cutoff over ranked lists.
+
+    Returns:
+        kept_count_report fields plus "recall" (ground-truth tables kept / all)
+        and "all_retrieved" (share of queries keeping every ground-truth table)
+    """
+    kept_counts, found, complete = Counter(), 0, 0
+    for scores, relevance, n_truth in zip(score_lists, relevance_lists, n_truths):
+        count = score_cutoff.keep_count(scores)
+        kept_counts[count] += 1
+        hits = int(np.sum(relevance[:count]))
+        found += hits
+        complete += int(hits >= n_truth)
+    report = kept_count_report(kept_counts)
+    report["recall"] = float(found / max(sum(n_truths), 1))
+    report["all_retrieved"] = complete / max(len(score_lists), 1)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the probability calibration and compare cutoff modes "
+                                                 "on a --output_format refs retrieval run.")
+    parser.add_argument("--retrieved_file", type=str, required=True,
+                        help="*_retrieved_tables_schema_*.jsonl written with --output_format refs")
+    parser.add_argument("--calibration_file", type=str, default=None,
+                        help="Save the fitted calibration (JSON) here for --cutoff_mode probability")
+    parser.add_argument("--min_keep", type=int, default=1)
+    parser.add_argument("--max_keep", type=int, default=None)
+    args = parser.parse_args()
+
+    score_lists, relevance_lists, n_truths = [], [], []
+    for result in iter_records(args.retrieved_file, record_type=RetrievalResult):
+        if not isinstance(result.retrieved_scores, list):
+            raise ValueError(f"{args.retrieved_file} has no retrieved_scores; rerun retrieval with --output_format refs")
+        truth = set(result.ground_truth_sub_table_idx)
+        score_lists.append(result.retrieved_scores)
+        relevance_lists.append([table_idx in truth for table_idx in result.retrieve_sub_table_idx])
+        n_truths.append(len(truth))
+    print(f"{len(score_lists)} queries")
+
+    calibration = fit_calibration(score_lists, relevance_lists)
+    print(f"Calibration: {calibration}")
+    if args.calibration_file is not None:
+        with open(args.calibration_file, "w", encoding="utf-8") as f:
+            json.dump(calibration, f, indent=2)
+        print(f"Saved calibration to {args.calibration_file}")
+
+    settings = [("gap", {"gap": gap}) for gap in (0.3, 0.5, 0.7)] + \
+               [("mass", {"mass": mass}) for mass in (0.5, 0.7, 0.9)] + \
+               [("probability", {"probability": p}) for p in (0.3, 0.5, 0.7)]
+    uncut = evaluate_cutoff(ScoreCutoff("mass", args.min_keep, args.max_keep, mass=1.0), score_lists,
+                            relevance_lists, n_truths)
+    print(f"  {'no cutoff':<18} mean kept {uncut['mean']:6.2f}, recall {uncut['recall']:.4f}, "
+          f"all retrieved {uncut['all_retrieved']:.4f}")
+    for mode, options in settings:
+        report = evaluate_cutoff(ScoreCutoff(mode, args.min_keep, args.max_keep, calibration=calibration, **options),
+                                 score_lists, relevance_lists, n_truths)
+        name = f"{mode} {next(iter(options.values()))}"
+        print(f"  {name:<18} mean kept {report['mean']:6.2f} (p50 {report['p50']:g}, p90 {report['p90']:g}), "
+              f"recall {report['recall']:.4f}, all retrieved {report['all_retrieved']:.4f}")
@@ -0,0 +1,137 @@
+"""
+Embedding Projector - Optional dimensionality reduction for semantic embeddings
+Fitted once at index time and applied to tables, typical nodes and queries
+"""
+
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+
+
+class EmbeddingProjector:
+    """
+    Linear projection of semantic embeddings to a smaller dimension.
+
+    Two methods are supported:
+      - "pca": principal components of the (centered) fitting embeddings
+      - "random": a Gaussian random matrix, orthonormalized so the projection
+        preserves the geometry of the retained subspace
+
+    The same fitted projector must be applied to every embedding that is
+    compared against another (tables, typical nodes and queries), otherwise
+    cosine similarities are computed across different spaces.
+    """
+
+    def __init__(self, n_components: int, method: str = "pca", random_state: int = 42):
+        if method not in ("pca", "random"):
+            raise ValueError(f"Unknown projection method: {method}")
+        self.n_components = n_components
+        self.method = method
+        self.random_state = random_state
+        self.mean_: Optional[np.ndarray] = None
+        self.components_: Optional[np.ndarray] = None  # (n_components, input_dim)
+        self.variance_retained_: Optional[float] = None
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.components_ is not None
+
+    def fit(self, embeddings) -> "EmbeddingProjector":
+        """
+        Fit the projection on a (n_samples, input_dim) embedding matrix.
+
+        Args:
+            embeddings: numpy array or torch tensor of embeddings
+
+        Returns:
+            self
+        """
+        X = _to_numpy(embeddings).astype(np.float64)
+        n_samples, input_dim = X.shape
+        if self.n_components >= input_dim:
+            raise ValueError(
+                f"n_components ({self.n_components}) must be smaller than the embedding dimension ({input_dim})"
+            )
+
+        self.mean_ = X.mean(axis=0)
+        X_centered = X - self.mean_
+
+        if self.method == "pca":
+            # Rows of Vt are the principal directions, sorted by singular value.
+            _, _, Vt = np.linalg.svd(X_centered, full_matrices=False)
+            components = Vt[:self.n_components]
+        else:
+            rng = np.random.default_rng(self.random_state)
+            gaussian = rng.standard_normal((input_dim, self.n_components))
+            Q, _ = np.linalg.qr(gaussian)
+            components = Q.T
+
+        total_variance = float((X_centered ** 2).sum())
+        projected_variance = float(((X_centered @ components.T) ** 2).sum())
+        self.variance_retained_ = projected_variance / total_variance if total_variance > 0 else 1.0
+        self.components_ = components.astype(np.float32)
+        self.mean_ = self.mean_.astype(np.float32)
+        return self
+
+    def transform(self, embeddings):
+        """
+        Project embeddings to n_components dimensions.
+
+        Accepts a single vector or a matrix, as a numpy array or a torch tensor,
+        and returns the same type (torch tensors stay on their device).
+        """
+        if not self.is_fitted:
+            raise RuntimeError("EmbeddingProjector must be fitted before transform")
+
+        if torch.is_tensor(embeddings):
+            mean = torch.as_tensor(self.mean_, dtype=embeddings.dtype, device=embeddings.device)
+            components = torch.as_tensor(self.components_, dtype=embeddings.dtype, device=embeddings.device)
+            return (embeddings - mean) @ components.T
+
+        X = np.asarray(embeddings)
+        return ((X - self.mean_) @ self.components_.T).astype(X.dtype, copy=False)
+
+    def fit_transform(self, embeddings):
+        return self.fit(embeddings).transform(embeddings)
+
+    def report(self) -> Dict:
+        """Summary of the fitted projection for logging."""
+        return {
+            "method": self.method,
+            "input_dim": None if self.components_ is None else int(self.components_.shape[1]),
+            "n_components": self.n_components,
+            "variance_retained": self.variance_retained_,
+        }
+
+    def save(self, path: str) -> None:
+        if not self.is_fitted:
+            raise RuntimeError("Cannot save an unfitted EmbeddingProjector")
+        np.savez(
+            path,
+            method=np.array(self.method),
+            n_components=np.array(self.n_components),
+            random_state=np.array(self.random_state),
+            mean=self.mean_,
+            components=self.components_,
+            variance_retained=np.array(self.variance_retained_),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingProjector":
+        data = np.load(path)
+        projector = cls(
+            n_components=int(data["n_components"]),
+            method=str(data["method"]),
+            random_state=int(data["random_state"]),
+        )
+        projector.mean_ = data["mean"]
+        projector.components_ = data["components"]
+        projector.variance_retained_ = float(data["variance_retained"])
+        return projector
+
+
+def _to_numpy(embeddings) -> np.ndarray:
+    if torch.is_tensor(embeddings):
+        return embeddings.detach().cpu().numpy()
+    return np.asarray(embeddings)
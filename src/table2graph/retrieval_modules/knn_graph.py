@@ -0,0 +1,136 @@
+"""
+Global kNN Table Graph - Offline sparse similarity graph over all table embeddings
+Built blockwise and stored as CSR; each query's subgraph is a row/column slice
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize rows (same as F.normalize(R, p=2, dim=1))."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def build_knn_graph(embeddings: np.ndarray, k: int = 50, similarity_threshold: float = 0.3,
+                    block_size: int = 2048, symmetric: bool = True) -> sp.csr_matrix:
+    """
+    Build a sparse cosine-similarity kNN graph without materialising N x N.
+
+    Each block of block_size rows is compared against all N embeddings
+    (block_size x N floats resident at a time), and only the top-k
+    neighbours with similarity >= similarity_threshold are kept. Self loops
+    are kept, matching the diagonal of the dense thresholded matrix.
+
+    Args:
+        embeddings: (N, dim) table embeddings (normalized internally)
+        k: Neighbours kept per table
+        similarity_threshold: Minimum cosine similarity for an edge
+        block_size: Rows compared per block
+        symmetric: Keep an edge if either endpoint selected it, so the graph
+                   stays symmetric like the dense similarity matrix
+
+    Returns:
+        (N, N) scipy.sparse.csr_matrix of float32 similarities
+    """
+    E = normalize_rows(embeddings)
+    n_tables = E.shape[0]
+    k = min(k, n_tables)
+
+    rows, cols, vals = [], [], []
+    for start in range(0, n_tables, block_size):
+        end = min(start + block_size, n_tables)
+        sims = E[start:end] @ E.T
+        if k < n_tables:
+            top = np.argpartition(sims, -k, axis=1)[:, -k:]
+        else:
+            top = np.broadcast_to(np.arange(n_tables), sims.shape)
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        keep = top_sims >= similarity_threshold
+        block_rows = np.broadcast_to(np.arange(start, end)[:, None], top.shape)
+        rows.append(block_rows[keep])
+        cols.append(top[keep])
+        vals.append(top_sims[keep])
+
+    graph = sp.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_tables, n_tables), dtype=np.float32,
+    )
+    if symmetric:
+        graph = graph.maximum(graph.T).tocsr()
+    graph.sort_indices()
+    return graph
+
+
+class KnnTableGraph:
+    """
+    A persisted global kNN graph plus the normalized embeddings it was built from.
+
+    Rows are ordered like table_ids; position maps a table_idx to its row.
+    """
+
+    def __init__(self, graph: sp.csr_matrix, table_ids: Sequence, embeddings: np.ndarray,
+                 k: int, similarity_threshold: float, normalized: bool = False):
+        self.graph = graph.tocsr()
+        self.table_ids = list(table_ids)
+        # normalized=True keeps the caller's array (e.g. a shared-memory view) instead of a normalized copy.
+        self.embeddings = embeddings if normalized else normalize_rows(embeddings)
+        self.k = k
+        self.similarity_threshold = similarity_threshold
+        self.position: Dict = {table_idx: i for i, table_idx in enumerate(self.table_ids)}
+
+    @classmethod
+    def build(cls, table_ids: Sequence, embeddings: np.ndarray, k: int = 50,
+              similarity_threshold: float = 0.3, block_size: int = 2048) -> "KnnTableGraph":
+        graph = build_knn_graph(embeddings, k=k, similarity_threshold=similarity_threshold, block_size=block_size)
+        return cls(graph, table_ids, embeddings, k, similarity_threshold)
+
+    def positions(self, table_indices: Sequence) -> np.ndarray:
+        """Rows of the given tables; tables missing from the graph are skipped."""
+        return np.array([self.position[t] for t in table_indices if t in self.position], dtype=np.int64)
+
+    def subgraph(self, table_indices: Sequence) -> Tuple[sp.csr_matrix, np.ndarray, List]:
+        """
+        Extract the induced subgraph of a candidate set.
+
+        Returns:
+            (S, R_norm, table_indices): the (n, n) CSR similarity slice, the
+            (n, dim) normalized embeddings and the table ids in row order
+        """
+        pos = self.positions(table_indices)
+        S = self.graph[pos][:, pos]
+        return S, self.embeddings[pos], [self.table_ids[p] for p in pos]
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            data=self.graph.data,
+            indices=self.graph.indices,
+            indptr=self.graph.indptr,
+            shape=np.array(self.graph.shape),
+            table_ids=np.array(self.table_ids),
+            embeddings=self.embeddings,
+            k=np.array(self.k),
+            similarity_threshold=np.array(self.similarity_threshold),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "KnnTableGraph":
+        data = np.load(path)
+        graph = sp.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=tuple(data["shape"]))
+        return cls(graph, data["table_ids"].tolist(), data["embeddings"],
+                   int(data["k"]), float(data["similarity_threshold"]))
+
+    def stats(self) -> Dict:
+        n_tables = self.graph.shape[0]
+        return {
+            "n_tables": n_tables,
+            "n_edges": int(self.graph.nnz),
+            "avg_degree": self.graph.nnz / n_tables if n_tables else 0.0,
+            "k": self.k,
+            "similarity_threshold": self.similarity_threshold,
+        }
@@ -0,0 +1,235 @@
+"""
+Lexical Pre-filter - BM25 over table_schema strings ahead of dense scoring
+An inverted index (CSR postings of table rows and term frequencies) is built
+once from {dataset}_schema.jsonl and persisted. It prunes a cluster-derived
+candidate set to its lexical top-M and can supply lexical personalization
+scores to fuse with the dense ones
+
+Recall curves for choosing M (run from src/table2graph):
+    python -m retrieval_modules.lexical --dataset MultiTableQA --cluster_embedding_method contriever
+"""
+
+import argparse
+import copy
+import json
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .corpus import iter_records, read_columns
+from .records import ClusteredQuery, ClusteredTables
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Template words of the schema strings ("Caption: ...; Headers: [...]") and common query words.
+STOP_WORDS = frozenset(["caption", "headers", "the", "a", "an", "of", "in", "on", "for", "to", "and", "or", "is",
+                        "was", "were", "are", "what", "which", "who", "when", "where", "how", "many", "much",
+                        "did", "does", "do", "by", "with", "at", "from", "that", "as", "it", "its", "be"])
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over one short document per table.
+
+    Postings are stored per term as CSR slices: rows (int32 positions into
+    table_ids, ascending) and tfs (float32 term frequencies).
+    """
+
+    def __init__(self, table_ids: Sequence, vocabulary: Sequence[str], posting_ptr: np.ndarray, rows: np.ndarray,
+                 tfs: np.ndarray, doc_len: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.table_ids = list(table_ids)
+        self.vocabulary = list(vocabulary)
+        self.term_id: Dict[str, int] = {term: i for i, term in enumerate(self.vocabulary)}
+        self.position: Dict = {table_idx: i for i, table_idx in enumerate(self.table_ids)}
+        self.posting_ptr = posting_ptr
+        self.rows = rows
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        n_docs = len(self.table_ids)
+        df = np.diff(posting_ptr)
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # Per-row BM25 length normalization, precomputed once.
+        self.length_norm = (k1 * (1 - b + b * doc_len / max(float(doc_len.mean()), 1e-9))).astype(np.float32)
+
+    @classmethod
+    def build(cls, documents: Sequence[str], table_ids: Sequence, k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        postings: Dict[str, List] = {}
+        doc_len = np.zeros(len(documents), dtype=np.float32)
+        for row, document in enumerate(documents):
+            tokens = tokenize(document)
+            doc_len[row] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((row, tf))
+        vocabulary = sorted(postings)
+        posting_ptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        posting_ptr[1:] = np.cumsum([len(postings[term]) for term in vocabulary])
+        entries = [entry for term in vocabulary for entry in postings[term]]
+        rows = np.array([row for row, _ in entries], dtype=np.int32)
+        tfs = np.array([tf for _, tf in entries], dtype=np.float32)
+        return cls(table_ids, vocabulary, posting_ptr, rows, tfs, doc_len, k1=k1, b=b)
+
+    @classmethod
+    def from_schema_file(cls, schema_file: str, **kwargs) -> "BM25Index":
+        """Index the table_schema strings of {dataset}_schema.jsonl (or its columnar sibling)."""
+        schemas = read_columns(schema_file, ["table_schema", "table_idx"])
+        return cls.build(schemas["table_schema"], schemas["table_idx"], **kwargs)
+
+    def scores(self, query: str, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        BM25 scores of all tables, or of the given rows (in their order).
+        Only the postings of the query's terms are touched.
+        """
+        scores = np.zeros(len(self.table_ids), dtype=np.float32)
+        for term, query_tf in Counter(tokenize(query)).items():
+            term_id = self.term_id.get(term)
+            if term_id is None:
+                continue
+            start, end = self.posting_ptr[term_id], self.posting_ptr[term_id + 1]
+            rows, tfs = self.rows[start:end], self.tfs[start:end]
+            scores[rows] += query_tf * self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + self.length_norm[rows])
+        return scores if positions is None else scores[positions]
+
+    def candidate_scores(self, query: str, table_indices: Sequence) -> np.ndarray:
+        """BM25 scores for a list of table ids (0 for tables without a schema entry)."""
+        positions = np.array([self.position.get(t, -1) for t in table_indices], dtype=np.int64)
+        scores = self.scores(query)
+        return np.where(positions >= 0, scores[positions], 0.0).astype(np.float32)
+
+    def prune(self, query: str, table_indices: Sequence, top_m: int) -> List:
+        """
+        The top_m candidates by BM25, in their original order. Ties at the
+        cut keep the earlier candidates, so a query with no lexical match
+        keeps the first top_m.
+        """
+        if len(table_indices) <= top_m:
+            return list(table_indices)
+        scores = self.candidate_scores(query, table_indices)
+        keep = np.sort(np.argsort(-scores, kind="stable")[:top_m])
+        return [table_indices[i] for i in keep]
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            table_ids=np.array(self.table_ids),
+            vocabulary=np.array(self.vocabulary),
+            posting_ptr=self.posting_ptr,
+            rows=self.rows,
+            tfs=self.tfs,
+            doc_len=self.doc_len,
+            k1=np.array(self.k1),
+            b=np.array(self.b),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        data = np.load(path)
+        return cls(data["table_ids"].tolist(), data["vocabulary"].tolist(), data["posting_ptr"], data["rows"],
+                   data["tfs"], data["doc_len"], k1=float(data["k1"]), b=float(data["b"]))
+
+    def stats(self) -> Dict:
+        return {
+            "n_tables": len(self.table_ids),
+            "n_terms": len(self.vocabulary),
+            "n_postings": int(len(self.rows)),
+            "avg_doc_len": float(self.doc_len.mean()) if len(self.doc_len) else 0.0,
+        }
+
+
+def prune_query_batch(query_batch: List, lexical_index: BM25Index, top_m: int) -> List:
+    """
+    Copies of clustered-query records whose candidate sets are cut to their
+    lexical top_m. The retrieval scripts prune before grouping queries by
+    candidate set, so a pruned table is never part of that query's graph.
+    """
+    pruned_batch = []
+    for clustered_data in query_batch:
+        kept = lexical_index.prune(clustered_data["query"], clustered_data["clustered_tables"]["clustered_tables"],
+                                   top_m)
+        pruned = copy.copy(clustered_data)
+        pruned["clustered_tables"] = ClusteredTables(clustered_tables=kept, size=len(kept))
+        pruned_batch.append(pruned)
+    return pruned_batch
+
+
+def lexical_personalization(lexical_index: BM25Index, queries: Sequence[str], table_indices: Sequence) -> np.ndarray:
+    """(N, Q) BM25 scores of one candidate set, for fusing with the dense personalization."""
+    return np.stack([lexical_index.candidate_scores(query, table_indices) for query in queries], axis=1)
+
+
+def fuse_personalization(backend, dense, lexical: np.ndarray, weight: float):
+    """
+    (1 - weight) * dense + weight * lexical, with lexical normalized per
+    query like the dense distribution. Queries with no lexical match keep
+    the dense column unchanged.
+    """
+    weights = backend.asarray(weight * (lexical.sum(axis=0) > 0).astype(np.float32))
+    lexical = backend.restrict(backend.asarray(lexical))
+    return dense * (1 - weights) + lexical * weights
+
+
+def recall_curve(lexical_index: BM25Index, queries: Sequence[str], candidate_lists: Sequence[Sequence],
+                 ground_truths: Sequence[Sequence], top_ms: Sequence[int]) -> Dict:
+    """
+    Ground-truth recall of the candidate sets before and after BM25 pruning.
+
+    Returns:
+        {"unpruned": recall, "curve": [{"top_m", "recall", "mean_candidates"}, ...]}
+    """
+    def recall(kept_lists):
+        return float(np.mean([len(set(truth) & set(kept)) / len(truth) if truth else 1.0
+                              for truth, kept in zip(ground_truths, kept_lists)]))
+
+    curve = []
+    for top_m in top_ms:
+        kept_lists = [lexical_index.prune(query, list(candidates), top_m)
+                      for query, candidates in zip(queries, candidate_lists)]
+        curve.append({"top_m": top_m, "recall": recall(kept_lists),
+                      "mean_candidates": float(np.mean([len(kept) for kept in kept_lists]))})
+    return {"unpruned": recall(candidate_lists), "curve": curve}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the BM25 schema index and report pruning recall curves.")
+    parser.add_argument("--dataset", type=str, required=True, help="Name of the dataset")
+    parser.add_argument("--cluster_embedding_method", type=str, default="contriever",
+                        help="Which {dataset}_clustered_tables_{method}.jsonl to measure")
+    parser.add_argument("--bm25_index_file", type=str, default=None,
+                        help="Default ./data/{dataset}/{dataset}_bm25_schema.npz (built if missing)")
+    parser.add_argument("--top_ms", type=str, default="25,50,100,200,500,1000")
+    parser.add_argument("--testing_num", type=int, default=None, help="Only the first N clustered queries")
+    args = parser.parse_args()
+
+    data_dir = f"./data/{args.dataset}/"
+    index_file = args.bm25_index_file or f"{data_dir}{args.dataset}_bm25_schema.npz"
+    try:
+        lexical_index = BM25Index.load(index_file)
+    except FileNotFoundError:
+        lexical_index = BM25Index.from_schema_file(f"{data_dir}{args.dataset}_schema.jsonl")
+        lexical_index.save(index_file)
+        print(f"Saved BM25 index to {index_file}")
+    print(f"BM25 index: {lexical_index.stats()}")
+
+    with open(f"{data_dir}{args.dataset}_table_match.json", "r", encoding="utf-8") as f:
+        table_match = json.load(f)
+    queries, candidate_lists, ground_truths = [], [], []
+    clustered_file = f"{data_dir}{args.dataset}_clustered_tables_{args.cluster_embedding_method}.jsonl"
+    for clustered_data in iter_records(clustered_file, record_type=ClusteredQuery):
+        if args.testing_num is not None and len(queries) >= args.testing_num:
+            break
+        queries.append(clustered_data.query)
+        candidate_lists.append(clustered_data.clustered_tables.clustered_tables)
+        ground_truths.append(table_match[str(clustered_data.source_table_idx)])
+
+    result = recall_curve(lexical_index, queries, candidate_lists, ground_truths,
+                          [int(m) for m in args.top_ms.split(",")])
+    print(f"{len(queries)} queries, unpruned recall {result['unpruned']:.4f}")
+    for point in result["curve"]:
+        print(f"  top_m {point['top_m']:>6}: recall {point['recall']:.4f}, "
+              f"mean candidates {point['mean_candidates']:.1f}")
@@ -0,0 +1,229 @@
+"""
+Out-of-core KMeans - Chunked clustering over memory-mapped feature matrices
+Only one chunk of features is resident at a time; labels are written back to disk
+"""
+
+import os
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from sklearn.cluster import kmeans_plusplus
+
+
+def write_memmap(path: str, n_rows: int, chunks: Iterable[np.ndarray], dtype=np.float32) -> np.memmap:
+    """
+    Stream feature chunks into a .npy file and reopen it read-only as a memmap.
+
+    Args:
+        path: Destination .npy file
+        n_rows: Total number of rows the chunks will produce
+        chunks: Iterable of (chunk_rows, dim) arrays, in row order
+        dtype: On-disk dtype (float32 halves the footprint of float64 features)
+
+    Returns:
+        Read-only np.memmap of shape (n_rows, dim)
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    out = None
+    start = 0
+    for chunk in chunks:
+        chunk = np.asarray(chunk, dtype=dtype)
+        if out is None:
+            out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(n_rows, chunk.shape[1]))
+        out[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    if out is None or start != n_rows:
+        raise ValueError(f"Expected {n_rows} rows for {path}, got {start}")
+    out.flush()
+    del out
+    return np.load(path, mmap_mode="r")
+
+
+def iter_chunks(items: List, chunk_size: int, transform: Callable) -> Iterable[np.ndarray]:
+    """Yield transform(items[i:i + chunk_size]) for consecutive chunks."""
+    for start in range(0, len(items), chunk_size):
+        yield transform(items[start:start + chunk_size])
+
+
+class MemmapKMeans:
+    """
+    Lloyd's KMeans that streams a (possibly memory-mapped) feature matrix in chunks.
+
+    Exposes the attributes the clustering scripts rely on (cluster_centers_,
+    labels_, n_clusters, inertia_) so it can stand in for sklearn's KMeans.
+    Peak memory is O(chunk_size * dim + n_clusters * dim) regardless of N.
+    """
+
+    def __init__(self, n_clusters: int, chunk_size: int = 4096, max_iter: int = 100,
+                 tol: float = 1e-4, random_state: int = 42, init_sample_size: Optional[int] = None):
+        self.n_clusters = n_clusters
+        self.chunk_size = chunk_size
+        self.max_iter = max_iter
+        self.tol = tol
+        self.random_state = random_state
+        self.init_sample_size = init_sample_size or max(chunk_size, 10 * n_clusters)
+        self.cluster_centers_ = None
+        self.labels_ = None
+        self.inertia_ = None
+        self.n_iter_ = 0
+
+    def _chunks(self, n_rows: int):
+        for start in range(0, n_rows, self.chunk_size):
+            yield start, min(start + self.chunk_size, n_rows)
+
+    @staticmethod
+    def _assign(chunk: np.ndarray, centers: np.ndarray, center_sq: np.ndarray):
+        # Squared euclidean distances without materialising (chunk, k, dim).
+        dists = (chunk ** 2).sum(axis=1, keepdims=True) - 2.0 * chunk @ centers.T + center_sq
+        labels = dists.argmin(axis=1)
+        return labels, np.maximum(dists[np.arange(len(chunk)), labels], 0.0)
+
+    def _init_centers(self, features) -> np.ndarray:
+        rng = np.random.default_rng(self.random_state)
+        n_rows = features.shape[0]
+        sample_size = min(n_rows, self.init_sample_size)
+        # Sorted indices keep memmap reads sequential.
+        sample_idx = np.sort(rng.choice(n_rows, size=sample_size, replace=False))
+        sample = np.asarray(features[sample_idx], dtype=np.float64)
+        centers, _ = kmeans_plusplus(sample, self.n_clusters, random_state=self.random_state)
+        return centers
+
+    def fit(self, features, labels_path: Optional[str] = None) -> "MemmapKMeans":
+        """
+        Cluster features chunk by chunk.
+
+        Args:
+            features: (N, dim) array or np.memmap
+            labels_path: Optional .npy file for the final labels; when given,
+                labels_ is a read-only memmap of that file instead of an in-memory array
+
+        Returns:
+            self
+        """
+        n_rows, dim = features.shape
+        if n_rows < self.n_clusters:
+            raise ValueError(f"n_samples={n_rows} should be >= n_clusters={self.n_clusters}")
+
+        # Tolerance is relative to the mean feature variance, as in sklearn.
+        total = np.zeros(dim)
+        total_sq = np.zeros(dim)
+        for start, end in self._chunks(n_rows):
+            chunk = np.asarray(features[start:end], dtype=np.float64)
+            total += chunk.sum(axis=0)
+            total_sq += (chunk ** 2).sum(axis=0)
+        mean_variance = float(np.mean(total_sq / n_rows - (total / n_rows) ** 2))
+        tol = self.tol * mean_variance
+
+        centers = self._init_centers(features)
+        for iteration in range(self.max_iter):
+            sums = np.zeros((self.n_clusters, dim))
+            counts = np.zeros(self.n_clusters, dtype=np.int64)
+            center_sq = (centers ** 2).sum(axis=1)
+            for start, end in self._chunks(n_rows):
+                chunk = np.asarray(features[start:end], dtype=np.float64)
+                labels, _ = self._assign(chunk, centers, center_sq)
+                one_hot = np.zeros((len(labels), self.n_clusters))
+                one_hot[np.arange(len(labels)), labels] = 1.0
+                sums += one_hot.T @ chunk
+                counts += np.bincount(labels, minlength=self.n_clusters)
+
+            new_centers = centers.copy()
+            non_empty = counts > 0
+            # Empty clusters keep their previous centroid.
+            new_centers[non_empty] = sums[non_empty] / counts[non_empty, None]
+            shift = float(((new_centers - centers) ** 2).sum())
+            centers = new_centers
+            self.n_iter_ = iteration + 1
+            if shift <= tol:
+                break
+
+        self.cluster_centers_ = centers
+        self.labels_, self.inertia_ = self._write_labels(features, labels_path)
+        return self
+
+    def _write_labels(self, features, labels_path: Optional[str]):
+        n_rows = features.shape[0]
+        if labels_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(labels_path)), exist_ok=True)
+            labels_out = np.lib.format.open_memmap(labels_path, mode="w+", dtype=np.int32, shape=(n_rows,))
+        else:
+            labels_out = np.empty(n_rows, dtype=np.int32)
+
+        inertia = 0.0
+        center_sq = (self.cluster_centers_ ** 2).sum(axis=1)
+        for start, end in self._chunks(n_rows):
+            chunk = np.asarray(features[start:end], dtype=np.float64)
+            labels, dists = self._assign(chunk, self.cluster_centers_, center_sq)
+            labels_out[start:end] = labels
+            inertia += float(dists.sum())
+
+        if labels_path is not None:
+            labels_out.flush()
+            del labels_out
+            return np.load(labels_path, mmap_mode="r"), inertia
+        return labels_out, inertia
+
+    def save(self, path: str) -> None:
+        """Save a fitted model (centroids, labels, inertia) as .npz."""
+        np.savez(path, cluster_centers=self.cluster_centers_, labels=np.asarray(self.labels_),
+                 inertia=np.array(self.inertia_), n_iter=np.array(self.n_iter_),
+                 chunk_size=np.array(self.chunk_size))
+
+    @classmethod
+    def load(cls, path: str) -> "MemmapKMeans":
+        data = np.load(path)
+        model = cls(n_clusters=len(data["cluster_centers"]), chunk_size=int(data["chunk_size"]))
+        model.cluster_centers_ = data["cluster_centers"]
+        model.labels_ = data["labels"]
+        model.inertia_ = float(data["inertia"])
+        model.n_iter_ = int(data["n_iter"])
+        return model
+
+    def predict(self, features) -> np.ndarray:
+        """Assign cluster labels to new rows, chunk by chunk."""
+        center_sq = (self.cluster_centers_ ** 2).sum(axis=1)
+        labels = np.empty(features.shape[0], dtype=np.int32)
+        for start, end in self._chunks(features.shape[0]):
+            chunk = np.asarray(features[start:end], dtype=np.float64)
+            labels[start:end], _ = self._assign(chunk, self.cluster_centers_, center_sq)
+        return labels
+
+
+def select_typical_indices_chunked(features, labels, cluster_centers: np.ndarray,
+                                   k: int, chunk_size: int = 4096) -> Dict[int, np.ndarray]:
+    """
+    Pick the k rows most cosine-similar to their cluster centroid without
+    loading whole clusters into memory.
+
+    Returns:
+        {cluster_id: row indices}, ordered by ascending similarity like
+        cluster_indices[np.argsort(similarities)[-k:]] in the in-memory path
+    """
+    n_clusters = cluster_centers.shape[0]
+    centers = cluster_centers / (np.linalg.norm(cluster_centers, axis=1, keepdims=True) + 1e-12)
+    best_sims = {c: np.empty(0) for c in range(n_clusters)}
+    best_idx = {c: np.empty(0, dtype=np.int64) for c in range(n_clusters)}
+
+    n_rows = features.shape[0]
+    for start in range(0, n_rows, chunk_size):
+        end = min(start + chunk_size, n_rows)
+        chunk = np.asarray(features[start:end], dtype=np.float64)
+        chunk = chunk / (np.linalg.norm(chunk, axis=1, keepdims=True) + 1e-12)
+        chunk_labels = np.asarray(labels[start:end])
+        for cluster_id in np.unique(chunk_labels):
+            rows = np.where(chunk_labels == cluster_id)[0]
+            sims = chunk[rows] @ centers[cluster_id]
+            sims = np.concatenate([best_sims[cluster_id], sims])
+            idx = np.concatenate([best_idx[cluster_id], rows + start])
+            if len(sims) > k:
+                keep = np.argpartition(sims, -k)[-k:]
+                sims, idx = sims[keep], idx[keep]
+            best_sims[cluster_id], best_idx[cluster_id] = sims, idx
+
+    typical = {}
+    for cluster_id in range(n_clusters):
+        if len(best_idx[cluster_id]) == 0:
+            continue
+        order = np.argsort(best_sims[cluster_id])
+        typical[cluster_id] = best_idx[cluster_id][order]
+    return typical
@@ -0,0 +1,281 @@
+"""
+Personalized PageRank - Batched power iteration and pluggable solvers
+over dense or sparse transition matrices
+
+All solvers compute x = (1 - alpha) * p + alpha * P^T x for one personalization
+vector p (shape (N,)) or several at once (shape (N, Q)).
+"""
+
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+# Iterations between convergence tests in the torch solvers. Each test reads a
+# value back from the device, so checking every iteration serializes GPU runs.
+DEFAULT_CHECK_EVERY = 5
+
+
+class PageRankResult(NamedTuple):
+    scores: torch.Tensor  # same shape as the personalization input
+    iterations: int       # iterations (or push rounds) actually run
+    residual: float       # max over columns of ||(I - alpha P^T) x - (1 - alpha) p||_1
+
+
+def transpose_transition(P: torch.Tensor) -> torch.Tensor:
+    """P.T, coalesced for sparse P so repeated products stay cheap."""
+    return P.t().coalesce() if P.is_sparse else P.T
+
+
+def run_pagerank_batched(P: torch.Tensor, personalization: torch.Tensor, alpha: float = 0.85,
+                         max_iter: int = 50, tol: float = 1e-6,
+                         check_every: int = 1, x0: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Personalized PageRank for several personalization vectors on the same graph.
+
+    All columns are iterated together, so each step is one (sparse or dense)
+    matmul instead of Q matvecs. A column stops updating once its L1 change
+    drops below tol, exactly like the single-vector run_pagerank_gpu.
+
+    Args:
+        P: (N, N) row-stochastic transition matrix (dense or sparse COO)
+        personalization: (N, Q) matrix, one personalization vector per column
+        alpha: Damping factor
+        max_iter: Maximum number of power iterations
+        tol: Per-column L1 convergence tolerance
+        check_every: Test convergence every this many iterations; each test
+                     forces a device sync, so values > 1 trade a few extra
+                     iterations for fewer syncs
+        x0: Optional (N, Q) starting scores (warm start); defaults to personalization
+
+    Returns:
+        (scores, iterations): (N, Q) PageRank scores and the number of
+        iterations each column ran for
+    """
+    if personalization.dim() == 1:
+        personalization = personalization.unsqueeze(1)
+    P_T = transpose_transition(P)
+    n_queries = personalization.shape[1]
+
+    x = _initial_guess(personalization, x0)
+    active = torch.ones(n_queries, dtype=torch.bool, device=personalization.device)
+    iterations = torch.zeros(n_queries, dtype=torch.long, device=personalization.device)
+    cols = torch.arange(n_queries, device=personalization.device)
+    for i in range(max_iter):
+        if cols.numel() == n_queries:
+            x_active, p_active = x, personalization
+        else:
+            x_active, p_active = x[:, cols], personalization[:, cols]
+        x_new = (1 - alpha) * p_active + alpha * (P_T @ x_active)
+        iterations[cols] += 1
+        if (i + 1) % check_every != 0 and i + 1 < max_iter:
+            x[:, cols] = x_new
+            continue
+        delta = (x_new - x_active).abs().sum(dim=0)
+        x[:, cols] = x_new
+        active[cols[delta < tol]] = False
+        cols = active.nonzero(as_tuple=True)[0]
+        if cols.numel() == 0:
+            break
+    return x, iterations
+
+
+def pagerank_residual(P_T: torch.Tensor, x: torch.Tensor, personalization: torch.Tensor, alpha: float) -> float:
+    """Max column L1 norm of (I - alpha P^T) x - (1 - alpha) p."""
+    residual = x - alpha * (P_T @ x) - (1 - alpha) * personalization
+    return float(residual.abs().sum(dim=0).max())
+
+
+def _as_matrix(personalization: torch.Tensor) -> Tuple[torch.Tensor, bool]:
+    if personalization.dim() == 1:
+        return personalization.unsqueeze(1), True
+    return personalization, False
+
+
+def _initial_guess(personalization: torch.Tensor, x0: Optional[torch.Tensor]) -> torch.Tensor:
+    if x0 is None:
+        return personalization.clone()
+    return x0.reshape(personalization.shape).to(dtype=personalization.dtype).clone()
+
+
+def _result(P_T, x, p, alpha, iterations, squeeze) -> PageRankResult:
+    residual = pagerank_residual(P_T, x, p, alpha)
+    return PageRankResult(x.squeeze(1) if squeeze else x, int(iterations), residual)
+
+
+def solve_power(P, personalization, alpha=0.85, max_iter=50, tol=1e-6, check_every=DEFAULT_CHECK_EVERY,
+                x0=None, **_) -> PageRankResult:
+    """Power iteration (the original solver), with optional sparser convergence checks."""
+    p, squeeze = _as_matrix(personalization)
+    x, iterations = run_pagerank_batched(P, p, alpha=alpha, max_iter=max_iter, tol=tol, check_every=check_every, x0=x0)
+    return _result(transpose_transition(P), x, p, alpha, iterations.max(), squeeze)
+
+
+def solve_extrapolated(P, personalization, alpha=0.85, max_iter=50, tol=1e-6, extrapolate_every=10,
+                       check_every=DEFAULT_CHECK_EVERY, x0=None, **_) -> PageRankResult:
+    """
+    Power iteration with periodic Aitken delta-squared extrapolation.
+
+    Every extrapolate_every iterations the last three iterates are combined
+    to cancel the dominant error term (convergence rate ~alpha), which
+    typically removes a large share of the iterations of the plain method.
+    Convergence is tested every check_every iterations, as in solve_power.
+    """
+    p, squeeze = _as_matrix(personalization)
+    P_T = transpose_transition(P)
+    x = _initial_guess(p, x0)
+    history = []
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        x_new = (1 - alpha) * p + alpha * (P_T @ x)
+        history = (history + [x_new])[-3:]
+        if iterations % extrapolate_every == 0 and len(history) == 3:
+            x_first, x_second, x_third = history
+            denominator = x_third - 2 * x_second + x_first
+            safe = denominator.abs() > 1e-12
+            step = torch.where(safe, (x_third - x_second) ** 2 / torch.where(safe, denominator, torch.ones_like(denominator)),
+                               torch.zeros_like(x_third))
+            extrapolated = (x_third - step).clamp(min=0)
+            # Keep the column mass of the current iterate.
+            x_new = extrapolated * (x_third.sum(dim=0, keepdim=True)
+                                    / extrapolated.sum(dim=0, keepdim=True).clamp(min=1e-30))
+            history = []
+        if iterations % check_every != 0 and iterations < max_iter:
+            x = x_new
+            continue
+        converged = bool((x_new - x).abs().sum(dim=0).max() < tol)
+        x = x_new
+        if converged:
+            break
+    return _result(P_T, x, p, alpha, iterations, squeeze)
+
+
+def solve_linear(P, personalization, alpha=0.85, max_iter=50, tol=1e-6, check_every=DEFAULT_CHECK_EVERY,
+                 x0=None, **_) -> PageRankResult:
+    """
+    Krylov solve of (I - alpha P^T) x = (1 - alpha) p with BiCGSTAB.
+
+    The system is non-symmetric, so plain CG does not apply; BiCGSTAB needs
+    two matvecs per iteration but no restart storage, and runs column-wise
+    on the whole (N, Q) block. Columns whose residual drops below tol are
+    frozen on the device, and the host only tests whether all are done every
+    check_every iterations.
+    """
+    p, squeeze = _as_matrix(personalization)
+    P_T = transpose_transition(P)
+
+    def A(v):
+        return v - alpha * (P_T @ v)
+
+    b = (1 - alpha) * p
+    x = _initial_guess(p, x0)
+    r = b - A(x)
+    r_hat = r.clone()
+    rho = alpha_k = omega = torch.ones(1, p.shape[1], dtype=p.dtype, device=p.device)
+    v = torch.zeros_like(p)
+    direction = torch.zeros_like(p)
+    done = torch.zeros(1, p.shape[1], dtype=torch.bool, device=p.device)
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        rho_new = (r_hat * r).sum(dim=0, keepdim=True)
+        beta = (rho_new / _nonzero(rho)) * (alpha_k / _nonzero(omega))
+        direction = r + beta * (direction - omega * v)
+        v = A(direction)
+        alpha_k = rho_new / _nonzero((r_hat * v).sum(dim=0, keepdim=True))
+        s = r - alpha_k * v
+        t = A(s)
+        omega = (t * s).sum(dim=0, keepdim=True) / _nonzero((t * t).sum(dim=0, keepdim=True))
+        # Further steps on a solved column only divide round-off by round-off.
+        x = torch.where(done, x, x + alpha_k * direction + omega * s)
+        r = torch.where(done, r, s - omega * t)
+        rho = rho_new
+        done = done | (r.abs().sum(dim=0, keepdim=True) < tol)
+        if (iterations % check_every == 0 or iterations == max_iter) and bool(done.all()):
+            break
+    return _result(P_T, x, p, alpha, iterations, squeeze)
+
+
+def _nonzero(t: torch.Tensor) -> torch.Tensor:
+    return torch.where(t.abs() < 1e-30, torch.full_like(t, 1e-30), t)
+
+
+def solve_push(P, personalization, alpha=0.85, max_iter=50, tol=1e-6, push_epsilon=1e-4,
+               P_csr: Optional[sp.csr_matrix] = None, **_) -> PageRankResult:
+    """
+    Local forward-push approximate PPR.
+
+    Starts with all mass as residual on the personalization vector. Every
+    round, each table whose residual exceeds push_epsilon keeps (1 - alpha)
+    of it as score and pushes the rest to its out-neighbours. Only rows of
+    tables with large residuals are ever read, so work is confined to the
+    neighbourhood of high-personalization tables. The final L1 residual
+    bounds the error of every score. Push always starts from zero scores,
+    so a warm start (x0) is ignored. Callers solving the same P repeatedly
+    pass its to_scipy_csr(P) as P_csr so it is converted once.
+    """
+    p, squeeze = _as_matrix(personalization)
+    if P_csr is None:
+        P_csr = to_scipy_csr(P)
+    estimate, rounds = forward_push(P_csr, p.detach().cpu().double().numpy(), alpha=alpha,
+                                    max_iter=max_iter, tol=tol, push_epsilon=push_epsilon)
+    x = torch.from_numpy(estimate).to(dtype=p.dtype, device=p.device)
+    return _result(transpose_transition(P), x, p, alpha, rounds, squeeze)
+
+
+def forward_push(P_csr: sp.csr_matrix, personalization: np.ndarray, alpha: float = 0.85, max_iter: int = 50,
+                 tol: float = 1e-6, push_epsilon: float = 1e-4) -> Tuple[np.ndarray, int]:
+    """NumPy core of solve_push on an (N, Q) personalization; returns (estimate, rounds)."""
+    r = np.array(personalization, dtype=np.float64)
+    estimate = np.zeros_like(r)
+    rounds = 0
+    for rounds in range(1, max_iter + 1):
+        frontier = np.nonzero((r > push_epsilon).any(axis=1))[0]
+        if len(frontier) == 0:
+            break
+        pushed = np.where(r[frontier] > push_epsilon, r[frontier], 0.0)
+        estimate[frontier] += (1 - alpha) * pushed
+        r[frontier] -= pushed
+        r += alpha * (P_csr[frontier].T @ pushed)
+        if r.sum(axis=0).max() < tol:
+            break
+    return estimate, rounds
+
+
+def to_scipy_csr(P: torch.Tensor) -> sp.csr_matrix:
+    """Float64 SciPy CSR copy of a dense or sparse torch transition matrix, as forward_push reads it."""
+    if P.is_sparse:
+        P = P.coalesce()
+        indices = P.indices().cpu().numpy()
+        values = P.values().detach().cpu().double().numpy()
+        return sp.csr_matrix((values, (indices[0], indices[1])), shape=tuple(P.shape))
+    return sp.csr_matrix(P.detach().cpu().double().numpy())
+
+
+PAGERANK_SOLVERS: Dict[str, Callable[..., PageRankResult]] = {
+    "power": solve_power,
+    "extrapolated": solve_extrapolated,
+    "linear": solve_linear,
+    "push": solve_push,
+}
+
+
+def solve_pagerank(P: torch.Tensor, personalization: torch.Tensor, solver: str = "power",
+                   alpha: float = 0.85, max_iter: int = 50, tol: float = 1e-6, **solver_kwargs) -> PageRankResult:
+    """
+    Run personalized PageRank with the named solver.
+
+    Args:
+        P: (N, N) row-stochastic transition matrix (dense or sparse COO)
+        personalization: (N,) vector or (N, Q) matrix
+        solver: One of PAGERANK_SOLVERS ("power", "extrapolated", "linear", "push")
+        alpha, max_iter, tol: As in run_pagerank_gpu
+        **solver_kwargs: Solver-specific options (check_every, extrapolate_every, push_epsilon, P_csr)
+                         and x0, a warm-start guess shaped like personalization
+
+    Returns:
+        PageRankResult(scores, iterations, residual)
+    """
+    if solver not in PAGERANK_SOLVERS:
+        raise ValueError(f"Unknown PageRank solver: {solver}. Choose from {sorted(PAGERANK_SOLVERS)}")
+    return PAGERANK_SOLVERS[solver](P, personalization, alpha=alpha, max_iter=max_iter, tol=tol, **solver_kwargs)
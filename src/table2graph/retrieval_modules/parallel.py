@@ -0,0 +1,159 @@
+"""
+Parallel Retrieval - Shared-memory indexes and an ordered process pool
+The parent publishes the kNN graph arrays once in shared memory; spawned
+workers map them without copying, so N workers hold one copy of the index
+instead of N. Table embeddings travel with the kNN graph, so a run
+without one shares none and each worker encodes its own tables
+"""
+
+import os
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+from .knn_graph import KnnTableGraph
+
+# Read by the BLAS / OpenMP runtimes when a spawned worker imports numpy and torch.
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def share_arrays(arrays: Dict[str, np.ndarray]) -> Tuple[Dict, List[SharedMemory]]:
+    """
+    Copy arrays into new shared-memory blocks.
+
+    Returns:
+        (spec, blocks): a picklable name -> (block name, shape, dtype) spec
+        for attach_arrays, and the blocks, which the caller must unlink
+    """
+    spec, blocks = {}, []
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        spec[name] = (block.name, array.shape, array.dtype.str)
+        blocks.append(block)
+    return spec, blocks
+
+
+def attach_arrays(spec: Dict) -> Tuple[Dict[str, np.ndarray], List[SharedMemory]]:
+    """Map the arrays of a share_arrays spec; keep the returned blocks alive as long as the arrays."""
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in spec.items():
+        block = SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        blocks.append(block)
+    return arrays, blocks
+
+
+def share_knn_graph(knn_graph: KnnTableGraph) -> Tuple[Dict, List[SharedMemory]]:
+    spec, blocks = share_arrays({
+        "data": knn_graph.graph.data,
+        "indices": knn_graph.graph.indices,
+        "indptr": knn_graph.graph.indptr,
+        "embeddings": knn_graph.embeddings,
+    })
+    handle = {"arrays": spec, "shape": knn_graph.graph.shape, "table_ids": knn_graph.table_ids,
+              "k": knn_graph.k, "similarity_threshold": knn_graph.similarity_threshold}
+    return handle, blocks
+
+
+def attach_knn_graph(handle: Dict) -> KnnTableGraph:
+    arrays, blocks = attach_arrays(handle["arrays"])
+    graph = sp.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=handle["shape"], copy=False)
+    knn_graph = KnnTableGraph(graph, handle["table_ids"], arrays["embeddings"], handle["k"],
+                              handle["similarity_threshold"], normalized=True)
+    knn_graph.shared_blocks = blocks
+    return knn_graph
+
+
+def pin_threads(n_threads: int) -> None:
+    """Limit this process's torch / BLAS thread pools so workers do not oversubscribe the cores."""
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+    torch.set_num_threads(n_threads)
+
+
+def _init_worker(n_threads: int, knn_graph_handle: Optional[Dict], initializer: Callable, initargs: Tuple) -> None:
+    pin_threads(n_threads)
+    knn_graph = attach_knn_graph(knn_graph_handle) if knn_graph_handle is not None else None
+    initializer(knn_graph, *initargs)
+
+
+def _restore_env(saved_env: Dict) -> None:
+    for var, value in saved_env.items():
+        if value is None:
+            os.environ.pop(var, None)
+        else:
+            os.environ[var] = value
+
+
+@contextmanager
+def worker_pool(workers: int, initializer: Callable, initargs: Tuple = (), threads_per_worker: Optional[int] = None,
+                knn_graph: Optional[KnnTableGraph] = None):
+    """
+    Spawn a process pool whose workers share the parent's kNN graph.
+
+    Each worker pins its thread count, maps the shared arrays and then calls
+    initializer(knn_graph, *initargs) to load its own models.
+    The shared blocks are unlinked when the pool is done.
+
+    Args:
+        workers: Worker processes
+        initializer: Per-worker setup, a module-level function
+        initargs: Extra picklable initializer arguments
+        threads_per_worker: Torch / BLAS threads per worker (default: cpu_count // workers)
+        knn_graph: Optional index to publish in shared memory
+    """
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    blocks = []
+    knn_graph_handle = None
+    if knn_graph is not None:
+        knn_graph_handle, graph_blocks = share_knn_graph(knn_graph)
+        blocks.extend(graph_blocks)
+
+    saved_env = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads_per_worker)
+    pool = None
+    try:
+        # spawn, not fork: forked torch / CUDA state is unsafe, and spawned children see the pinned env at import.
+        pool = get_context("spawn").Pool(workers, initializer=_init_worker,
+                                         initargs=(threads_per_worker, knn_graph_handle, initializer, initargs))
+        _restore_env(saved_env)
+        print(f"Started {workers} workers x {threads_per_worker} threads "
+              f"({sum(block.size for block in blocks) / 2**20:.1f} MiB index in shared memory)")
+        yield pool
+        pool.close()
+        pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _restore_env(saved_env)
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def imap_ordered(pool, fn: Callable, tasks: Iterable, max_pending: int) -> Iterator[Tuple]:
+    """
+    Like pool.imap, but with at most max_pending tasks submitted ahead of the
+    consumer, so a long task stream is not pickled into memory all at once.
+
+    Yields:
+        (task, result) pairs in task order
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append((task, pool.apply_async(fn, (task,))))
+        if len(pending) >= max_pending:
+            task, result = pending.popleft()
+            yield task, result.get()
+    while pending:
+        task, result = pending.popleft()
+        yield task, result.get()
@@ -0,0 +1,193 @@
+"""
+Typed Records - msgspec schemas for the JSONL records exchanged between stages
+Lines are decoded straight into compact structs (validated, no intermediate
+dicts) and encoded back without going through the json module. Structs also
+answer record["field"] / record.get("field") so dict-style readers keep working
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Type, Union
+
+import msgspec
+from msgspec import UNSET, UnsetType
+
+TableId = Union[int, str]
+
+
+class RecordDecodeError(ValueError):
+    """A malformed line in a record file, with its location."""
+
+    def __init__(self, path: str, line_no: int, message: str):
+        super().__init__(f"{path}, line {line_no}: {message}" if line_no else f"{path}: {message}")
+        self.path = path
+        self.line_no = line_no
+
+
+class Record(msgspec.Struct, gc=False):
+    """
+    Base of the record schemas. Optional fields default to UNSET, which is
+    left out when encoding, so a decoded record re-encodes to the same keys.
+    """
+
+    def __getitem__(self, name: str) -> Any:
+        value = getattr(self, name, UNSET) if name in self.__struct_fields__ else UNSET
+        if value is UNSET:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        setattr(self, name, value)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__struct_fields__ and getattr(self, name) is not UNSET
+
+    def get(self, name: str, default: Any = None) -> Any:
+        value = getattr(self, name, UNSET) if name in self.__struct_fields__ else UNSET
+        return default if value is UNSET else value
+
+    def to_dict(self) -> Dict:
+        return msgspec.to_builtins(self)
+
+
+class Table(Record):
+    header: List[Any]
+    rows: List[List[Any]]
+
+
+class TableRecord(Record, kw_only=True):
+    """One line of {dataset}_table.jsonl."""
+    split: Union[Optional[str], UnsetType] = UNSET
+    source_table_idx: Union[TableId, UnsetType] = UNSET
+    table_idx: TableId
+    caption: Union[Optional[str], UnsetType] = UNSET
+    table: Union[Table, UnsetType] = UNSET
+    example_query: Union[List[str], UnsetType] = UNSET
+
+
+class SchemaRecord(Record):
+    """One line of {dataset}_schema.jsonl."""
+    table_schema: str
+    source_table_idx: TableId
+    table_idx: TableId
+
+
+class ExampleQueryRecord(Record):
+    """One line of {dataset}_example_query.jsonl."""
+    example_query: str
+    source_table_idx: TableId
+    table_idx: TableId
+
+
+class QueryRecord(Record):
+    """One line of {dataset}_query.jsonl."""
+    query: str
+    source_table_idx: TableId
+    label: Any = None
+
+
+class ClusteredTables(Record):
+    clustered_tables: List[TableId]
+    size: int
+
+
+class ClusteredQuery(Record, kw_only=True):
+    """One line of {dataset}_clustered_tables_{method}.jsonl."""
+    source_table_idx: TableId
+    query: str
+    label: Any = None
+    clustered_tables: ClusteredTables
+
+
+class RetrievedTable(Record):
+    """A table embedded in full-format retrieval output (RETRIEVED_TABLE_FIELDS)."""
+    split: Optional[str] = None
+    source_table_idx: Optional[TableId] = None
+    table_idx: Optional[TableId] = None
+    caption: Optional[str] = None
+    table: Optional[Table] = None
+
+
+class RetrievalResult(Record, kw_only=True):
+    """
+    One line of *_retrieved_tables_schema_*.jsonl. Reference-format output
+    carries retrieved_scores and no retrieved_tables.
+    """
+    query: str
+    query_label: Any = None
+    source_table_idx: Union[TableId, UnsetType] = UNSET
+    retrieve_sub_table_idx: List[TableId]
+    ground_truth_sub_table_idx: List[TableId] = []
+    retrieved_tables: Union[List[RetrievedTable], UnsetType] = UNSET
+    retrieved_scores: Union[List[float], UnsetType] = UNSET
+
+
+class LLMOutput(Record, kw_only=True):
+    """
+    One line of the downstream output_*.jsonl files. call_llm.py writes
+    groundtruth / output and call_llm_v1.py writes ground_truth /
+    generated_text; either spelling decodes into groundtruth / output.
+    """
+    query: Any = None
+    groundtruth: Any = None
+    output: Optional[str] = None
+    ground_truth: Union[Any, UnsetType] = UNSET
+    generated_text: Union[Optional[str], UnsetType] = UNSET
+
+    def __post_init__(self):
+        if self.ground_truth is not UNSET:
+            if self.groundtruth is None:
+                self.groundtruth = self.ground_truth
+            self.ground_truth = UNSET
+        if self.generated_text is not UNSET:
+            if self.output is None:
+                self.output = self.generated_text
+            self.generated_text = UNSET
+
+
+_encoder = msgspec.json.Encoder()
+_decoders: Dict[Any, msgspec.json.Decoder] = {}
+
+
+def get_decoder(record_type: Optional[Type] = None) -> msgspec.json.Decoder:
+    """Cached JSON decoder for a record type (None: plain dicts / lists)."""
+    decoder = _decoders.get(record_type)
+    if decoder is None:
+        decoder = _decoders[record_type] = (msgspec.json.Decoder(record_type) if record_type is not None
+                                            else msgspec.json.Decoder())
+    return decoder
+
+
+def decode_line(line: Union[str, bytes], record_type: Optional[Type] = None, path: str = "<string>",
+                line_no: int = 0) -> Any:
+    """Decode one JSON line, raising RecordDecodeError with the file and line number if it is malformed."""
+    try:
+        return get_decoder(record_type).decode(line)
+    except (msgspec.ValidationError, msgspec.DecodeError) as e:
+        raise RecordDecodeError(path, line_no, str(e)) from None
+
+
+def convert_record(record: Dict, record_type: Optional[Type] = None, path: str = "<string>", line_no: int = 0) -> Any:
+    """Validate an already-decoded dict (e.g. an Arrow row) against a record type."""
+    if record_type is None:
+        return record
+    try:
+        return msgspec.convert(record, record_type)
+    except msgspec.ValidationError as e:
+        raise RecordDecodeError(path, line_no, str(e)) from None
+
+
+def encode_line(record: Any) -> str:
+    """One JSON line (without the newline) for a record, dict or list of either."""
+    return _encoder.encode(record).decode("utf-8")
+
+
+def iter_jsonl(path: str, record_type: Optional[Type] = None) -> Iterator[Any]:
+    """Stream the records of a JSONL file, skipping blank lines."""
+    decoder = get_decoder(record_type)
+    with open(path, "rb") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield decoder.decode(line)
+            except (msgspec.ValidationError, msgspec.DecodeError) as e:
+                raise RecordDecodeError(path, line_no, str(e)) from None
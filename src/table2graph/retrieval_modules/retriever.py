@@ -0,0 +1,201 @@
+"""
+Table Retriever - Resident index for online table retrieval
+Keeps the global kNN graph, table embeddings, a coarse cluster router and
+the table payloads in memory, so a query costs one encoder call plus a
+small PageRank over its candidate subgraph
+"""
+
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .backends import select_backend
+from .knn_graph import KnnTableGraph, normalize_rows
+from .ooc_kmeans import MemmapKMeans
+from .routing_tree import RoutingTree
+from .shrinking import shrink_and_rank
+
+
+class TableRetriever:
+    """
+    Query -> ranked table_idx list over a prebuilt KnnTableGraph.
+
+    Candidates are the tables of the leaves a RoutingTree beam search
+    reaches, the members of the nprobe clusters nearest to the query (flat
+    KMeans over the table embeddings, loaded from a saved router or fitted at
+    start-up), or the
+    candidate_k most similar tables when neither is configured. Candidates are
+    then ranked with the same iterative PageRank filtering as the
+    subgraph retrieval scripts.
+    """
+
+    def __init__(self, knn_graph: KnnTableGraph, encode_fn: Callable[[List[str]], np.ndarray],
+                 filter_topks: Sequence[int] = (50,), n_clusters: int = 0, nprobe: int = 4,
+                 candidate_k: int = 1000, alpha: float = 0.85, backend: str = "auto", device=None,
+                 sparse: bool = False, tables: Optional[Dict] = None, routing_tree: Optional[RoutingTree] = None,
+                 tree_branching: int = 0, leaf_size: int = 256, beam_width: int = 4, routing_score: str = "centroid",
+                 router: Optional[MemmapKMeans] = None, **pagerank_options):
+        """
+        Args:
+            knn_graph: Global table graph with its embeddings
+            encode_fn: Maps a list of query strings to a (Q, dim) array in the graph's embedding space
+            filter_topks: Tables kept after each PageRank round; the last value is the result size
+            n_clusters: KMeans clusters used for routing (0 disables routing)
+            nprobe: Clusters searched per query
+            candidate_k: Candidate-set size when routing is disabled
+            alpha: PageRank damping factor
+            backend: "auto", "torch" or "numpy" (see select_backend)
+            device: Torch device for the torch backend
+            sparse: Keep candidate graphs sparse instead of densifying the slice
+            tables: Optional table_idx -> table record mapping (dict or TableStore) for payloads
+            routing_tree: Prebuilt RoutingTree over the graph rows (takes precedence over n_clusters)
+            tree_branching: Build a RoutingTree with this many children per split (0: no tree)
+            leaf_size: Largest leaf of a built tree
+            beam_width: Tree nodes kept per level while routing
+            routing_score: "centroid" or "typical" (see RoutingTree.route)
+            router: Prefitted flat KMeans over the graph rows (MemmapKMeans.load; takes precedence over n_clusters)
+            **pagerank_options: Solver options (solver, check_every, push_epsilon)
+        """
+        self.knn_graph = knn_graph
+        self.encode_fn = encode_fn
+        self.filter_topks = list(filter_topks)
+        self.nprobe = nprobe
+        self.candidate_k = candidate_k
+        self.alpha = alpha
+        self.backend = backend
+        self.device = device
+        self.sparse = sparse
+        self.tables = tables or {}
+        self.pagerank_options = pagerank_options
+        self.warmed_up = False
+        self.beam_width = beam_width
+        self.routing_score = routing_score
+
+        self.routing_tree = routing_tree
+        if self.routing_tree is None and tree_branching:
+            self.routing_tree = RoutingTree.build(knn_graph.embeddings, branching=tree_branching, leaf_size=leaf_size)
+
+        self.router = None
+        self.cluster_members: Dict[int, np.ndarray] = {}
+        if router is not None and len(router.labels_) != len(knn_graph.table_ids):
+            raise ValueError(f"The router was fitted on {len(router.labels_)} tables, "
+                             f"the kNN graph has {len(knn_graph.table_ids)}")
+        if self.routing_tree is None and (router is not None or n_clusters):
+            self.router = router
+            if self.router is None:
+                self.router = MemmapKMeans(n_clusters=min(n_clusters, len(knn_graph.table_ids)))
+                self.router.fit(knn_graph.embeddings)
+            labels = np.asarray(self.router.labels_)
+            self.cluster_members = {c: np.nonzero(labels == c)[0] for c in range(self.router.n_clusters)}
+            self.centroids = normalize_rows(self.router.cluster_centers_)
+
+    def encode(self, queries: List[str]) -> np.ndarray:
+        """Normalized (Q, dim) query embeddings."""
+        return normalize_rows(np.asarray(self.encode_fn(queries), dtype=np.float32).reshape(len(queries), -1))
+
+    def candidates(self, query_norm: np.ndarray) -> np.ndarray:
+        """Graph rows of the candidate tables for one normalized query embedding."""
+        if self.routing_tree is not None:
+            return self.routing_tree.route(query_norm, beam_width=self.beam_width, score=self.routing_score,
+                                           embeddings=self.knn_graph.embeddings)["positions"]
+        if self.router is not None:
+            nearest = np.argsort(-(self.centroids @ query_norm))[:self.nprobe]
+            return np.sort(np.concatenate([self.cluster_members[c] for c in nearest]))
+        sims = self.knn_graph.embeddings @ query_norm
+        k = min(self.candidate_k, len(sims))
+        return np.sort(np.argpartition(-sims, k - 1)[:k])
+
+    def rank(self, query_norm: np.ndarray, top_k: Optional[int] = None) -> Dict:
+        """Rank the candidates of one encoded query; returns table ids and scores best-first."""
+        return self.rank_group(query_norm[None, :], self.candidates(query_norm), [top_k])[0]
+
+    def rank_group(self, query_norms: np.ndarray, positions: np.ndarray,
+                   top_ks: Sequence[Optional[int]]) -> List[Dict]:
+        """
+        Rank queries that share one candidate set.
+
+        The graph slice, the personalization matrix and the first PageRank
+        round are computed once for the whole (N, Q) group; only the later
+        shrinking rounds run per query.
+        """
+        backend = select_backend(len(positions), device=self.device,
+                                 solver=self.pagerank_options.get("solver", "power"), preferred=self.backend)
+        S = backend.from_scipy(self.knn_graph.graph[positions][:, positions], sparse=self.sparse)
+        R_norm = backend.asarray(self.knn_graph.embeddings[positions])
+        personalization = backend.personalization(R_norm, query_norms)
+        first_scores = backend.pagerank(backend.transition(S), personalization, alpha=self.alpha,
+                                        **self.pagerank_options).scores
+        results = []
+        for column, top_k in enumerate(top_ks):
+            keep_counts = list(self.filter_topks)
+            if top_k is not None:
+                keep_counts[-1] = min(keep_counts[-1], top_k)
+            keep, scores = shrink_and_rank(backend, S, personalization[:, column], keep_counts,
+                                           scores=first_scores[:, column], alpha=self.alpha, **self.pagerank_options)
+            results.append({
+                "table_idx": [self.knn_graph.table_ids[positions[i]] for i in backend.tolist(keep)],
+                "scores": backend.tolist(scores),
+                "n_candidates": int(len(positions)),
+            })
+        return results
+
+    def retrieve_batch(self, queries: List[str], top_k=None, include_tables=False) -> List[Dict]:
+        """
+        Encode the queries in one encoder call and rank them, batching the
+        PageRank of queries routed to the same candidate set.
+
+        Args:
+            queries: Query strings
+            top_k: One cap for all queries, or a per-query sequence (None entries use filter_topks)
+            include_tables: One flag for all queries, or a per-query sequence
+        """
+        top_ks = list(top_k) if isinstance(top_k, (list, tuple)) else [top_k] * len(queries)
+        with_tables = (list(include_tables) if isinstance(include_tables, (list, tuple))
+                       else [include_tables] * len(queries))
+        start = time.perf_counter()
+        query_norms = self.encode(queries)
+        encode_ms = (time.perf_counter() - start) * 1e3
+
+        groups: Dict[bytes, List[int]] = {}
+        group_positions = {}
+        for pos, query_norm in enumerate(query_norms):
+            positions = self.candidates(query_norm)
+            key = positions.tobytes()
+            groups.setdefault(key, []).append(pos)
+            group_positions[key] = positions
+
+        results: List[Optional[Dict]] = [None] * len(queries)
+        for key, members in groups.items():
+            rank_start = time.perf_counter()
+            ranked = self.rank_group(query_norms[members], group_positions[key], [top_ks[pos] for pos in members])
+            rank_ms = (time.perf_counter() - rank_start) * 1e3
+            for pos, result in zip(members, ranked):
+                result = {"query": queries[pos], **result}
+                if with_tables[pos]:
+                    result["tables"] = [self.tables.get(table_idx) for table_idx in result["table_idx"]]
+                result["latency_ms"] = {"encode": encode_ms, "rank": rank_ms}
+                result["group_size"] = len(members)
+                results[pos] = result
+        return results
+
+    def retrieve(self, query: str, top_k: Optional[int] = None, include_tables: bool = False) -> Dict:
+        return self.retrieve_batch([query], top_k=top_k, include_tables=include_tables)[0]
+
+    def warm_up(self, queries: Sequence[str] = ("warm up query",)) -> float:
+        """Run a few throw-away queries (lazy CUDA/BLAS init, allocator caches); returns seconds taken."""
+        start = time.perf_counter()
+        self.retrieve_batch(list(queries))
+        self.warmed_up = True
+        return time.perf_counter() - start
+
+    def stats(self) -> Dict:
+        return {
+            **self.knn_graph.stats(),
+            "n_clusters": self.router.n_clusters if self.router is not None else 0,
+            "nprobe": self.nprobe,
+            "routing_tree": self.routing_tree.stats() if self.routing_tree is not None else None,
+            "beam_width": self.beam_width,
+            "filter_topks": self.filter_topks,
+            "warmed_up": self.warmed_up,
+        }
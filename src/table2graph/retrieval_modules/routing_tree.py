@@ -0,0 +1,191 @@
+"""
+Routing Tree - Hierarchical KMeans routing over table embeddings
+Clusters larger than leaf_size are split recursively into sub-clusters with
+their own centroids and typical tables. A query descends the tree with a
+beam, so routing costs about beam_width * branching * depth centroid
+comparisons and ends in a few small leaf sets for PageRank
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .knn_graph import normalize_rows
+from .ooc_kmeans import MemmapKMeans, select_typical_indices_chunked
+
+ROUTING_SCORES = ("centroid", "typical")
+
+
+class RoutingTree:
+    """
+    A KMeans tree stored as flat arrays (CSR-style child, member and typical lists).
+
+    Node 0 is the root. Leaves own the table rows (knn_graph positions) below
+    them; every node except the root has a normalized centroid and up to
+    typical_k typical rows, the members closest to that centroid.
+    """
+
+    def __init__(self, centroids: np.ndarray, child_ptr: np.ndarray, children: np.ndarray,
+                 member_ptr: np.ndarray, members: np.ndarray, typical_ptr: np.ndarray, typical: np.ndarray,
+                 depth: np.ndarray, branching: int, leaf_size: int):
+        self.centroids = centroids
+        self.child_ptr = child_ptr
+        self.children = children
+        self.member_ptr = member_ptr
+        self.members = members
+        self.typical_ptr = typical_ptr
+        self.typical = typical
+        self.depth = depth
+        self.branching = branching
+        self.leaf_size = leaf_size
+        self.is_leaf = np.diff(child_ptr) == 0
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, branching: int = 16, leaf_size: int = 256, typical_k: int = 8,
+              chunk_size: int = 4096, random_state: int = 42) -> "RoutingTree":
+        """
+        Split embeddings top-down until every leaf holds at most leaf_size rows.
+
+        Args:
+            embeddings: (N, dim) table embeddings (e.g. KnnTableGraph.embeddings), rows are positions
+            branching: KMeans clusters per split
+            leaf_size: Largest node kept as a leaf
+            typical_k: Typical rows kept per node (used by score="typical")
+            chunk_size: MemmapKMeans chunk size
+            random_state: KMeans seed
+        """
+        embeddings = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        centroids: List[np.ndarray] = [np.zeros(embeddings.shape[1], dtype=np.float32)]
+        children: List[List[int]] = [[]]
+        members: List[np.ndarray] = [np.arange(len(embeddings))]
+        typical: List[np.ndarray] = [np.empty(0, dtype=np.int64)]
+        depth = [0]
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            rows = members[node]
+            if len(rows) <= leaf_size:
+                continue
+            features = embeddings[rows]
+            # Nodes just above leaf_size split into a few leaf-sized children, not branching tiny ones.
+            n_clusters = min(branching, max(2, -(-len(rows) // leaf_size)))
+            kmeans = MemmapKMeans(n_clusters=n_clusters, chunk_size=chunk_size,
+                                  random_state=random_state).fit(features)
+            labels = np.asarray(kmeans.labels_)
+            groups = [np.nonzero(labels == c)[0] for c in range(kmeans.n_clusters)]
+            if sum(len(group) > 0 for group in groups) < 2:
+                continue  # identical embeddings cannot be split; keep an oversized leaf
+            typical_rows = select_typical_indices_chunked(features, labels, kmeans.cluster_centers_, typical_k,
+                                                          chunk_size=chunk_size)
+            cluster_centers = normalize_rows(kmeans.cluster_centers_.astype(np.float32))
+            for c, group in enumerate(groups):
+                if len(group) == 0:
+                    continue
+                child = len(members)
+                children[node].append(child)
+                children.append([])
+                centroids.append(cluster_centers[c])
+                members.append(rows[group])
+                typical.append(rows[typical_rows[c]])
+                depth.append(depth[node] + 1)
+                stack.append(child)
+            members[node] = np.empty(0, dtype=np.int64)  # only leaves keep their rows
+
+        def flatten(lists):
+            ptr = np.zeros(len(lists) + 1, dtype=np.int64)
+            ptr[1:] = np.cumsum([len(values) for values in lists])
+            values = np.concatenate([np.asarray(values, dtype=np.int64) for values in lists]) if lists else []
+            return ptr, np.asarray(values, dtype=np.int64)
+
+        child_ptr, child_ids = flatten(children)
+        member_ptr, member_rows = flatten(members)
+        typical_ptr, typical_rows = flatten(typical)
+        return cls(np.stack(centroids), child_ptr, child_ids, member_ptr, member_rows, typical_ptr, typical_rows,
+                   np.asarray(depth, dtype=np.int32), branching, leaf_size)
+
+    def node_members(self, node: int) -> np.ndarray:
+        return self.members[self.member_ptr[node]:self.member_ptr[node + 1]]
+
+    def _scores(self, nodes: np.ndarray, query_norm: np.ndarray, embeddings: Optional[np.ndarray]) -> np.ndarray:
+        if embeddings is None:
+            return self.centroids[nodes] @ query_norm
+        # Mean similarity to the node's typical tables, as the cluster scripts route queries.
+        return np.array([float(np.mean(embeddings[self.typical[self.typical_ptr[n]:self.typical_ptr[n + 1]]]
+                                       @ query_norm)) for n in nodes])
+
+    def route(self, query_norm: np.ndarray, beam_width: int = 4, score: str = "centroid",
+              embeddings: Optional[np.ndarray] = None) -> Dict:
+        """
+        Descend the tree keeping the beam_width best nodes per level.
+
+        Leaves reached early stay in the beam and compete with the deeper
+        nodes of the next level.
+
+        Args:
+            query_norm: (dim,) normalized query embedding
+            beam_width: Nodes kept per level (also the most leaves returned)
+            score: "centroid" (dot product with the node centroid) or "typical"
+                   (mean similarity to the node's typical tables; needs embeddings)
+            embeddings: Normalized table embeddings, for score="typical"
+
+        Returns:
+            {"positions": sorted table rows of the selected leaves,
+             "leaves": selected leaf nodes, "comparisons": node scores computed}
+        """
+        if score not in ROUTING_SCORES:
+            raise ValueError(f"Unknown routing score {score}. Choose from {ROUTING_SCORES}")
+        if score == "centroid":
+            embeddings = None
+        elif embeddings is None:
+            raise ValueError("score='typical' needs the table embeddings")
+        beam = np.zeros(1, dtype=np.int64)
+        beam_scores = np.zeros(1)
+        comparisons = 0
+        while not self.is_leaf[beam].all():
+            expand = beam[~self.is_leaf[beam]]
+            children = np.concatenate([self.children[self.child_ptr[n]:self.child_ptr[n + 1]] for n in expand])
+            child_scores = self._scores(children, query_norm, embeddings)
+            comparisons += len(children)
+            kept_leaves = self.is_leaf[beam]
+            pool = np.concatenate([beam[kept_leaves], children])
+            pool_scores = np.concatenate([beam_scores[kept_leaves], child_scores])
+            order = np.argsort(-pool_scores, kind="stable")[:beam_width]
+            beam, beam_scores = pool[order], pool_scores[order]
+        positions = np.concatenate([self.node_members(n) for n in beam])
+        return {"positions": np.sort(positions), "leaves": beam.tolist(), "comparisons": comparisons}
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            centroids=self.centroids,
+            child_ptr=self.child_ptr,
+            children=self.children,
+            member_ptr=self.member_ptr,
+            members=self.members,
+            typical_ptr=self.typical_ptr,
+            typical=self.typical,
+            depth=self.depth,
+            branching=np.array(self.branching),
+            leaf_size=np.array(self.leaf_size),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "RoutingTree":
+        data = np.load(path)
+        return cls(data["centroids"], data["child_ptr"], data["children"], data["member_ptr"], data["members"],
+                   data["typical_ptr"], data["typical"], data["depth"], int(data["branching"]),
+                   int(data["leaf_size"]))
+
+    def stats(self) -> Dict:
+        leaves = np.nonzero(self.is_leaf)[0]
+        leaf_sizes = np.diff(self.member_ptr)[leaves]
+        return {
+            "n_nodes": int(len(self.depth)),
+            "n_leaves": int(len(leaves)),
+            "depth": int(self.depth.max()),
+            "branching": self.branching,
+            "leaf_size": self.leaf_size,
+            "mean_leaf_size": float(leaf_sizes.mean()),
+            "max_leaf_size": int(leaf_sizes.max()),
+        }
@@ -0,0 +1,133 @@
+"""
+Run Journal - Checkpointed, resumable JSONL output for long retrieval runs
+
+Output lines are written in chunks. A chunk counts as committed once its
+journal record (query keys, byte range, SHA-256, counters) is on disk, so a
+crash at any point loses at most the uncommitted tail, which --resume trims.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+
+class RunJournal:
+    """
+    Chunked writer for a JSONL output file plus a journal of committed chunks.
+
+    Usage:
+        with RunJournal(output_file, resume=args.resume) as journal:
+            for key, line in results:
+                if not journal.is_done(key):
+                    journal.add(key, line, total=1)
+    """
+
+    def __init__(self, output_file: str, journal_file: Optional[str] = None, chunk_size: int = 50,
+                 resume: bool = False):
+        self.output_file = output_file
+        self.journal_file = journal_file or output_file + ".journal"
+        self.chunk_size = chunk_size
+        # Keys of the chunks recovered by --resume. Keys committed by this run are not kept, so a long
+        # streaming run holds no per-query state; input keys are unique, so none is seen twice.
+        self.done_keys = set()
+        self.counters: Dict[str, int] = {}
+        self._pending_keys: List[str] = []
+        self._pending_lines: List[str] = []
+        self._pending_counters: Dict[str, int] = {}
+
+        if resume:
+            self._recover()
+        else:
+            # A fresh run replaces earlier output instead of appending to it.
+            open(self.output_file, "w").close()
+            open(self.journal_file, "w").close()
+
+    def _recover(self) -> None:
+        """Keep the committed chunks whose bytes still verify; trim everything after them."""
+        records = []
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break  # torn final record: the chunk was never committed
+
+        verified = []
+        offset = 0
+        if os.path.exists(self.output_file):
+            with open(self.output_file, "rb") as f:
+                for record in records:
+                    f.seek(record["start"])
+                    data = f.read(record["end"] - record["start"])
+                    if record["start"] != offset or hashlib.sha256(data).hexdigest() != record["sha256"]:
+                        print(f"Output integrity check failed at chunk {len(verified)}; "
+                              f"discarding it and {len(records) - len(verified) - 1} later chunks.")
+                        break
+                    verified.append(record)
+                    offset = record["end"]
+
+        with open(self.output_file, "ab") as f:
+            f.truncate(offset)
+        tmp_file = self.journal_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for record in verified:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.journal_file)
+
+        for record in verified:
+            self.done_keys.update(record["keys"])
+            for name, value in record.get("counters", {}).items():
+                self.counters[name] = self.counters.get(name, 0) + value
+        print(f"Resuming: {len(self.done_keys)} queries already completed in {len(verified)} chunks.")
+
+    def is_done(self, key: str) -> bool:
+        """Whether key was completed by the run being resumed."""
+        return key in self.done_keys
+
+    def add(self, key: str, line: str, **counters: int) -> None:
+        """Queue one output line; counters (e.g. total=1) are summed per chunk and restored on resume."""
+        self._pending_keys.append(key)
+        self._pending_lines.append(line if line.endswith("\n") else line + "\n")
+        for name, value in counters.items():
+            self._pending_counters[name] = self._pending_counters.get(name, 0) + value
+            self.counters[name] = self.counters.get(name, 0) + value
+        if len(self._pending_keys) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Append the pending chunk to the output, fsync it, then commit its journal record."""
+        if not self._pending_keys:
+            return
+        data = "".join(self._pending_lines).encode("utf-8")
+        with open(self.output_file, "ab") as f:
+            start = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        record = {
+            "keys": self._pending_keys,
+            "start": start,
+            "end": start + len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "counters": self._pending_counters,
+        }
+        with open(self.journal_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending_keys, self._pending_lines, self._pending_counters = [], [], {}
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "RunJournal":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # Completed results are committed even if the run stops with an exception.
+        self.close()
+
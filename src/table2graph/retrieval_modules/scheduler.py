@@ -0,0 +1,201 @@
+"""
+Micro-Batch Scheduler - Dynamic batching of concurrent retrieval requests
+Requests are held for a short window (or until a batch fills), encoded in
+one forward pass and ranked with TableRetriever.retrieve_batch, then the
+results are fanned back out to the waiting callers
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from .retriever import TableRetriever
+
+
+class _Pending:
+    """One queued request; ordered by (higher priority, earlier deadline, arrival)."""
+
+    __slots__ = ("sort_key", "query", "top_k", "include_tables", "arrival", "deadline", "future")
+
+    def __init__(self, seq: int, query: str, top_k: Optional[int], include_tables: bool, priority: int,
+                 arrival: float, deadline: float, future: asyncio.Future):
+        self.sort_key = (-priority, deadline, seq)
+        self.query = query
+        self.top_k = top_k
+        self.include_tables = include_tables
+        self.arrival = arrival
+        self.deadline = deadline
+        self.future = future
+
+    def __lt__(self, other: "_Pending") -> bool:
+        return self.sort_key < other.sort_key
+
+
+class MicroBatchScheduler:
+    """
+    asyncio front end that turns concurrent retrieve() calls into batches.
+
+    A batch is dispatched when max_batch_size requests are queued, when the
+    oldest request has waited max_wait_ms, or earlier if waiting longer would
+    make a queued request miss its deadline (judged by a running estimate of
+    batch service time). When more requests are queued than fit in a batch,
+    higher priority and then earlier deadline go first, so short interactive
+    queries overtake bulk traffic.
+
+    Batches run one at a time on a dedicated worker thread; requests that
+    arrive meanwhile queue up, so batch size grows with load.
+    """
+
+    def __init__(self, retriever: TableRetriever, max_batch_size: int = 32, max_wait_ms: float = 2.0,
+                 service_time_decay: float = 0.8):
+        """
+        Args:
+            retriever: Loaded TableRetriever
+            max_batch_size: Requests encoded and ranked together at most
+            max_wait_ms: Longest time the oldest queued request waits for the batch to fill
+            service_time_decay: Weight of the previous estimate in the batch service-time moving average
+        """
+        self.retriever = retriever
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1e3
+        self.service_time_decay = service_time_decay
+        self.service_time = 0.0
+        self._queue: List[_Pending] = []
+        self._seq = itertools.count()
+        self._arrived: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.batches = 0
+        self.requests = 0
+        self.deadline_misses = 0
+
+    async def retrieve(self, query: str, top_k: Optional[int] = None, include_tables: bool = False,
+                       priority: int = 0, deadline_ms: Optional[float] = None) -> Dict:
+        """
+        Queue one query and wait for its result.
+
+        Args:
+            query: Query string
+            top_k: Optional cap on returned tables
+            include_tables: Attach table payloads
+            priority: Higher values are dispatched first when the queue is longer than one batch
+            deadline_ms: Optional latency budget from now; tightens the batching window
+
+        Returns:
+            The retrieve_batch result, plus a "queue" entry in latency_ms and the dispatched batch size
+        """
+        loop = asyncio.get_running_loop()
+        self._start()
+        now = loop.time()
+        deadline = now + deadline_ms / 1e3 if deadline_ms is not None else math.inf
+        pending = _Pending(next(self._seq), query, top_k, include_tables, priority, now, deadline,
+                           loop.create_future())
+        heapq.heappush(self._queue, pending)
+        self._arrived.set()
+        return await pending.future
+
+    async def warm_up(self, queries: Sequence[str] = ("warm up query",)) -> float:
+        """
+        TableRetriever.warm_up through the batch worker, so warm-up queries
+        never run concurrently with a live batch; returns seconds taken.
+        """
+        start = time.perf_counter()
+        await asyncio.gather(*(self.retrieve(query) for query in queries))
+        self.retriever.warmed_up = True
+        return time.perf_counter() - start
+
+    def _start(self) -> None:
+        """Start the worker lazily, on the loop that serves requests."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval-batch")
+            self._arrived = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+    def _window_close(self) -> float:
+        """Loop time at which the current batch must be dispatched."""
+        close_at = min(pending.arrival for pending in self._queue) + self.max_wait
+        earliest_deadline = min(pending.deadline for pending in self._queue)
+        return min(close_at, earliest_deadline - self.service_time)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            while not self._queue:
+                self._arrived.clear()
+                await self._arrived.wait()
+
+            while len(self._queue) < self.max_batch_size:
+                timeout = self._window_close() - loop.time()
+                if timeout <= 0:
+                    break
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = [heapq.heappop(self._queue) for _ in range(min(self.max_batch_size, len(self._queue)))]
+            batch = [pending for pending in batch if not pending.future.done()]  # caller went away
+            if not batch:
+                continue
+
+            start = loop.time()
+            try:
+                results = await loop.run_in_executor(self._executor, self._process, batch)
+            except Exception as e:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+                continue
+            finished = loop.time()
+            self.service_time = (self.service_time_decay * self.service_time
+                                 + (1 - self.service_time_decay) * (finished - start))
+            self.batches += 1
+            self.requests += len(batch)
+            for pending, result in zip(batch, results):
+                result["latency_ms"]["queue"] = (start - pending.arrival) * 1e3
+                result["batch_size"] = len(batch)
+                if finished > pending.deadline:
+                    self.deadline_misses += 1
+                if not pending.future.done():
+                    pending.future.set_result(result)
+
+    def _process(self, batch: List[_Pending]) -> List[Dict]:
+        return self.retriever.retrieve_batch([pending.query for pending in batch],
+                                             top_k=[pending.top_k for pending in batch],
+                                             include_tables=[pending.include_tables for pending in batch])
+
+    async def stop(self) -> None:
+        """Cancel the worker and fail any still-queued requests."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        while self._queue:
+            pending = heapq.heappop(self._queue)
+            if not pending.future.done():
+                pending.future.set_exception(RuntimeError("Scheduler stopped"))
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1e3,
+            "queued": len(self._queue),
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "service_time_ms": self.service_time * 1e3,
+            "deadline_misses": self.deadline_misses,
+        }
@@ -0,0 +1,101 @@
+"""
+Retrieval Service - HTTP front end for a resident TableRetriever
+
+Endpoints:
+    GET  /health    liveness plus index statistics
+    POST /warmup    run throw-away queries before taking traffic
+    POST /retrieve  {"query": str, "top_k": int?, "include_tables": bool?,
+                     "priority": int?, "deadline_ms": number?}
+                    -> {"table_idx": [...], "scores": [...], ...}
+"""
+
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+import msgspec
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from .retriever import TableRetriever
+from .scheduler import MicroBatchScheduler
+
+
+class RecordJSONResponse(JSONResponse):
+    """JSON response encoded with msgspec, so results may embed TableRecord payloads."""
+
+    def render(self, content: Any) -> bytes:
+        return msgspec.json.encode(content)
+
+
+def parse_retrieve_request(body) -> Dict:
+    """Validate a /retrieve body; raises ValueError with a client-facing message."""
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object")
+    query = body.get("query")
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("'query' must be a non-empty string")
+    top_k = body.get("top_k")
+    if top_k is not None and (not isinstance(top_k, int) or isinstance(top_k, bool) or top_k < 1):
+        raise ValueError("'top_k' must be a positive integer")
+    priority = body.get("priority", 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        raise ValueError("'priority' must be an integer")
+    deadline_ms = body.get("deadline_ms")
+    if deadline_ms is not None and (not isinstance(deadline_ms, (int, float)) or isinstance(deadline_ms, bool)
+                                    or deadline_ms <= 0):
+        raise ValueError("'deadline_ms' must be a positive number")
+    return {"query": query, "top_k": top_k, "include_tables": bool(body.get("include_tables", False)),
+            "priority": priority, "deadline_ms": deadline_ms}
+
+
+def create_app(retriever: TableRetriever, scheduler: Optional[MicroBatchScheduler] = None) -> Starlette:
+    """
+    Build the Starlette app around an already-loaded retriever.
+
+    Encoding and ranking are blocking (torch / NumPy), so they run off the
+    event loop and it stays free for health checks. With a scheduler,
+    concurrent /retrieve calls are micro-batched and honour the priority and
+    deadline_ms hints; without one each request runs on its own in the
+    threadpool and the hints are ignored. /warmup goes through the scheduler
+    too, so it is serialized with the batches it would otherwise race.
+    """
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        if scheduler is not None:
+            await scheduler.stop()
+
+    async def health(request: Request) -> JSONResponse:
+        stats = retriever.stats()
+        if scheduler is not None:
+            stats["scheduler"] = scheduler.stats()
+        return JSONResponse({"status": "ok", **stats})
+
+    async def warmup(request: Request) -> JSONResponse:
+        if scheduler is not None:
+            seconds = await scheduler.warm_up()
+        else:
+            seconds = await run_in_threadpool(retriever.warm_up)
+        return JSONResponse({"warmed_up": True, "seconds": seconds})
+
+    async def retrieve(request: Request) -> JSONResponse:
+        try:
+            params = parse_retrieve_request(await request.json())
+        except ValueError as e:  # includes malformed JSON
+            return JSONResponse({"error": str(e)}, status_code=400)
+        if scheduler is not None:
+            result = await scheduler.retrieve(**params)
+        else:
+            result = await run_in_threadpool(retriever.retrieve, params["query"], params["top_k"],
+                                             params["include_tables"])
+        return RecordJSONResponse(result)
+
+    return Starlette(lifespan=lifespan, routes=[
+        Route("/health", health, methods=["GET"]),
+        Route("/warmup", warmup, methods=["POST"]),
+        Route("/retrieve", retrieve, methods=["POST"]),
+    ])
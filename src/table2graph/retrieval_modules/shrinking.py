@@ -0,0 +1,81 @@
+"""
+Incremental Candidate Shrinking - Index-tensor helpers for the filtering rounds
+Survivors of a round are a subgraph of the previous graph, so each round
+slices instead of re-encoding and rebuilding
+"""
+
+from typing import Optional, Sequence, Tuple
+
+import torch
+
+
+def slice_similarity(S: torch.Tensor, keep: torch.Tensor) -> torch.Tensor:
+    """
+    Induced subgraph of the kept candidates, in the order given by keep.
+
+    Args:
+        S: (N, N) similarity matrix (dense or sparse COO)
+        keep: (n,) long tensor of row positions into S
+
+    Returns:
+        (n, n) similarity matrix of the same layout as S
+    """
+    keep = keep.to(S.device)
+    if S.is_sparse:
+        return torch.index_select(torch.index_select(S, 0, keep), 1, keep).coalesce()
+    return S.index_select(0, keep).index_select(1, keep)
+
+
+def restrict_distribution(v: torch.Tensor, keep: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """
+    Restrict a probability vector (or (N, Q) columns) to the kept rows and
+    renormalize. Columns with no remaining mass become uniform, as in
+    compute_personalization_vector.
+    """
+    if keep is not None:
+        v = v.index_select(0, keep.to(v.device))
+    totals = v.sum(dim=0, keepdim=True)
+    uniform = torch.ones_like(v) / v.shape[0]
+    return torch.where(totals > 0, v / totals.clamp(min=1e-30), uniform)
+
+
+def shrink_and_rank(backend, S, personalization, keep_counts: Sequence[int], scores=None, alpha: float = 0.85,
+                    max_iter: int = 50, tol: float = 1e-6, final_rerank: bool = False,
+                    **pagerank_options) -> Tuple:
+    """
+    Iterative PageRank filtering of one candidate graph, as in the retrieval scripts.
+
+    Round i keeps the keep_counts[i] best tables; every round after the first
+    slices the graph to the survivors and warm-starts from their scores.
+
+    Args:
+        backend: TorchBackend or NumpyBackend the inputs belong to
+        S: (N, N) candidate similarity matrix
+        personalization: (N,) personalization vector over the candidates
+        keep_counts: Tables kept after each round
+        scores: Optional first-round scores (e.g. from a PPR basis); computed if None
+        alpha, max_iter, tol: PageRank parameters
+        final_rerank: Run one more PageRank over the final survivors
+        **pagerank_options: Solver options (solver, check_every, push_epsilon)
+
+    Returns:
+        (keep, scores): candidate positions best-first and their scores
+    """
+    keep = backend.arange(personalization.shape[0])
+    for iteration, keep_count in enumerate(keep_counts):
+        if iteration > 0 or scores is None:
+            P = backend.transition(S if iteration == 0 else backend.slice(S, keep))
+            x0 = backend.restrict(scores) if scores is not None else None
+            scores = backend.pagerank(P, backend.restrict(personalization, keep), alpha=alpha, max_iter=max_iter,
+                                      tol=tol, x0=x0, **pagerank_options).scores
+        scores, top = backend.topk(scores, min(keep_count, len(keep)))
+        keep = keep[top]
+        if len(keep) == 1:
+            break
+    if final_rerank:
+        P = backend.transition(backend.slice(S, keep))
+        final_scores = backend.pagerank(P, backend.restrict(personalization, keep), alpha=alpha, max_iter=max_iter,
+                                        tol=tol, x0=backend.restrict(scores), **pagerank_options).scores
+        scores, order = backend.topk(final_scores, len(keep))
+        keep = keep[order]
+    return keep, scores
@@ -0,0 +1,67 @@
+"""
+Sparse Similarity Graph - Top-k + threshold table graph as torch sparse tensors
+Per-query memory and PageRank cost scale with edges instead of N^2
+"""
+
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+
+def sparse_similarity_from_embeddings(R_norm: torch.Tensor, top_k: int = 20,
+                                      similarity_threshold: float = 0.3,
+                                      block_size: int = 1024) -> torch.Tensor:
+    """
+    Build a symmetric sparse similarity matrix from normalized embeddings.
+
+    Each row keeps its top_k most similar tables (self included, like the
+    diagonal of the dense matrix) whose similarity is >= similarity_threshold.
+    Rows are processed in blocks, so at most block_size x N similarities
+    are resident at once.
+
+    Args:
+        R_norm: (N, dim) L2-normalized embeddings
+        top_k: Neighbours kept per table
+        similarity_threshold: Minimum cosine similarity for an edge
+        block_size: Rows compared per block
+
+    Returns:
+        (N, N) coalesced torch sparse COO tensor on R_norm's device
+    """
+    n_tables = R_norm.shape[0]
+    k = min(top_k, n_tables)
+    rows, cols, vals = [], [], []
+    for start in range(0, n_tables, block_size):
+        sims = R_norm[start:start + block_size] @ R_norm.T
+        top_vals, top_cols = torch.topk(sims, k, dim=1)
+        keep = top_vals >= similarity_threshold
+        block_rows = torch.arange(start, start + sims.shape[0], device=R_norm.device).unsqueeze(1).expand_as(top_cols)
+        rows.append(block_rows[keep])
+        cols.append(top_cols[keep])
+        vals.append(top_vals[keep])
+    rows, cols, vals = torch.cat(rows), torch.cat(cols), torch.cat(vals)
+
+    # Symmetrize: an edge chosen by either endpoint is kept once. Similarities
+    # are symmetric, so averaging duplicates recovers the original value.
+    indices = torch.cat([torch.stack([rows, cols]), torch.stack([cols, rows])], dim=1)
+    summed = torch.sparse_coo_tensor(indices, torch.cat([vals, vals]), (n_tables, n_tables)).coalesce()
+    counts = torch.sparse_coo_tensor(indices, torch.ones(indices.shape[1], device=R_norm.device, dtype=vals.dtype),
+                                     (n_tables, n_tables)).coalesce()
+    return torch.sparse_coo_tensor(summed.indices(), summed.values() / counts.values(),
+                                   (n_tables, n_tables)).coalesce()
+
+
+def sparse_row_normalize(S: torch.Tensor, eps: float = 1e-10) -> torch.Tensor:
+    """Sparse equivalent of S / (S.sum(dim=1, keepdim=True) + eps)."""
+    S = S.coalesce()
+    row_sum = torch.sparse.sum(S, dim=1).to_dense()
+    rows = S.indices()[0]
+    return torch.sparse_coo_tensor(S.indices(), S.values() / (row_sum[rows] + eps), S.shape).coalesce()
+
+
+def scipy_to_torch_sparse(S: sp.spmatrix, device=None) -> torch.Tensor:
+    """Convert a scipy sparse matrix (e.g. a kNN graph slice) to a coalesced torch COO tensor."""
+    coo = S.tocoo()
+    indices = torch.from_numpy(np.vstack([coo.row, coo.col]).astype(np.int64))
+    values = torch.from_numpy(coo.data.astype(np.float32))
+    return torch.sparse_coo_tensor(indices, values, coo.shape, device=device).coalesce()
@@ -0,0 +1,218 @@
+"""
+Table Store - Lazy, offset-indexed access to {dataset}_table.jsonl
+A persisted index maps each table_idx to the byte range of its line, so
+startup reads the index instead of parsing every table, and records are
+decoded on demand behind an LRU cache. A {dataset}_table.arrow file next
+to the JSONL file is memory-mapped and read by row instead
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import msgspec
+import numpy as np
+
+from .corpus import _decode_rows, _json_columns, find_columnar_file, iter_records, read_arrow_table
+from .records import (RecordDecodeError, RetrievalResult, RetrievedTable, TableId, TableRecord, convert_record,
+                      decode_line, iter_jsonl)
+
+# Table fields embedded per retrieved table in full-format retrieval output.
+RETRIEVED_TABLE_FIELDS = ("split", "source_table_idx", "table_idx", "caption", "table")
+
+
+class _TableKey(msgspec.Struct):
+    """Only the table_idx of a table line; the rest of the line is skipped, not decoded."""
+    table_idx: TableId
+
+
+def build_table_index(table_file: str) -> Tuple[List, np.ndarray, np.ndarray]:
+    """
+    Scan a table JSONL file once.
+
+    Returns:
+        (table_ids, offsets, lengths): table_idx of every line plus its byte offset and length
+    """
+    decoder = msgspec.json.Decoder(_TableKey)
+    table_ids, offsets, lengths = [], [], []
+    offset = 0
+    with open(table_file, "rb") as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    table_ids.append(decoder.decode(line).table_idx)
+                except (msgspec.ValidationError, msgspec.DecodeError) as e:
+                    raise RecordDecodeError(table_file, line_no, str(e)) from None
+                offsets.append(offset)
+                lengths.append(len(line))
+            offset += len(line)
+    return table_ids, np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int64)
+
+
+class TableStore:
+    """
+    Read-only, dict-like table_idx -> TableRecord view of a table JSONL file.
+
+    The offset index is saved next to the table file (table_file + ".idx.npz")
+    and rebuilt when the table file's size or modification time changes.
+    If an Arrow IPC sibling ({dataset}_table.arrow) exists, it is
+    memory-mapped instead and rows are sliced out of it, with no index file.
+    Lookups are thread-safe; pickling reopens the file, so a store can be
+    handed to worker processes.
+    """
+
+    def __init__(self, table_file: str, index_file: Optional[str] = None, cache_size: int = 1024):
+        """
+        Args:
+            table_file: {dataset}_table.jsonl
+            index_file: Offset index path (default: table_file + ".idx.npz")
+            cache_size: Decoded records kept in the LRU cache
+        """
+        self.table_file = table_file
+        self.index_file = index_file or table_file + ".idx.npz"
+        self.cache_size = cache_size
+        self.arrow_file = find_columnar_file(table_file, formats=("arrow",))
+        if self.arrow_file is not None:
+            self.table_ids = read_arrow_table(self.arrow_file, ["table_idx"]).column("table_idx").to_pylist()
+            self.offsets = self.lengths = None
+        else:
+            self.table_ids, self.offsets, self.lengths = self._load_or_build_index()
+        self.position: Dict = {table_idx: i for i, table_idx in enumerate(self.table_ids)}
+        self._open()
+
+    def _file_signature(self) -> np.ndarray:
+        stat = os.stat(self.table_file)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def _load_or_build_index(self) -> Tuple[List, np.ndarray, np.ndarray]:
+        signature = self._file_signature()
+        if os.path.exists(self.index_file):
+            data = np.load(self.index_file)
+            if np.array_equal(data["signature"], signature):
+                return data["table_ids"].tolist(), data["offsets"], data["lengths"]
+            print(f"{self.table_file} changed since {self.index_file} was built; rebuilding the table index.")
+        table_ids, offsets, lengths = build_table_index(self.table_file)
+        try:
+            # np.savez appends .npz to other suffixes, so write through a file object.
+            with open(self.index_file + ".tmp", "wb") as f:
+                np.savez(f, table_ids=np.array(table_ids), offsets=offsets, lengths=lengths, signature=signature)
+            os.replace(self.index_file + ".tmp", self.index_file)
+        except OSError as e:  # read-only dataset directory: keep the index in memory only
+            print(f"Could not save the table index to {self.index_file}: {e}")
+        return table_ids, offsets, lengths
+
+    def _open(self) -> None:
+        if self.arrow_file is not None:
+            self._file = None
+            self._arrow = read_arrow_table(self.arrow_file)
+            self._arrow_json_columns = _json_columns(self._arrow)
+        else:
+            self._file = open(self.table_file, "rb")
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Any, TableRecord]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        for name in ("_file", "_lock", "_cache", "hits", "misses", "_arrow", "_arrow_json_columns"):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self) -> int:
+        return len(self.table_ids)
+
+    def __contains__(self, table_idx) -> bool:
+        return table_idx in self.position
+
+    def __iter__(self) -> Iterator:
+        return iter(self.table_ids)
+
+    def keys(self) -> List:
+        return list(self.table_ids)
+
+    def __getitem__(self, table_idx) -> TableRecord:
+        with self._lock:
+            record = self._cache.get(table_idx)
+            if record is not None:
+                self._cache.move_to_end(table_idx)
+                self.hits += 1
+                return record
+            i = self.position[table_idx]
+            self.misses += 1
+            if self._file is None:
+                row = _decode_rows(self._arrow.slice(i, 1).to_pylist(), self._arrow_json_columns)[0]
+                record = convert_record(row, TableRecord, self.arrow_file, i + 1)
+            else:
+                self._file.seek(int(self.offsets[i]))
+                record = decode_line(self._file.read(int(self.lengths[i])), TableRecord,
+                                     f"{self.table_file} (table_idx {table_idx})")
+            self._cache[table_idx] = record
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return record
+
+    def get(self, table_idx, default=None):
+        if table_idx not in self.position:
+            return default
+        return self[table_idx]
+
+    def items(self) -> Iterator[Tuple[Any, TableRecord]]:
+        """Stream every (table_idx, record) in file order, bypassing the cache (e.g. to encode the corpus)."""
+        for record in iter_records(self.table_file, record_type=TableRecord):
+            yield record.table_idx, record
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._arrow = None
+
+    def stats(self) -> Dict:
+        return {
+            "n_tables": len(self.table_ids),
+            "backend": "arrow" if self.arrow_file is not None else "jsonl",
+            "cache_size": self.cache_size,
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def retrieved_table(table_store: TableStore, table_idx) -> RetrievedTable:
+    """The RETRIEVED_TABLE_FIELDS of one table (all None if the store does not hold it)."""
+    table = table_store.get(table_idx, {})
+    return RetrievedTable(**{field: table.get(field) for field in RETRIEVED_TABLE_FIELDS})
+
+
+def resolve_retrieved_tables(record: RetrievalResult, table_store: TableStore) -> RetrievalResult:
+    """Fill "retrieved_tables" of a reference-format retrieval record from the store, in rank order."""
+    record.retrieved_tables = [retrieved_table(table_store, table_idx) for table_idx in record.retrieve_sub_table_idx]
+    return record
+
+
+def iter_retrieval_results(retrieval_file: str, table_file: Optional[str] = None,
+                           cache_size: int = 1024) -> Iterator[RetrievalResult]:
+    """
+    Stream the records of a *_retrieved_tables_schema_*.jsonl file as RetrievalResult records.
+
+    Full-format records are yielded as written. Reference-format records
+    (--output_format refs: ranked ids and scores, no tables) get their
+    "retrieved_tables" resolved through a TableStore over table_file, which
+    is opened on the first such record.
+    """
+    table_store = None
+    for record in iter_jsonl(retrieval_file, RetrievalResult):
+        if "retrieved_tables" not in record:
+            if table_store is None:
+                if table_file is None:
+                    raise ValueError(f"{retrieval_file} holds table references; a table file is needed to resolve them")
+                table_store = TableStore(table_file, cache_size=cache_size)
+            resolve_retrieved_tables(record, table_store)
+        yield record
+    if table_store is not None:
+        table_store.close()
@@ -0,0 +1,154 @@
+"""
+Stage Timing - Per-stage latency spans for subgraph retrieval runs
+Spans are aggregated per stage into p50/p90/p99 and a log-scale histogram,
+and each query records its candidate-set size with its stage times so cost
+can be plotted against N. A disabled timer hands out one shared no-op span
+"""
+
+import json
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Histogram bucket upper bounds in ms: 1/16 ms up to ~65 s, doubling.
+HISTOGRAM_BOUNDS_MS = [2.0 ** k for k in range(-4, 17)]
+
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    __slots__ = ("timer", "stage", "start")
+
+    def __init__(self, timer: "StageTimer", stage: str):
+        self.timer = timer
+        self.stage = stage
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.timer.add(self.stage, time.perf_counter() - self.start)
+
+
+def _distribution(values_ms: List[float]) -> Dict:
+    values = np.asarray(values_ms, dtype=np.float64)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"count": int(values.size), "mean": float(values.mean()), "p50": float(p50), "p90": float(p90),
+            "p99": float(p99), "max": float(values.max())}
+
+
+class StageTimer:
+    """
+    Collects wall-clock spans by stage name.
+
+    Spans also accumulate into the current per-query frame; end_query()
+    closes the frame into a per-query record. Timings are wall clock, so
+    asynchronous GPU work is charged to the stage that waits for it.
+
+    Usage:
+        with timer.span("ppr"):
+            ...
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.spans: Dict[str, List[float]] = defaultdict(list)
+        self.queries: List[Dict] = []
+        self._frame: Dict[str, float] = defaultdict(float)
+
+    def span(self, stage: str):
+        """Context manager timing one span of stage (a shared no-op when disabled)."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.spans[stage].append(seconds)
+        self._frame[stage] += seconds
+
+    def take_frame(self) -> Dict[str, float]:
+        """Return and reset the stage seconds accumulated since the last frame."""
+        frame, self._frame = dict(self._frame), defaultdict(float)
+        return frame
+
+    def end_query(self, n_candidates: int, shared: Optional[Dict[str, float]] = None, group_size: int = 1,
+                  batch_shared: Optional[Dict[str, float]] = None, batch_size: int = 1) -> None:
+        """
+        Record one query: its candidate-set size and its stage seconds, i.e.
+        the current frame plus an even share of stages run once for its
+        candidate-set group (shared, a frame taken after the group stages)
+        and of stages run once for its whole batch (batch_shared).
+        """
+        if not self.enabled:
+            return
+        stages = defaultdict(float)
+        for stage, seconds in (shared or {}).items():
+            stages[stage] += seconds / group_size
+        for stage, seconds in (batch_shared or {}).items():
+            stages[stage] += seconds / batch_size
+        for stage, seconds in self.take_frame().items():
+            stages[stage] += seconds
+        self.queries.append({"n_candidates": int(n_candidates), "group_size": group_size,
+                             "ms": {stage: seconds * 1e3 for stage, seconds in stages.items()}})
+
+    def state(self) -> Dict:
+        """Picklable contents, e.g. to send a worker's timings back to the parent."""
+        return {"spans": dict(self.spans), "queries": self.queries}
+
+    def drain(self) -> Dict:
+        """state(), then clear the timer."""
+        state = self.state()
+        self.spans = defaultdict(list)
+        self.queries = []
+        self._frame = defaultdict(float)
+        return state
+
+    def merge(self, state: Dict) -> None:
+        for stage, values in state["spans"].items():
+            self.spans[stage].extend(values)
+        self.queries.extend(state["queries"])
+
+    def summary(self, include_queries: bool = True) -> Dict:
+        """
+        Returns:
+            {"stages": {stage: count, total_s, mean/p50/p90/p99/max in ms, histogram},
+             "candidate_sizes": distribution of n_candidates,
+             "queries": per-query records (if include_queries)}
+        """
+        stages = {}
+        for stage, values in self.spans.items():
+            values_ms = [seconds * 1e3 for seconds in values]
+            counts, _ = np.histogram(values_ms, bins=[0.0] + HISTOGRAM_BOUNDS_MS + [np.inf])
+            stages[stage] = {"total_s": float(sum(values)), **_distribution(values_ms),
+                             "histogram": {"upper_bounds_ms": HISTOGRAM_BOUNDS_MS + ["inf"],
+                                           "counts": counts.tolist()}}
+        summary = {"stages": stages}
+        if self.queries:
+            summary["candidate_sizes"] = _distribution([query["n_candidates"] for query in self.queries])
+            if include_queries:
+                summary["queries"] = self.queries
+        return summary
+
+    def write(self, path: str, **metadata) -> Dict:
+        """Write summary() plus metadata (e.g. run arguments) as JSON and return it."""
+        summary = {**metadata, **self.summary()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+    def report(self) -> str:
+        """One line per stage, slowest total first."""
+        lines = []
+        for stage, stats in sorted(self.summary(include_queries=False)["stages"].items(),
+                                   key=lambda item: -item[1]["total_s"]):
+            lines.append(f"{stage:>14}: {stats['count']:>7} spans, {stats['total_s']:8.2f}s total, "
+                         f"p50 {stats['p50']:8.2f} ms, p90 {stats['p90']:8.2f} ms, p99 {stats['p99']:8.2f} ms")
+        return "\n".join(lines)
+
+
+# Default for code paths that take an optional timer.
+NULL_TIMER = StageTimer(enabled=False)
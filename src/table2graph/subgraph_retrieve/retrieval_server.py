@@ -0,0 +1,150 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import torch
+import uvicorn
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from retrieval_modules import EmbeddingProjector
+from retrieval_modules.knn_graph import KnnTableGraph
+from retrieval_modules.ooc_kmeans import MemmapKMeans
+from retrieval_modules.pagerank import PAGERANK_SOLVERS
+from retrieval_modules.retriever import TableRetriever
+from retrieval_modules.routing_tree import RoutingTree
+from retrieval_modules.scheduler import MicroBatchScheduler
+from retrieval_modules.service import create_app
+from retrieval_modules.table_store import TableStore
+
+device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def mean_pooling(token_embeddings, attention_mask):
+    token_embeddings = token_embeddings.masked_fill(~attention_mask[..., None].bool(), 0.)
+    return token_embeddings.sum(dim=1) / attention_mask.sum(dim=1)[..., None]
+
+
+def load_encoder(encoder, model_name=None, projector=None):
+    """
+    Load the query encoder once and return encode_fn(list of str) -> (Q, dim) numpy array.
+    Must match the encoder the kNN graph was built with.
+    """
+    if encoder == "contriever":
+        from transformers import AutoTokenizer, AutoModel
+        tokenizer = AutoTokenizer.from_pretrained(model_name or 'facebook/contriever')
+        model = AutoModel.from_pretrained(model_name or 'facebook/contriever').to(device).eval()
+
+        def encode(queries):
+            with torch.no_grad():
+                inputs = tokenizer(queries, padding=True, truncation=True, return_tensors='pt').to(device)
+                embeddings = mean_pooling(model(**inputs).last_hidden_state, inputs['attention_mask'])
+            return embeddings.cpu().numpy()
+    else:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name or 'intfloat/e5-large-v2', device=str(device))
+
+        def encode(queries):
+            with torch.no_grad():
+                return np.asarray(model.encode(queries, convert_to_numpy=True))
+
+    if projector is None:
+        return encode
+    return lambda queries: projector.transform(encode(queries))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve table retrieval over HTTP with resident models and index.")
+    parser.add_argument("--dataset", type=str, required=True, help="Name of the dataset")
+    parser.add_argument("--encoder", type=str, default="contriever", choices=["contriever", "sentencetransformer"],
+                        help="Query encoder; must match the one used to build the kNN graph.")
+    parser.add_argument("--model_name", type=str, default=None,
+                        help="Override the encoder checkpoint (default: facebook/contriever or intfloat/e5-large-v2).")
+    parser.add_argument("--knn_graph_file", type=str, default=None,
+                        help="Global kNN graph (.npz) from --build_knn_graph; "
+                             "default ./data/{dataset}/{dataset}_knn_graph_{encoder}.npz")
+    parser.add_argument("--projector_file", type=str, default=None,
+                        help="Fitted EmbeddingProjector (.npz) used when the graph was built.")
+    parser.add_argument("--filter_topks", type=str, default="50",
+                        help="Comma-separated tables kept after each PageRank round.")
+    parser.add_argument("--n_clusters", type=int, default=0,
+                        help="KMeans clusters for candidate routing (0: top --candidate_k tables by similarity).")
+    parser.add_argument("--router_file", type=str, default=None,
+                        help="Flat KMeans router (.npz) to load, or to save after fitting it with --n_clusters, "
+                             "so restarts skip the fit.")
+    parser.add_argument("--nprobe", type=int, default=4, help="Clusters searched per query.")
+    parser.add_argument("--candidate_k", type=int, default=1000, help="Candidate-set size without routing.")
+    parser.add_argument("--tree_branching", type=int, default=0,
+                        help="Route with a hierarchical KMeans tree with this many children per split "
+                             "(0: flat --n_clusters routing).")
+    parser.add_argument("--leaf_size", type=int, default=256, help="Largest routing-tree leaf.")
+    parser.add_argument("--beam_width", type=int, default=4, help="Routing-tree nodes kept per level.")
+    parser.add_argument("--routing_score", type=str, default="centroid", choices=["centroid", "typical"],
+                        help="Score tree nodes by centroid or by their typical tables.")
+    parser.add_argument("--routing_tree_file", type=str, default=None,
+                        help="Routing tree (.npz) to load, or to save after building it with --tree_branching.")
+    parser.add_argument("--pagerank_solver", type=str, default="power", choices=sorted(PAGERANK_SOLVERS))
+    parser.add_argument("--backend", type=str, default="auto", choices=["auto", "torch", "numpy"])
+    parser.add_argument("--sparse_graph", action="store_true", help="Keep candidate graphs sparse.")
+    parser.add_argument("--no_tables", action="store_true",
+                        help="Do not load table payloads (include_tables requests return nulls).")
+    parser.add_argument("--table_cache_size", type=int, default=4096,
+                        help="Decoded tables kept in the table store's LRU cache.")
+    parser.add_argument("--warmup", action="store_true", help="Run a warm-up query before serving.")
+    parser.add_argument("--max_batch_size", type=int, default=32,
+                        help="Concurrent requests encoded and ranked together (1 disables micro-batching).")
+    parser.add_argument("--batch_window_ms", type=float, default=2.0,
+                        help="Longest time a request waits for its batch to fill.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    dataset = args.dataset
+    knn_graph_file = args.knn_graph_file or f"./data/{dataset}/{dataset}_knn_graph_{args.encoder}.npz"
+    table_file = f"./data/{dataset}/{dataset}_table.jsonl"
+
+    projector = EmbeddingProjector.load(args.projector_file) if args.projector_file else None
+    encode_fn = load_encoder(args.encoder, args.model_name, projector)
+
+    knn_graph = KnnTableGraph.load(knn_graph_file)
+    print(f"Loaded global kNN graph from {knn_graph_file}: {knn_graph.stats()}")
+
+    table_store = None
+    if not args.no_tables:
+        table_store = TableStore(table_file, cache_size=args.table_cache_size)
+        print(f"Indexed {len(table_store)} tables in {table_file}")
+
+    routing_tree = None
+    if args.routing_tree_file and os.path.exists(args.routing_tree_file):
+        routing_tree = RoutingTree.load(args.routing_tree_file)
+        print(f"Loaded routing tree from {args.routing_tree_file}: {routing_tree.stats()}")
+
+    router = None
+    if args.router_file and os.path.exists(args.router_file) and not args.tree_branching and routing_tree is None:
+        router = MemmapKMeans.load(args.router_file)
+        print(f"Loaded {router.n_clusters}-cluster router from {args.router_file}")
+
+    retriever = TableRetriever(knn_graph, encode_fn, filter_topks=[int(k) for k in args.filter_topks.split(",")],
+                               n_clusters=args.n_clusters, nprobe=args.nprobe, candidate_k=args.candidate_k,
+                               backend=args.backend, device=device, sparse=args.sparse_graph, tables=table_store,
+                               routing_tree=routing_tree, tree_branching=args.tree_branching,
+                               leaf_size=args.leaf_size, beam_width=args.beam_width,
+                               routing_score=args.routing_score, router=router, solver=args.pagerank_solver)
+    if routing_tree is None and retriever.routing_tree is not None:
+        print(f"Built routing tree: {retriever.routing_tree.stats()}")
+        if args.routing_tree_file:
+            retriever.routing_tree.save(args.routing_tree_file)
+            print(f"Saved routing tree to {args.routing_tree_file}")
+    if router is None and retriever.router is not None:
+        print(f"Fitted {retriever.router.n_clusters}-cluster router")
+        if args.router_file:
+            retriever.router.save(args.router_file)
+            print(f"Saved router to {args.router_file}")
+    if args.warmup:
+        print(f"Warm-up took {retriever.warm_up():.2f}s")
+
+    scheduler = None
+    if args.max_batch_size > 1:
+        scheduler = MicroBatchScheduler(retriever, max_batch_size=args.max_batch_size,
+                                        max_wait_ms=args.batch_window_ms)
+    uvicorn.run(create_app(retriever, scheduler), host=args.host, port=args.port)
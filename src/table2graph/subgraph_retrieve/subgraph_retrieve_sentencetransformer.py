@@ -9,18 +9,39 @@ import numpy as np
 from sentence_transformers import SentenceTransformer
 import math
 import os
+import sys
+from collections import Counter
+from contextlib import ExitStack
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from retrieval_modules import EmbeddingProjector
+from retrieval_modules.knn_graph import KnnTableGraph
+from retrieval_modules.backends import TorchBackend, select_backend, DEFAULT_CROSSOVER
+from retrieval_modules.pagerank import DEFAULT_CHECK_EVERY, PAGERANK_SOLVERS
+from retrieval_modules.batching import iter_keyed_query_batches, group_by_candidate_set, prefetch
+from retrieval_modules.parallel import worker_pool, imap_ordered
+from retrieval_modules.run_journal import RunJournal
+from retrieval_modules.timing import NULL_TIMER, StageTimer
+from retrieval_modules.records import RetrievalResult, encode_line
+from retrieval_modules.table_store import TableStore, retrieved_table
+from retrieval_modules.lexical import BM25Index, prune_query_batch, lexical_personalization, fuse_personalization
+from retrieval_modules.cell_index import CELL_MODES, CellIndex, cell_candidates
+from retrieval_modules.column_stats import ColumnCatalog, prune_by_constraints
+from retrieval_modules.cutoff import CUTOFF_MODES, ScoreCutoff, kept_count_report
 
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# Graph stage on the torch device unless select_backend picks NumPy for a candidate set
+torch_backend = TorchBackend(device)
+# Optional fitted projection shared with the clustering index (set in main via --projector_file)
+projector = None
 
-def infer_column_type(column_values):
-    """Efficiently determine whether a column is 'real' (numeric) or 'text'."""
-    num_count = sum(
-        1 for val in column_values
-        if isinstance(val, (int, float)) or re.match(r"^\d+[\d,]*\.?\d*$", str(val))
-    )
-    return "real" if num_count / len(column_values) > 0.5 else "text"
 
+def project_embedding(embedding):
+    """Apply the optional dimensionality reduction to a table or query embedding."""
+    if projector is None:
+        return embedding
+    return projector.transform(embedding)
 
 def linearize_table(table):
     caption = table.get("caption", "")
@@ -36,45 +57,251 @@ def linearize_table(table):
 def aggregate_table_representation(encodings):
     return encodings["table_embedding"]
 
-def build_similarity_matrix(processed_encodings, similarity_threshold=0.3):
-    table_indices = []
-    representations = []
-    for table_idx, encodings in processed_encodings.items():
-        rep = aggregate_table_representation(encodings)  # Already on GPU.
-        table_indices.append(table_idx)
-        representations.append(rep)
-    R = torch.stack(representations, dim=0)
-    R_norm = F.normalize(R, p=2, dim=1)
-    S = R_norm @ R_norm.T
-    S = torch.where(S < similarity_threshold, torch.zeros_like(S), S)
+def stack_representations(processed_encodings, backend):
+    """Normalized (N, dim) table representations in the backend's array type, plus their table ids."""
+    table_indices = list(processed_encodings.keys())
+    R = backend.stack([aggregate_table_representation(encodings) for encodings in processed_encodings.values()])
+    return backend.normalize_rows(R), table_indices
+
+def build_similarity_matrix(processed_encodings, similarity_threshold=0.3, backend=torch_backend):
+    R_norm, table_indices = stack_representations(processed_encodings, backend)
+    S = backend.similarity(R_norm, similarity_threshold)
     return S, R_norm, table_indices
 
-def build_transition_matrix(S):
-    row_sum = S.sum(dim=1, keepdim=True)
-    P = S / (row_sum + 1e-10)
-    return P
-
-def compute_personalization_vector(query, sentence_model, R_norm):
-    query_repr = sentence_model.encode(query, convert_to_tensor=True, device=device)
-    query_norm = F.normalize(query_repr, p=2, dim=0)
-    sims = (R_norm @ query_norm.unsqueeze(1)).squeeze(1)
-    sims = sims.clamp(min=0)
-    total = sims.sum()
-    if total > 0:
-        personalization = sims / total
-    else:
-        personalization = torch.ones_like(sims) / sims.numel()
-    return personalization
-
-def run_pagerank_gpu(P, personalization, alpha=0.85, max_iter=50, tol=1e-6):
-    x = personalization.clone()
-    for i in range(max_iter):
-        x_new = (1 - alpha) * personalization + alpha * (P.T @ x)
-        if torch.norm(x_new - x, p=1) < tol:
-            x = x_new
-            break
-        x = x_new
-    return x
+def build_table_text(table, schema_only=False, headers_only=False):
+    caption = table.get("caption", "")
+    if schema_only:
+        return f"Table Caption: {caption}. Table Headers: {table['table']['header']}"
+    if headers_only:
+        return f"Table Headers: {table['table']['header']}"
+    return linearize_table(table)
+
+def encode_tables(texts, sentence_model, batch_size=64):
+    """Encode a list of table strings in batches; returns a (len(texts), dim) numpy array."""
+    embeddings = []
+    with torch.no_grad():
+        for start in trange(0, len(texts), batch_size, desc="Encoding tables"):
+            batch = texts[start:start + batch_size]
+            batch_embeddings = project_embedding(sentence_model.encode(batch, convert_to_tensor=True, device=device))
+            embeddings.append(batch_embeddings.reshape(len(batch), -1).float().cpu().numpy())
+    return np.concatenate(embeddings, axis=0)
+
+def build_sparse_similarity_matrix(processed_encodings, top_k=20, similarity_threshold=0.3, backend=torch_backend):
+    """Sparse counterpart of build_similarity_matrix: top-k neighbours per table above the threshold."""
+    R_norm, table_indices = stack_representations(processed_encodings, backend)
+    S = backend.similarity(R_norm, similarity_threshold, sparse=True, top_k=top_k)
+    return S, R_norm, table_indices
+
+def build_similarity_matrix_from_graph(knn_graph, table_indices, sparse=False, backend=torch_backend):
+    """Slice the precomputed global kNN graph instead of computing R_norm @ R_norm.T."""
+    S, R_norm, graph_table_indices = knn_graph.subgraph(table_indices)
+    return backend.from_scipy(S, sparse=sparse), backend.asarray(R_norm), graph_table_indices
+
+def build_candidate_graph(processed_encodings, knn_graph=None, sparse=False, top_k=20, similarity_threshold=0.3,
+                          backend=torch_backend):
+    """Similarity graph of the current candidate set: global-graph slice, sparse top-k or dense."""
+    if knn_graph is not None:
+        return build_similarity_matrix_from_graph(knn_graph, list(processed_encodings.keys()), sparse=sparse, backend=backend)
+    if sparse:
+        return build_sparse_similarity_matrix(processed_encodings, top_k=top_k, similarity_threshold=similarity_threshold,
+                                              backend=backend)
+    return build_similarity_matrix(processed_encodings, similarity_threshold=similarity_threshold, backend=backend)
+
+def compute_personalization_matrix(queries, sentence_model, R_norm, backend=torch_backend):
+    """
+    Personalization vectors for several queries on one candidate set, as an (N, Q) matrix:
+    clamped cosine similarity to each table, normalized per query (uniform if all zero).
+    """
+    query_repr = project_embedding(sentence_model.encode(queries, convert_to_tensor=True, device=device)).reshape(len(queries), -1)
+    return backend.personalization(R_norm, query_repr)
+
+def rank_query_batch(query_batch, sentence_model, table_store, knn_graph, args, pagerank_options,
+                     filter_topks=None, filter_percentages=None, lexical_index=None, cell_index=None,
+                     column_catalog=None, score_cutoff=None, timer=NULL_TIMER):
+    """
+    Iterative PageRank filtering for one batch of clustered queries.
+    Pass filter_topks or filter_percentages (one per iteration); timer
+    collects per-stage spans and one record per query. With lexical_index,
+    candidate sets are cut to their BM25 top args.bm25_top_m and/or the
+    BM25 scores are fused into the personalization (args.bm25_fusion).
+    Per-query candidate changes run on the whole batch before grouping, so
+    every group's graph holds exactly the tables its queries rank and the
+    result does not depend on args.query_batch_size.
+    With cell_index, tables whose cell values the query mentions are added
+    to (or replace) the candidate set (args.cell_top_e, args.cell_mode).
+    With column_catalog, candidates whose numeric / year column ranges
+    cannot meet the query's constraints are dropped. With score_cutoff,
+    the final ranked list of each query is cut to score_cutoff.keep_count
+    of its scores instead of the full last filter count.
+
+    Returns one final_ranked_tables list per query, in batch order, each
+    listing (table_idx, score) best-first.
+    """
+    # Per-query candidate changes first; their spans are shared evenly by the batch's queries.
+    timer.take_frame()
+    if lexical_index is not None and args.bm25_top_m:
+        with timer.span("lexical"):
+            query_batch = prune_query_batch(query_batch, lexical_index, args.bm25_top_m)
+    if column_catalog is not None:
+        with timer.span("catalog_prune"):
+            query_batch = prune_by_constraints(query_batch, column_catalog)
+    if cell_index is not None and args.cell_top_e:
+        with timer.span("cell_lookup"):
+            query_batch = cell_candidates(query_batch, cell_index, args.cell_top_e, args.cell_mode, args.cell_max_df)
+    batch_frame = timer.take_frame()
+
+    # Queries left with the same candidate set share it: encode it and run the
+    # first PageRank round once per group, with one personalization column per query.
+    group_results = {}
+    for group_positions in group_by_candidate_set(query_batch):
+        clustered_indices = query_batch[group_positions[0]]["clustered_tables"]["clustered_tables"]
+        with timer.span("table_lookup"):
+            matched_table_ids = [idx for idx in clustered_indices if idx in table_store]
+
+        processed_encodings = {}
+        with torch.no_grad():
+            for table_idx in tqdm(matched_table_ids, desc="Processing tables"):
+                if table_idx in processed_encodings:
+                    continue
+                if knn_graph is not None:
+                    # Embedding and neighbours come from the precomputed global graph; the table is not read.
+                    caption = None
+                    table_embedding = None
+                else:
+                    with timer.span("table_lookup"):
+                        table = table_store[table_idx]
+                    with timer.span("table_encode"):
+                        caption = table.get("caption", "")
+                        table_str = build_table_text(table, args.schema_only, args.headers_only)
+                        table_embedding = project_embedding(sentence_model.encode(table_str, convert_to_tensor=True, device=device))
+                processed_encodings[table_idx] = {
+                    "table_idx": table_idx,
+                    "table_id": caption,
+                    "table_embedding": table_embedding
+                }
+
+            group_queries = [query_batch[pos]["query"] for pos in group_positions]
+            # Small CPU graphs go to NumPy/SciPy, the rest to torch (see select_backend).
+            backend = select_backend(len(processed_encodings), device=device, solver=args.pagerank_solver,
+                                     preferred=args.backend, crossover=args.backend_crossover)
+            with timer.span("similarity"):
+                S, R_norm, group_table_indices = build_candidate_graph(processed_encodings, knn_graph,
+                                                                       sparse=args.sparse_graph, top_k=args.graph_top_k,
+                                                                       similarity_threshold=0.3, backend=backend)
+            with timer.span("query_encode"):
+                personalization = compute_personalization_matrix(group_queries, sentence_model, R_norm, backend=backend)
+            if lexical_index is not None and args.bm25_fusion > 0:
+                with timer.span("lexical"):
+                    lexical_scores = lexical_personalization(lexical_index, group_queries, group_table_indices)
+                    personalization = fuse_personalization(backend, personalization, lexical_scores, args.bm25_fusion)
+            with timer.span("ppr"):
+                P = backend.transition(S)
+                group_result = backend.pagerank(P, personalization, alpha=0.85, max_iter=50, tol=1e-6,
+                                                **pagerank_options)
+            group_scores = group_result.scores
+            print(f"PageRank ({args.pagerank_solver}, {backend.name}) over {len(group_table_indices)} tables x {len(group_queries)} queries: "
+                  f"{group_result.iterations} iterations, residual {group_result.residual:.2e}")
+        group_frame = timer.take_frame()
+        for column, pos in enumerate(group_positions):
+            group_results[pos] = (group_table_indices, backend, S, personalization[:, column],
+                                  group_scores[:, column], group_frame, len(group_positions))
+
+    ranked_batch = []
+    for pos in range(len(query_batch)):
+        (group_table_indices, backend, group_S, group_personalization, group_pagerank_scores,
+         group_frame, group_size) = group_results[pos]
+
+        # --- Iterative Graph-based Ranking via Personalized PageRank ---
+        # Survivors are tracked as positions into the group's candidate graph: every round
+        # slices that graph, restricts the query's personalization and warm-starts PageRank
+        # from the survivors' previous scores, so the query is encoded only once.
+        keep = backend.arange(len(group_table_indices))
+        pagerank_scores = group_pagerank_scores
+        initial_total = len(keep)
+        for iteration in trange(args.num_iterations):
+            if iteration > 0:
+                # First round was computed for the whole candidate-set group above.
+                with timer.span("ppr"):
+                    P = backend.transition(backend.slice(group_S, keep))
+                    personalization = backend.restrict(group_personalization, keep)
+                    pagerank_scores = backend.pagerank(P, personalization, alpha=0.85, max_iter=50, tol=1e-6,
+                                                       x0=backend.restrict(pagerank_scores), **pagerank_options).scores
+
+            current_count = len(keep)
+            if filter_topks is not None:
+                keep_count = min(current_count, filter_topks[iteration])
+                print(f"Iteration {iteration+1}: Keeping top {keep_count} out of {current_count} tables (top-k metric).")
+            else:
+                keep_percentage = filter_percentages[iteration]
+                keep_count = max(1, math.ceil(current_count * (keep_percentage / 100.0)))
+                print(f"Iteration {iteration+1}: Keeping {keep_count} out of {current_count} tables ({keep_percentage}%).")
+
+            with timer.span("sort"):
+                pagerank_scores, top = backend.topk(pagerank_scores, keep_count)
+                keep = keep[top]
+
+            if len(keep) == 1:
+                break
+
+        final_total = len(keep)
+        overall_ratio = final_total / initial_total
+        print(f"Total tables at start: {initial_total}, Final filtered tables after {iteration+1} iterations: {final_total}, Overall ratio: {overall_ratio:.2f}")
+
+        if args.final_rerank:
+            # Re-run ranking on the final filtered table set for evaluation.
+            with timer.span("ppr"):
+                final_P = backend.transition(backend.slice(group_S, keep))
+                final_personalization = backend.restrict(group_personalization, keep)
+                final_pagerank_scores = backend.pagerank(final_P, final_personalization, alpha=0.85, max_iter=50,
+                                                         tol=1e-6, x0=backend.restrict(pagerank_scores),
+                                                         **pagerank_options).scores
+            with timer.span("sort"):
+                pagerank_scores, order = backend.topk(final_pagerank_scores, len(keep))
+                keep = keep[order]
+        # topk already returns the survivors best-first.
+        final_ranked_tables = list(zip([group_table_indices[i] for i in backend.tolist(keep)],
+                                       backend.tolist(pagerank_scores)))
+        if score_cutoff is not None:
+            final_ranked_tables = final_ranked_tables[:score_cutoff.keep_count([score for _, score in final_ranked_tables])]
+        ranked_batch.append(final_ranked_tables)
+        timer.end_query(initial_total, shared=group_frame, group_size=group_size, batch_shared=batch_frame,
+                        batch_size=len(query_batch))
+    return ranked_batch
+
+# State of a --workers process, set once by init_worker
+worker_context = {}
+
+def init_worker(knn_graph, table_store, lexical_index, cell_index, column_catalog, args,
+                pagerank_options, filter_options):
+    """Load this worker's encoder and keep the shared graph for rank_query_batch_worker."""
+    global sentence_model, projector
+    sentence_model = SentenceTransformer('intfloat/e5-large-v2')
+    sentence_model.to(device)
+    if args.projector_file is not None:
+        projector = EmbeddingProjector.load(args.projector_file)
+    worker_context.update(knn_graph=knn_graph, table_store=table_store,
+                          lexical_index=lexical_index, cell_index=cell_index, column_catalog=column_catalog,
+                          args=args,
+                          pagerank_options=pagerank_options, filter_options=filter_options,
+                          timer=StageTimer(enabled=args.timing_file is not None))
+
+def rank_query_batch_worker(task):
+    """Rank one batch in a worker; returns the ranked batch and this batch's stage timings."""
+    query_keys, query_batch = task
+    timer = worker_context["timer"]
+    ranked_batch = rank_query_batch(query_batch, sentence_model, worker_context["table_store"], worker_context["knn_graph"],
+                                    worker_context["args"], worker_context["pagerank_options"],
+                                    **worker_context["filter_options"], lexical_index=worker_context["lexical_index"],
+                                    cell_index=worker_context["cell_index"],
+                                    column_catalog=worker_context["column_catalog"], timer=timer)
+    return ranked_batch, timer.drain()
+
+def merge_worker_timings(results, timer):
+    """Unpack rank_query_batch_worker results in order, folding each worker's timings into timer."""
+    for (query_keys, query_batch), (ranked_batch, timings) in results:
+        timer.merge(timings)
+        yield query_keys, query_batch, ranked_batch
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Script to process dataset.")
@@ -95,9 +322,114 @@ if __name__ == '__main__':
                         help="Number of examples to process")
     parser.add_argument("--cluster_embedding_method", type=str, default="contriever",
                         help="Embedding method to use for clustering previously.")
+    parser.add_argument("--projector_file", type=str, default=None,
+                        help="Fitted EmbeddingProjector (.npz) applied to table and query embeddings. "
+                             "Must have been fitted in the same embedding space as this script's encoder.")
+    parser.add_argument("--build_knn_graph", action="store_true",
+                        help="Encode every table, build the global sparse kNN graph, save it to --knn_graph_file and exit.")
+    parser.add_argument("--use_knn_graph", action="store_true",
+                        help="Slice each query's similarity subgraph from the precomputed global kNN graph.")
+    parser.add_argument("--knn_graph_file", type=str, default=None,
+                        help="Global kNN graph (.npz); default ./data/{dataset}/{dataset}_knn_graph_sentencetransformer.npz")
+    parser.add_argument("--knn_k", type=int, default=50,
+                        help="Neighbours kept per table in the global kNN graph.")
+    parser.add_argument("--knn_block_size", type=int, default=2048,
+                        help="Rows compared per block while building the kNN graph (memory is block_size x N).")
+    parser.add_argument("--sparse_graph", action="store_true",
+                        help="Use a sparse top-k + threshold similarity graph and sparse PageRank instead of dense N x N.")
+    parser.add_argument("--graph_top_k", type=int, default=20,
+                        help="Neighbours kept per table with --sparse_graph (ignored when slicing --use_knn_graph).")
+    parser.add_argument("--query_batch_size", type=int, default=1,
+                        help="Queries read per batch; queries in a batch that share a candidate set run the "
+                             "first PageRank round together as one batched PPR.")
+    parser.add_argument("--pagerank_solver", type=str, default="power", choices=sorted(PAGERANK_SOLVERS),
+                        help="PageRank solver: power iteration, extrapolated (Aitken-accelerated power), "
+                             "linear (BiCGSTAB on (I - alpha P^T) x = (1 - alpha) p) or push (local forward push).")
+    parser.add_argument("--pagerank_check_every", type=int, default=DEFAULT_CHECK_EVERY,
+                        help="Power, extrapolated and linear solvers: test convergence every N iterations "
+                             "(fewer device syncs, at the cost of up to N - 1 extra iterations).")
+    parser.add_argument("--push_epsilon", type=float, default=1e-4,
+                        help="Push solver: residual threshold above which a table pushes its mass.")
+    parser.add_argument("--final_rerank", action="store_true",
+                        help="Run one more PageRank on the final filtered set instead of reusing the last "
+                             "iteration's ranking (the previous behaviour).")
+    parser.add_argument("--backend", type=str, default="auto", choices=["auto", "torch", "numpy"],
+                        help="Graph/PageRank backend; auto uses torch on GPU and for CPU candidate sets of at least "
+                             "--backend_crossover tables, NumPy/SciPy otherwise.")
+    parser.add_argument("--backend_crossover", type=int, default=DEFAULT_CROSSOVER,
+                        help="Candidate-set size from which auto picks torch on CPU (default: none, NumPy at every "
+                             "size; measure with python -m retrieval_modules.backends).")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run: verify the committed output chunks against the run "
+                             "journal, drop any uncommitted tail and skip queries that are already done.")
+    parser.add_argument("--checkpoint_every", type=int, default=50,
+                        help="Queries per committed output chunk (fsync + journal record).")
+    parser.add_argument("--table_cache_size", type=int, default=1024,
+                        help="Decoded tables kept in the table store's LRU cache.")
+    parser.add_argument("--output_format", type=str, default="full", choices=["full", "refs"],
+                        help="full: embed every retrieved table in each output line; refs: write ranked table ids "
+                             "and scores only, resolved later from the table store.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes ranking query batches in parallel; the kNN graph is "
+                             "shared, not copied, and output keeps input order. Table embeddings are only "
+                             "shared with --use_knn_graph; otherwise each worker encodes its candidate tables itself.")
+    parser.add_argument("--threads_per_worker", type=int, default=None,
+                        help="Torch / BLAS threads per worker (default: CPU count // --workers).")
+    parser.add_argument("--prefetch_depth", type=int, default=4,
+                        help="Query batches read and decoded ahead by a background thread while the current batch "
+                             "is ranked (0: read inline); with --workers, batches in flight per worker.")
+    parser.add_argument("--bm25_top_m", type=int, default=0,
+                        help="Cut each clustered candidate set to its BM25 top-M over table_schema before dense "
+                             "scoring and PageRank (0: no pruning). See python -m retrieval_modules.lexical for recall curves.")
+    parser.add_argument("--bm25_fusion", type=float, default=0.0,
+                        help="Weight of BM25 scores fused into the PageRank personalization (0: dense only).")
+    parser.add_argument("--bm25_index_file", type=str, default=None,
+                        help="BM25 schema index (.npz); default ./data/{dataset}/{dataset}_bm25_schema.npz, "
+                             "built from {dataset}_schema.jsonl if missing")
+    parser.add_argument("--cell_top_e", type=int, default=0,
+                        help="Use up to E tables whose cell values appear in the query as candidates (0: off). "
+                             "See python -m retrieval_modules.cell_index for match precision.")
+    parser.add_argument("--cell_mode", type=str, default="add", choices=CELL_MODES,
+                        help="add: append cell matches to the clustered candidates; "
+                             "restrict: use only the matches for queries that have any")
+    parser.add_argument("--cell_max_df", type=int, default=100,
+                        help="Ignore cell phrases that occur in more tables than this.")
+    parser.add_argument("--cell_index_file", type=str, default=None,
+                        help="Cell-value index (.npz); default ./data/{dataset}/{dataset}_cell_index.npz, "
+                             "built from the table file if missing")
+    parser.add_argument("--column_catalog_prune", action="store_true",
+                        help="Drop candidates whose numeric / year column ranges cannot meet the query's constraints. "
+                             "See python -m retrieval_modules.column_stats.")
+    parser.add_argument("--column_catalog_file", type=str, default=None,
+                        help="Column statistics catalog (.npz); default ./data/{dataset}/{dataset}_column_catalog.npz, "
+                             "built from the table file if missing")
+    parser.add_argument("--cutoff_mode", type=str, default=None, choices=CUTOFF_MODES,
+                        help="Keep a per-query number of final tables chosen from their scores instead of the last "
+                             "filter count: gap (before the sharpest score drop), mass (share of the score mass) or "
+                             "probability (calibrated relevance). See python -m retrieval_modules.cutoff.")
+    parser.add_argument("--cutoff_min", type=int, default=1,
+                        help="Fewest final tables kept by --cutoff_mode.")
+    parser.add_argument("--cutoff_max", type=int, default=None,
+                        help="Most final tables kept by --cutoff_mode (default: the last filter count).")
+    parser.add_argument("--cutoff_gap", type=float, default=0.5,
+                        help="gap: cut before the sharpest drop if the next score is at most this times the previous one.")
+    parser.add_argument("--cutoff_mass", type=float, default=0.8,
+                        help="mass: keep the fewest tables holding this share of the final scores.")
+    parser.add_argument("--cutoff_probability", type=float, default=0.5,
+                        help="probability: keep tables whose calibrated relevance probability is at least this.")
+    parser.add_argument("--cutoff_calibration_file", type=str, default=None,
+                        help="Calibration (JSON) for --cutoff_mode probability; default "
+                             "./data/{dataset}/{dataset}_cutoff_calibration.json")
+    parser.add_argument("--timing_file", type=str, default=None,
+                        help="Write per-stage latency percentiles (table lookup, encoding, similarity, PPR, sort, "
+                             "write) and per-query candidate-set sizes to this JSON file; timing is off without it.")
 
     
     args = parser.parse_args()
+    if args.workers > 1 and not args.use_knn_graph:
+        print(f"Warning: without --use_knn_graph the {args.workers} workers share no table embeddings; each one "
+              f"loads and encodes the candidate tables of its own batches. Build the graph once with "
+              f"--build_knn_graph and pass --use_knn_graph to share them.")
 
 
     use_topk = False
@@ -132,112 +464,127 @@ if __name__ == '__main__':
     table_file = f"./data/{dataset}/{dataset}_table.jsonl"
     table_match_file = f"./data/{dataset}/{dataset}_table_match.json"
     output_dir = f"./data/{dataset}/"
-    output_file = f"{output_dir}{dataset}_retrieved_tables_schema_{testing_num}_{filter_topks[0]}_contriever.jsonl"
+    projector_suffix = ""
+    if args.projector_file is not None:
+        projector = EmbeddingProjector.load(args.projector_file)
+        report = projector.report()
+        print(f"Projection: {report['method']} {report['input_dim']} -> {report['n_components']} dims, "
+              f"variance retained: {report['variance_retained']:.4f}")
+        projector_suffix = f"_{report['method']}{report['n_components']}"
+    output_file = f"{output_dir}{dataset}_retrieved_tables_schema_{testing_num}_{filter_topks[0]}_contriever{projector_suffix}.jsonl"
     os.makedirs(output_dir, exist_ok=True)
     
     with open(table_match_file, "r", encoding="utf-8") as f:
         source_sub_table_mapping = json.load(f)
 
-    table_dict = {}
-    with open(table_file, "r", encoding="utf-8") as f:
-        for line in f:
-            table_data = json.loads(line)
-            table_dict[table_data["table_idx"]] = table_data
+    # Tables are read on demand through a persisted byte-offset index, not parsed up front.
+    table_store = TableStore(table_file, cache_size=args.table_cache_size)
+    print(f"Indexed {len(table_store)} tables in {table_file}")
 
-    processed_data = []
-    half_retrieve = 0
-    total = 0
-    idx = 0
-    print(f"Schema Only: {args.schema_only}")
-    print(f"Headers Only: {args.headers_only}")
-    with open(output_file, "a", encoding="utf-8") as output_f:
-        with open(clustered_table_file, "r", encoding="utf-8") as f:
-            for line in f:
-                idx += 1
-                if idx > testing_num:
-                    break
+    knn_graph_file = args.knn_graph_file or f"{output_dir}{dataset}_knn_graph_sentencetransformer.npz"
+    if args.build_knn_graph:
+        graph_table_ids = table_store.keys()
+        table_texts = [build_table_text(table, args.schema_only, args.headers_only) for _, table in table_store.items()]
+        table_embeddings = encode_tables(table_texts, sentence_model)
+        knn_graph = KnnTableGraph.build(graph_table_ids, table_embeddings, k=args.knn_k,
+                                        similarity_threshold=0.3, block_size=args.knn_block_size)
+        knn_graph.save(knn_graph_file)
+        print(f"Saved global kNN graph to {knn_graph_file}: {knn_graph.stats()}")
+        sys.exit(0)
 
-                processed_encodings = {}
-                processed_table_idxs = set()
+    knn_graph = None
+    if args.use_knn_graph:
+        knn_graph = KnnTableGraph.load(knn_graph_file)
+        print(f"Loaded global kNN graph from {knn_graph_file}: {knn_graph.stats()}")
+    lexical_index = None
+    if args.bm25_top_m or args.bm25_fusion:
+        bm25_index_file = args.bm25_index_file or f"{output_dir}{dataset}_bm25_schema.npz"
+        if os.path.exists(bm25_index_file):
+            lexical_index = BM25Index.load(bm25_index_file)
+        else:
+            lexical_index = BM25Index.from_schema_file(f"{output_dir}{dataset}_schema.jsonl")
+            lexical_index.save(bm25_index_file)
+        print(f"BM25 schema index {bm25_index_file}: {lexical_index.stats()}")
+    cell_index = None
+    if args.cell_top_e:
+        cell_index_file = args.cell_index_file or f"{output_dir}{dataset}_cell_index.npz"
+        if os.path.exists(cell_index_file):
+            cell_index = CellIndex.load(cell_index_file)
+        else:
+            cell_index = CellIndex.from_table_file(table_file)
+            cell_index.save(cell_index_file)
+        print(f"Cell-value index {cell_index_file}: {cell_index.stats()}")
+    column_catalog = None
+    if args.column_catalog_prune:
+        column_catalog_file = args.column_catalog_file or f"{output_dir}{dataset}_column_catalog.npz"
+        if os.path.exists(column_catalog_file):
+            column_catalog = ColumnCatalog.load(column_catalog_file)
+        else:
+            column_catalog = ColumnCatalog.from_table_file(table_file)
+            column_catalog.save(column_catalog_file)
+        print(f"Column catalog {column_catalog_file}: {column_catalog.stats()}")
 
-                clustered_data = json.loads(line)
+    score_cutoff = None
+    if args.cutoff_mode is not None:
+        calibration = None
+        if args.cutoff_mode == "probability":
+            calibration_file = args.cutoff_calibration_file or f"{output_dir}{dataset}_cutoff_calibration.json"
+            with open(calibration_file, "r", encoding="utf-8") as f:
+                calibration = json.load(f)
+        score_cutoff = ScoreCutoff(args.cutoff_mode, min_keep=args.cutoff_min, max_keep=args.cutoff_max,
+                                   gap=args.cutoff_gap, mass=args.cutoff_mass, probability=args.cutoff_probability,
+                                   calibration=calibration)
+
+    pagerank_options = {"solver": args.pagerank_solver}
+    if args.pagerank_solver == "push":
+        pagerank_options["push_epsilon"] = args.push_epsilon
+    else:
+        pagerank_options["check_every"] = args.pagerank_check_every
+    print(f"Schema Only: {args.schema_only}")
+    print(f"Headers Only: {args.headers_only}")
+    # Streaming driver: clustered records are read (up to --prefetch_depth batches ahead), ranked and written
+    # through the run journal (chunked, checksummed writes that --resume can verify and continue), then dropped,
+    # so memory stays flat however many queries are processed.
+    filter_options = {"filter_topks": filter_topks} if use_topk else {"filter_percentages": filter_percentages}
+    filter_options["score_cutoff"] = score_cutoff
+    kept_counts = Counter()
+    timer = StageTimer(enabled=args.timing_file is not None)
+    with RunJournal(output_file, chunk_size=args.checkpoint_every, resume=args.resume) as journal, ExitStack() as stack:
+        half_retrieve = journal.counters.get("half_retrieve", 0)
+        total = journal.counters.get("total", 0)
+        query_batches = prefetch(iter_keyed_query_batches(clustered_table_file, testing_num, args.query_batch_size,
+                                                          done_keys=journal.done_keys), args.prefetch_depth)
+        if args.workers > 1:
+            # Each worker loads its own encoder and maps the graph from shared memory;
+            # batches are ranked in parallel and come back in input order for the journal.
+            pool = stack.enter_context(worker_pool(args.workers, init_worker,
+                                                   (table_store, lexical_index, cell_index, column_catalog,
+                                                    args, pagerank_options, filter_options),
+                                                   threads_per_worker=args.threads_per_worker,
+                                                   knn_graph=knn_graph))
+            ranked_batches = merge_worker_timings(imap_ordered(pool, rank_query_batch_worker, query_batches,
+                                                               max_pending=max(args.prefetch_depth, 1) * args.workers),
+                                                  timer)
+        else:
+            ranked_batches = ((query_keys, query_batch,
+                               rank_query_batch(query_batch, sentence_model, table_store, knn_graph, args,
+                                                pagerank_options, **filter_options, lexical_index=lexical_index,
+                                                cell_index=cell_index, column_catalog=column_catalog,
+                                                timer=timer))
+                              for query_keys, query_batch in query_batches)
+        for query_keys, query_batch, ranked_batch in ranked_batches:
+            for pos, clustered_data in enumerate(query_batch):
+                final_ranked_tables = ranked_batch[pos]
+                kept_counts[len(final_ranked_tables)] += 1
                 table_size = clustered_data["clustered_tables"]["size"]
                 source_table_idx = clustered_data["source_table_idx"]
                 ground_truth_table_idx = source_sub_table_mapping[str(source_table_idx)]
                 query = clustered_data["query"]
                 query_label = clustered_data["label"]
-                clustered_indices = clustered_data["clustered_tables"]["clustered_tables"]
-
-                matched_tables = [table_dict[idx] for idx in clustered_indices if idx in table_dict]
-                processed_data.append({
-                    "source_table_idx": source_table_idx,
-                    "query": query,
-                    "matched_tables": matched_tables
-                })
-
-                with torch.no_grad():
-                    for table in tqdm(matched_tables, desc="Processing tables"):
-                        table_idx = table["table_idx"]
-                        caption = table.get("caption", "")
-                        if args.schema_only:
-                            table_str = f"Table Caption: {caption}. Table Headers: {table['table']['header']}"
-                            # table_str = f"Table Headers: {table['table']['header']}"
-                        elif args.headers_only:
-                            table_str = f"Table Headers: {table['table']['header']}"
-                        else:
-                            table_str = linearize_table(table)
-
-                        table_embedding = sentence_model.encode(table_str, convert_to_tensor=True, device=device)
-                        if table_idx not in processed_table_idxs:
-                            processed_table_idxs.add(table_idx)
-                            processed_encodings[table_idx] = {
-                                "table_idx": table_idx,
-                                "source_table_idx": source_table_idx,
-                                "test_query": query,
-                                "table_id": caption,
-                                "table_embedding": table_embedding
-                            }
-
-                # --- Iterative Graph-based Ranking via Personalized PageRank ---
-                initial_total = len(processed_encodings)
-                current_encodings = processed_encodings
-                for iteration in trange(args.num_iterations):
-                    S, R_norm, table_indices = build_similarity_matrix(current_encodings, similarity_threshold=0.3)
-                    P = build_transition_matrix(S)
-                    personalization = compute_personalization_vector(query, sentence_model, R_norm)
-                    pagerank_scores = run_pagerank_gpu(P, personalization, alpha=0.85, max_iter=50, tol=1e-6)
-                    ranked_tables = sorted(zip(table_indices, pagerank_scores.cpu().tolist()),
-                                        key=lambda x: x[1], reverse=True)
-                    
-                    current_count = len(ranked_tables)
-                    if use_topk:
-                        keep_count = min(current_count, filter_topks[iteration])
-                        print(f"Iteration {iteration+1}: Keeping top {keep_count} out of {current_count} tables (top-k metric).")
-                    else:
-                        keep_percentage = filter_percentages[iteration]
-                        keep_count = max(1, math.ceil(current_count * (keep_percentage / 100.0)))
-                        print(f"Iteration {iteration+1}: Keeping {keep_count} out of {current_count} tables ({keep_percentage}%).")
-                    
-                    filtered_table_indices = [table_idx for table_idx, _ in ranked_tables[:keep_count]]
-                    current_encodings = {table_idx: current_encodings[table_idx] for table_idx in filtered_table_indices}
-                    
-                    if len(current_encodings) == 1:
-                        break
-                
-                final_total = len(current_encodings)
-                overall_ratio = final_total / initial_total
-                print(f"Total tables at start: {initial_total}, Final filtered tables after {iteration+1} iterations: {final_total}, Overall ratio: {overall_ratio:.2f}")
-                            
-                # Re-run ranking on the final filtered table set for evaluation.
-                final_S, final_R_norm, final_table_indices = build_similarity_matrix(current_encodings, similarity_threshold=0.3)
-                final_P = build_transition_matrix(final_S)
-                final_personalization = compute_personalization_vector(query, sentence_model, final_R_norm)
-                final_pagerank_scores = run_pagerank_gpu(final_P, final_personalization, alpha=0.85, max_iter=50, tol=1e-6)
-                final_ranked_tables = sorted(zip(final_table_indices, final_pagerank_scores.cpu().tolist()),
-                                            key=lambda x: x[1], reverse=True)
-                
+
                 final_table_ids = [table_idx for table_idx, score in final_ranked_tables]
-                if set(ground_truth_table_idx).issubset(set(final_table_ids)):
+                retrieved_all = set(ground_truth_table_idx).issubset(set(final_table_ids))
+                if retrieved_all:
                     for rank, (table_idx, score) in enumerate(final_ranked_tables, 1):
                         if table_idx in ground_truth_table_idx:
                             print(f"Final - Rank: {rank}, Table ID: {table_idx}, Score: {score}")
@@ -248,26 +595,25 @@ if __name__ == '__main__':
                 total += 1
                 print(f"Total Queries Processed: {total}, Half Retrieve Count: {half_retrieve}")
 
-                final_result = {
-                    "query": query,
-                    "query_label": query_label,
-                    "source_table_idx": source_table_idx,
-                    "retrieve_sub_table_idx": final_table_ids,
-                    "ground_truth_sub_table_idx": ground_truth_table_idx,
-                    "retrieved_tables": []
-                }
-
-                for rank, (table_idx, score) in enumerate(final_ranked_tables, 1):
-                    table_details = table_dict.get(table_idx, {}) 
-                    
-                    selected_details = {
-                        "split": table_details.get("split"),
-                        "source_table_idx": table_details.get("source_table_idx"),
-                        "table_idx": table_details.get("table_idx"),
-                        "caption": table_details.get("caption"),
-                        "table": table_details.get("table"),
-                    }
-
-                    final_result["retrieved_tables"].append(selected_details)
+                with timer.span("write"):
+                    final_result = RetrievalResult(
+                        query=query,
+                        query_label=query_label,
+                        source_table_idx=source_table_idx,
+                        retrieve_sub_table_idx=final_table_ids,
+                        ground_truth_sub_table_idx=ground_truth_table_idx,
+                    )
+                    if args.output_format == "refs":
+                        # Ranked ids and scores only; call_llm.py resolves the tables through the table store.
+                        final_result.retrieved_scores = [score for table_idx, score in final_ranked_tables]
+                    else:
+                        final_result.retrieved_tables = [retrieved_table(table_store, table_idx)
+                                                         for table_idx, score in final_ranked_tables]
+                    journal.add(query_keys[pos], encode_line(final_result), total=1, half_retrieve=int(retrieved_all))
 
-                output_f.write(json.dumps(final_result) + "\n")
\ No newline at end of file
+    if score_cutoff is not None:
+        print(f"Final tables per query ({args.cutoff_mode} cutoff): {kept_count_report(kept_counts)}")
+    if timer.enabled:
+        timer.write(args.timing_file, output_file=output_file, workers=args.workers,
+                    query_batch_size=args.query_batch_size)
+        print(f"Stage timings ({len(timer.queries)} queries) saved to {args.timing_file}:\n{timer.report()}")
@@ -0,0 +1,1085 @@
+#!/usr/bin/env python3
+"""
+Quick test script for table2graph retrieval modules
+Tests index/retrieval helpers on small random data without datasets or models
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+
+from retrieval_modules.dim_reduction import EmbeddingProjector
+from retrieval_modules.ooc_kmeans import MemmapKMeans, write_memmap, iter_chunks
+from retrieval_modules.knn_graph import KnnTableGraph
+from retrieval_modules.routing_tree import RoutingTree
+from retrieval_modules.sparse_graph import sparse_similarity_from_embeddings, sparse_row_normalize, scipy_to_torch_sparse
+from retrieval_modules.pagerank import run_pagerank_batched, solve_pagerank, to_scipy_csr
+from retrieval_modules.shrinking import slice_similarity, restrict_distribution
+from retrieval_modules.run_journal import RunJournal
+from retrieval_modules.timing import StageTimer
+from retrieval_modules.corpus import read_columns, iter_records, write_records
+from retrieval_modules.records import ClusteredQuery, LLMOutput, RecordDecodeError, RetrievalResult, TableRecord, decode_line, encode_line, iter_jsonl
+from retrieval_modules.table_store import TableStore, iter_retrieval_results
+from retrieval_modules.cell_index import CellIndex, cell_candidates, decode_postings, encode_postings
+from retrieval_modules.column_stats import ColumnCatalog, estimate_distinct, extract_constraints, prune_by_constraints
+from retrieval_modules.cutoff import ScoreCutoff, evaluate_cutoff, fit_calibration, kept_count_report
+from retrieval_modules.lexical import BM25Index, prune_query_batch, fuse_personalization, recall_curve
+from retrieval_modules.retriever import TableRetriever
+from retrieval_modules.scheduler import MicroBatchScheduler
+from retrieval_modules.batching import group_by_candidate_set, iter_keyed_query_batches, prefetch
+from retrieval_modules.parallel import share_knn_graph, attach_knn_graph, imap_ordered
+from retrieval_modules.benchmark import StubEncoder, compare_reports, run_benchmark
+from retrieval_modules.backends import NumpyBackend, TorchBackend, select_backend, benchmark_backends, find_crossover
+
+
+def test_projector_roundtrip(tmp_path=None):
+    """Test projector fitting, persistence and numpy/torch consistency"""
+    print("\n" + "="*60)
+    print("TEST 1: Embedding Projector")
+    print("="*60)
+
+    rng = np.random.default_rng(0)
+    # Low-rank data plus noise: PCA should keep almost all of the variance.
+    X = (rng.standard_normal((300, 8)) @ rng.standard_normal((8, 64)) +
+         0.01 * rng.standard_normal((300, 64))).astype(np.float32)
+
+    pca = EmbeddingProjector(8, method="pca").fit(X)
+    assert pca.variance_retained_ > 0.99, "PCA should retain the low-rank variance"
+
+    random_proj = EmbeddingProjector(8, method="random").fit(X)
+    assert random_proj.variance_retained_ < pca.variance_retained_, "PCA should beat random projection"
+
+    path = str(tmp_path / "projector.npz") if tmp_path is not None else "/tmp/test_projector.npz"
+    pca.save(path)
+    loaded = EmbeddingProjector.load(path)
+    projected = loaded.transform(X)
+    assert projected.shape == (300, 8), "Should project to 8 dimensions"
+    assert np.allclose(projected, pca.transform(X)), "Loaded projector should match"
+
+    single = loaded.transform(torch.from_numpy(X[0]))
+    assert torch.is_tensor(single), "Torch input should stay a tensor"
+    assert np.allclose(single.numpy(), projected[0], atol=1e-5), "Torch and numpy paths should agree"
+
+    print("✓ Test 1 passed!")
+    return True
+
+
+def test_memmap_kmeans(tmp_path=None):
+    """Test chunked KMeans over a memory-mapped feature file"""
+    print("\n" + "="*60)
+    print("TEST 2: Out-of-core KMeans")
+    print("="*60)
+
+    rng = np.random.default_rng(1)
+    centers = np.array([[0.0] * 4, [8.0] * 4, [16.0] * 4])
+    X = np.concatenate([rng.normal(c, 1.0, (500, 4)) for c in centers])
+    workdir = str(tmp_path) if tmp_path is not None else "/tmp"
+
+    features = write_memmap(f"{workdir}/features.npy", len(X), iter_chunks(X, 128, np.asarray))
+    assert isinstance(features, np.memmap), "Features should be memory-mapped"
+
+    kmeans = MemmapKMeans(n_clusters=3, chunk_size=128).fit(features, labels_path=f"{workdir}/labels.npy")
+    assert isinstance(kmeans.labels_, np.memmap), "Labels should be written to disk"
+
+    # Every generated blob should map to exactly one cluster.
+    for blob in range(3):
+        blob_labels = set(np.asarray(kmeans.labels_[blob * 500:(blob + 1) * 500]).tolist())
+        assert len(blob_labels) == 1, "Each blob should be a single cluster"
+    assert np.array_equal(kmeans.predict(X), np.asarray(kmeans.labels_)), "predict should match fitted labels"
+
+    print("✓ Test 2 passed!")
+    return True
+
+
+def dense_similarity(E, similarity_threshold=0.3):
+    """Reference dense thresholded similarity matrix, as in build_similarity_matrix"""
+    R_norm = E / np.linalg.norm(E, axis=1, keepdims=True)
+    S = R_norm @ R_norm.T
+    return np.where(S < similarity_threshold, 0.0, S)
+
+
+def test_knn_graph_subgraph(tmp_path=None):
+    """Test blockwise kNN graph construction and per-query slicing"""
+    print("\n" + "="*60)
+    print("TEST 3: Global kNN Graph")
+    print("="*60)
+
+    rng = np.random.default_rng(2)
+    E = (rng.standard_normal((120, 16)) + 1.0).astype(np.float32)
+    table_ids = list(range(500, 620))
+
+    # With k = N the kNN graph must equal the dense thresholded matrix.
+    full = KnnTableGraph.build(table_ids, E, k=len(E), block_size=32)
+    assert np.allclose(full.graph.toarray(), dense_similarity(E), atol=1e-5), "k=N should match dense"
+
+    sparse_graph = KnnTableGraph.build(table_ids, E, k=5, block_size=32)
+    assert (sparse_graph.graph != sparse_graph.graph.T).nnz == 0, "Graph should be symmetric"
+
+    path = str(tmp_path / "graph.npz") if tmp_path is not None else "/tmp/test_knn_graph.npz"
+    sparse_graph.save(path)
+    loaded = KnnTableGraph.load(path)
+    S, R_norm, ids = loaded.subgraph([503, 510, 999, 501])
+    assert ids == [503, 510, 501], "Unknown tables should be skipped"
+    assert S.shape == (3, 3) and R_norm.shape == (3, 16), "Subgraph shape mismatch"
+    assert np.allclose(S.toarray(), sparse_graph.graph.toarray()[np.ix_([3, 10, 1], [3, 10, 1])]), "Slice mismatch"
+
+    print("✓ Test 3 passed!")
+    return True
+
+
+def test_sparse_similarity_graph():
+    """Test sparse top-k graph and row normalization against the dense path"""
+    print("\n" + "="*60)
+    print("TEST 4: Sparse Similarity Graph")
+    print("="*60)
+
+    rng = np.random.default_rng(3)
+    E = (rng.standard_normal((80, 16)) + 0.5).astype(np.float32)
+    R_norm = torch.nn.functional.normalize(torch.from_numpy(E), p=2, dim=1)
+
+    # Keeping every neighbour must reproduce the dense thresholded matrix.
+    S = sparse_similarity_from_embeddings(R_norm, top_k=80, block_size=16)
+    assert S.is_sparse, "Should return a sparse tensor"
+    assert np.allclose(S.to_dense().numpy(), dense_similarity(E), atol=1e-5), "top_k=N should match dense"
+
+    dense_S = torch.from_numpy(dense_similarity(E).astype(np.float32))
+    dense_P = dense_S / (dense_S.sum(dim=1, keepdim=True) + 1e-10)
+    assert torch.allclose(sparse_row_normalize(S).to_dense(), dense_P, atol=1e-5), "Row normalization mismatch"
+
+    S_small = sparse_similarity_from_embeddings(R_norm, top_k=4)
+    assert S_small._nnz() < S._nnz(), "Smaller top_k should keep fewer edges"
+    assert torch.allclose(S_small.to_dense(), S_small.to_dense().T), "Sparse graph should be symmetric"
+
+    print("✓ Test 4 passed!")
+    return True
+
+
+def reference_pagerank(P, personalization, alpha=0.85, max_iter=50, tol=1e-6):
+    """Single-vector power iteration, as in run_pagerank_gpu"""
+    x = personalization.clone()
+    for _ in range(max_iter):
+        x_new = (1 - alpha) * personalization + alpha * (P.T @ x)
+        if torch.norm(x_new - x, p=1) < tol:
+            return x_new
+        x = x_new
+    return x
+
+
+def random_transition_matrix(n, seed=4):
+    """Row-normalized dense similarity graph over random embeddings"""
+    rng = np.random.default_rng(seed)
+    E = (rng.standard_normal((n, 16)) + 0.5).astype(np.float32)
+    S = torch.from_numpy(dense_similarity(E).astype(np.float32))
+    return S / (S.sum(dim=1, keepdim=True) + 1e-10)
+
+
+def test_batched_pagerank():
+    """Test batched PPR columns against single-vector power iteration"""
+    print("\n" + "="*60)
+    print("TEST 5: Batched Personalized PageRank")
+    print("="*60)
+
+    P = random_transition_matrix(60)
+    personalization = torch.rand(60, 5)
+    personalization[:, 0] = 0.0
+    personalization[7, 0] = 1.0  # a sharply peaked column converges at a different rate
+    personalization = personalization / personalization.sum(dim=0, keepdim=True)
+
+    scores, iterations = run_pagerank_batched(P, personalization)
+    assert scores.shape == (60, 5), "Should return one column per query"
+    for q in range(5):
+        expected = reference_pagerank(P, personalization[:, q])
+        assert torch.allclose(scores[:, q], expected, atol=1e-6), f"Column {q} should match single PPR"
+    assert int(iterations.max()) <= 50, "Should respect max_iter"
+
+    sparse_scores, _ = run_pagerank_batched(P.to_sparse(), personalization)
+    assert torch.allclose(sparse_scores, scores, atol=1e-6), "Sparse and dense P should agree"
+
+    print("✓ Test 5 passed!")
+    return True
+
+
+def test_pagerank_solvers():
+    """Test every PageRank solver against plain power iteration"""
+    print("\n" + "="*60)
+    print("TEST 6: Pluggable PageRank Solvers")
+    print("="*60)
+
+    P = random_transition_matrix(60)
+    personalization = torch.rand(60, 3)
+    personalization = personalization / personalization.sum(dim=0, keepdim=True)
+    expected = torch.stack([reference_pagerank(P, personalization[:, q], tol=1e-10, max_iter=500)
+                            for q in range(3)], dim=1)
+
+    for solver in ["power", "extrapolated", "linear"]:
+        result = solve_pagerank(P, personalization, solver=solver, tol=1e-8, max_iter=200)
+        assert result.scores.shape == (60, 3), f"{solver} should keep the batch shape"
+        assert torch.allclose(result.scores, expected, atol=1e-5), f"{solver} should match power iteration"
+        assert result.residual < 1e-4, f"{solver} should report a small residual"
+        assert result.iterations >= 1, f"{solver} should report iterations"
+        print(f"  {solver}: {result.iterations} iterations, residual {result.residual:.2e}")
+        sparse_checks = solve_pagerank(P, personalization, solver=solver, tol=1e-8, max_iter=200, check_every=7)
+        assert torch.allclose(sparse_checks.scores, expected, atol=1e-5), \
+            f"{solver} should converge with sparse convergence checks"
+        assert sparse_checks.iterations % 7 == 0, f"{solver} should only stop at a convergence check"
+
+    push = solve_pagerank(P.to_sparse(), personalization[:, 0], solver="push", push_epsilon=1e-5, max_iter=500)
+    assert push.scores.shape == (60,), "A single vector should stay a vector"
+    assert (push.scores - expected[:, 0]).abs().sum() <= push.residual / (1 - 0.85) + 1e-6, \
+        "Push error should be bounded by its residual"
+    P_csr = to_scipy_csr(P.to_sparse())
+    reused = solve_pagerank(P.to_sparse(), personalization[:, 0], solver="push", push_epsilon=1e-5, max_iter=500,
+                            P_csr=P_csr)
+    assert torch.equal(reused.scores, push.scores), "A precomputed CSR matrix should give the same push result"
+
+    try:
+        solve_pagerank(P, personalization, solver="unknown")
+        assert False, "Unknown solver should raise"
+    except ValueError:
+        pass
+
+    print("✓ Test 6 passed!")
+    return True
+
+
+def test_incremental_shrinking():
+    """Test graph slicing, personalization restriction and warm-started PageRank"""
+    print("\n" + "="*60)
+    print("TEST 7: Incremental Subgraph Shrinking")
+    print("="*60)
+
+    E = np.random.default_rng(5).random((40, 8))
+    S = torch.from_numpy(dense_similarity(E, 0.3))
+    keep = torch.tensor([5, 0, 17, 33, 8])
+    expected = torch.from_numpy(dense_similarity(E[keep.numpy()], 0.3))
+    assert torch.allclose(slice_similarity(S, keep), expected), "Dense slice should equal the rebuilt subgraph"
+    assert torch.allclose(slice_similarity(S.to_sparse(), keep).to_dense(), expected), \
+        "Sparse slice should equal the rebuilt subgraph"
+
+    sims = S[0].clone()
+    restricted = restrict_distribution(sims / sims.sum(), keep)
+    assert torch.allclose(restricted, sims[keep] / sims[keep].sum()), "Restriction should renormalize"
+    assert torch.allclose(restrict_distribution(torch.zeros(4)), torch.full((4,), 0.25)), \
+        "Empty mass should fall back to uniform"
+
+    P = S / S.sum(dim=1, keepdim=True)
+    p = sims / sims.sum()
+    cold = solve_pagerank(P, p, tol=1e-8, max_iter=200)
+    warm = solve_pagerank(P, p, tol=1e-8, max_iter=200, x0=cold.scores)
+    assert torch.allclose(warm.scores, cold.scores, atol=1e-6), "Warm start should reach the same scores"
+    assert warm.iterations < cold.iterations, "Warm start from the solution should converge immediately"
+
+    print("✓ Test 7 passed!")
+    return True
+
+
+def test_graph_backends():
+    """Test that the NumPy/SciPy and torch backends agree on the whole graph stage"""
+    print("\n" + "="*60)
+    print("TEST 8: NumPy and Torch Graph Backends")
+    print("="*60)
+
+    rng = np.random.default_rng(3)
+    R = rng.normal(size=(80, 16)).astype(np.float32) + 0.3
+    queries = rng.normal(size=(2, 16)).astype(np.float32) + 0.3
+
+    for sparse in (False, True):
+        outputs = {}
+        for backend in (NumpyBackend(), TorchBackend()):
+            R_norm = backend.normalize_rows(backend.asarray(R))
+            S = backend.similarity(R_norm, 0.3, sparse=sparse, top_k=10)
+            P = backend.transition(S)
+            p = backend.personalization(R_norm, queries)
+            keep = backend.arange(80)[:40]
+            sliced = backend.pagerank(backend.transition(backend.slice(S, keep)), backend.restrict(p, keep))
+            outputs[backend.name] = [np.asarray(backend.tolist(backend.pagerank(P, p, solver=solver).scores))
+                                     for solver in ("power", "linear")]
+            outputs[backend.name].append(np.asarray(backend.tolist(sliced.scores)))
+            _, top = backend.topk(backend.pagerank(P, p).scores[:, 0], 5)
+            outputs[backend.name + "_top"] = backend.tolist(top)
+        for ours, theirs in zip(outputs["numpy"], outputs["torch"]):
+            assert np.allclose(ours, theirs, atol=1e-5), f"Backends should agree (sparse={sparse})"
+        assert outputs["numpy_top"] == outputs["torch_top"], "Backends should rank identically"
+
+    backend = NumpyBackend()
+    R_norm = backend.normalize_rows(R)
+    P = backend.transition(backend.similarity(R_norm, 0.3))
+    p = backend.personalization(R_norm, queries)
+    power = backend.pagerank(P, p, tol=1e-9, max_iter=200)
+    linear = backend.pagerank(P, p, solver="linear", tol=1e-9, check_every=5)
+    assert np.allclose(linear.scores, power.scores, atol=1e-6), "The iterative linear solve should match power iteration"
+    assert linear.residual < 1e-6, "The linear solve should honour the L1 tolerance"
+    warm = backend.pagerank(P, p, solver="linear", tol=1e-9, x0=linear.scores)
+    assert warm.iterations <= linear.iterations, "A warm start should not need more iterations"
+
+    assert select_backend(100, device="cpu").name == "numpy", "Small CPU graphs should use NumPy"
+    assert select_backend(50000, device="cpu").name == "numpy", "Without a measured crossover CPU stays on NumPy"
+    assert select_backend(100, device="cpu", crossover=50).name == "torch", "Large graphs should use torch"
+    assert select_backend(100, solver="extrapolated").name == "torch", "Unsupported solvers should fall back to torch"
+    assert select_backend(100, preferred="torch").name == "torch", "An explicit backend should win"
+
+    results = benchmark_backends(sizes=(20, 40), dim=8, repeats=1)
+    assert [row["n_nodes"] for row in results] == [20, 40], "Benchmark should report every size"
+    assert find_crossover([{"n_nodes": 10, "numpy": 1, "torch": 2}, {"n_nodes": 20, "numpy": 2, "torch": 1}]) == 20
+
+    print("✓ Test 8 passed!")
+    return True
+
+
+def test_run_journal(tmp_path=None):
+    """Test chunked journal commits, crash recovery and resumed query skipping"""
+    print("\n" + "="*60)
+    print("TEST 9: Resumable Run Journal")
+    print("="*60)
+
+    directory = str(tmp_path) if tmp_path else tempfile.mkdtemp()
+    clustered_file = os.path.join(directory, "clustered.jsonl")
+    with open(clustered_file, "w") as f:
+        for i in range(7):
+            f.write(json.dumps({"source_table_idx": i, "query": f"query {i}", "label": "x",
+                                "clustered_tables": {"clustered_tables": [i], "size": 1}}) + "\n")
+    output_file = os.path.join(directory, "retrieved.jsonl")
+
+    with RunJournal(output_file, chunk_size=3) as journal:
+        for keys, batch in iter_keyed_query_batches(clustered_file, 5, batch_size=2):
+            for key, record in zip(keys, batch):
+                journal.add(key, encode_line(record), total=1)
+    with open(output_file) as f:
+        assert len(f.readlines()) == 5, "Every query should be written once"
+
+    # Simulate a crash: a torn output tail and a torn journal record.
+    with open(output_file, "ab") as f:
+        f.write(b'{"query": "tor')
+    with open(output_file + ".journal", "a") as f:
+        f.write('{"keys": ["6:')
+
+    with RunJournal(output_file, chunk_size=3, resume=True) as journal:
+        assert journal.counters["total"] == 5, "Counters should be restored"
+        remaining = [key for keys, _ in iter_keyed_query_batches(clustered_file, 7, 2, journal.done_keys) for key in keys]
+        assert [key.split(":")[0] for key in remaining] == ["6", "7"], "Completed queries should be skipped"
+        for key in remaining:
+            journal.add(key, json.dumps({"query": key}), total=1)
+    with open(output_file) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 7, "Torn tail should be dropped and the rest appended"
+
+    # A corrupted committed chunk invalidates itself and everything after it.
+    with open(output_file, "r+b") as f:
+        f.seek(2)
+        f.write(b"X")
+    journal = RunJournal(output_file, chunk_size=3, resume=True)
+    assert not journal.done_keys and os.path.getsize(output_file) == 0, "Corrupted chunks should be redone"
+
+    print("✓ Test 9 passed!")
+    return True
+
+
+def test_retrieval_service():
+    """Test the resident retriever and its HTTP endpoints with a stub encoder"""
+    print("\n" + "="*60)
+    print("TEST 10: Retrieval Service")
+    print("="*60)
+
+    rng = np.random.default_rng(6)
+    embeddings = rng.normal(size=(90, 12)).astype(np.float32) + 0.5
+    table_ids = [f"t{i}" for i in range(90)]
+    graph = KnnTableGraph.build(table_ids, embeddings, k=10, similarity_threshold=0.3)
+    calls = []
+
+    def encode(queries):
+        calls.append(len(queries))
+        # "table 17" encodes like table t17; anything else (e.g. the warm-up query) like t0
+        return np.stack([embeddings[int(q.split()[-1]) if q.split()[-1].isdigit() else 0] for q in queries])
+
+    tables = {table_idx: {"table_idx": table_idx} for table_idx in table_ids}
+    for n_clusters in (0, 5):
+        retriever = TableRetriever(graph, encode, filter_topks=[20, 5], n_clusters=n_clusters, nprobe=2,
+                                   candidate_k=40, tables=tables)
+        result = retriever.retrieve("table 17", include_tables=True)
+        assert len(result["table_idx"]) == 5, "Should return the last filter_topks tables"
+        assert result["scores"] == sorted(result["scores"], reverse=True), "Should rank best-first"
+        assert [t["table_idx"] for t in result["tables"]] == result["table_idx"], "Payloads should follow ranks"
+        assert "t17" in result["table_idx"], "The query's own table should rank near the top"
+    assert len(retriever.retrieve_batch(["table 1", "table 2"])) == 2 and calls[-1] == 2, \
+        "A batch should be encoded in one call"
+
+    # A saved router reloads into the same routing without refitting.
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        router_file = os.path.join(tmp_dir, "router.npz")
+        retriever.router.save(router_file)
+        reloaded = TableRetriever(graph, encode, filter_topks=[20, 5], nprobe=2, tables=tables,
+                                  router=MemmapKMeans.load(router_file))
+    assert reloaded.retrieve("table 17")["table_idx"] == retriever.retrieve("table 17")["table_idx"], \
+        "A reloaded router should route like the fitted one"
+
+    pytest.importorskip("httpx")
+    from starlette.testclient import TestClient
+    from retrieval_modules.service import create_app
+    client = TestClient(create_app(retriever))
+    assert client.get("/health").json()["n_tables"] == 90, "Health should report the index"
+    assert client.post("/warmup").json()["warmed_up"], "Warm-up should succeed"
+    response = client.post("/retrieve", json={"query": "table 3", "top_k": 3})
+    assert response.status_code == 200 and len(response.json()["table_idx"]) == 3, "top_k should cap results"
+    assert client.post("/retrieve", json={"query": ""}).status_code == 400, "Empty queries should be rejected"
+    assert client.post("/retrieve", content=b"not json").status_code == 400, "Malformed JSON should be rejected"
+
+    print("✓ Test 10 passed!")
+    return True
+
+
+def test_micro_batch_scheduler():
+    """Test that concurrent requests are batched, prioritized and match unbatched results"""
+    print("\n" + "="*60)
+    print("TEST 11: Micro-Batch Scheduler")
+    print("="*60)
+    import asyncio
+
+    rng = np.random.default_rng(7)
+    embeddings = rng.normal(size=(60, 12)).astype(np.float32) + 0.5
+    graph = KnnTableGraph.build([f"t{i}" for i in range(60)], embeddings, k=8, similarity_threshold=0.3)
+    batches = []
+
+    def encode(queries):
+        batches.append(list(queries))
+        return np.stack([embeddings[int(q.split()[-1])] for q in queries])
+
+    retriever = TableRetriever(graph, encode, filter_topks=[15, 5], n_clusters=3, nprobe=1)
+    expected = {q: retriever.retrieve(q)["table_idx"] for q in [f"table {i}" for i in range(10)]}
+    batches.clear()
+
+    async def run():
+        scheduler = MicroBatchScheduler(retriever, max_batch_size=4, max_wait_ms=50)
+        calls = [scheduler.retrieve(f"table {i}") for i in range(9)]
+        calls.append(scheduler.retrieve("table 9", priority=1, deadline_ms=5))
+        results = await asyncio.gather(*calls)
+        stats = scheduler.stats()
+        warm_batches = len(batches)
+        await scheduler.warm_up(["table 0"])
+        assert batches[warm_batches:] == [["table 0"]], "Warm-up should run as a scheduler batch"
+        del batches[warm_batches:]
+        await scheduler.stop()
+        return results, stats
+
+    results, stats = asyncio.run(run())
+    print(f"Encoder calls: {[len(b) for b in batches]}, stats: {stats}")
+    assert [len(b) for b in batches] == [4, 4, 2], "Ten queued requests should form batches of 4, 4, 2"
+    assert "table 9" in batches[0], "The high-priority request should jump the queue"
+    for result in results:
+        assert result["table_idx"] == expected[result["query"]], "Batched ranking should match unbatched"
+        assert "queue" in result["latency_ms"]
+    assert stats["requests"] == 10 and stats["batches"] == 3
+    assert retriever.warmed_up
+
+    print("✓ Test 11 passed!")
+    return True
+
+
+def test_shared_index():
+    """Test shared-memory graph attachment and ordered bounded task mapping"""
+    print("\n" + "="*60)
+    print("TEST 12: Shared Index for Workers")
+    print("="*60)
+    import time
+    from multiprocessing.pool import ThreadPool
+
+    rng = np.random.default_rng(8)
+    graph = KnnTableGraph.build([f"t{i}" for i in range(40)], rng.normal(size=(40, 6)).astype(np.float32),
+                                k=5, similarity_threshold=0.0)
+    handle, blocks = share_knn_graph(graph)
+    try:
+        shared = attach_knn_graph(handle)
+        candidates = ["t3", "t17", "t5", "t39"]
+        S, R_norm, ids = graph.subgraph(candidates)
+        S_shared, R_shared, ids_shared = shared.subgraph(candidates)
+        assert ids == ids_shared and np.allclose(R_norm, R_shared), "Attached graph should match the original"
+        assert (S != S_shared).nnz == 0, "Attached adjacency should match the original"
+        published = np.ndarray(graph.embeddings.shape, graph.embeddings.dtype, buffer=blocks[-1].buf)
+        published[0, 0] = 42.0
+        assert shared.embeddings[0, 0] == 42.0, "Attached embeddings should map the shared block, not a copy"
+        del published
+        del shared, S_shared, R_shared
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    def slow_square(x):
+        time.sleep(0.01 * (5 - x % 5))  # later tasks finish first
+        return x * x
+
+    with ThreadPool(4) as pool:
+        results = list(imap_ordered(pool, slow_square, range(12), max_pending=3))
+    assert results == [(x, x * x) for x in range(12)], "Results should come back in task order"
+
+    print("✓ Test 12 passed!")
+    return True
+
+
+def test_table_store():
+    """Test lazy offset-indexed table lookups, the LRU cache and index persistence"""
+    print("\n" + "="*60)
+    print("TEST 13: Table Store")
+    print("="*60)
+    import pickle
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        table_file = os.path.join(tmp_dir, "toy_table.jsonl")
+        tables = [{"table_idx": i, "caption": f"caption {i}", "table": {"header": ["a"], "rows": [[str(i)] * 3]}}
+                  for i in range(20)]
+        with open(table_file, "w", encoding="utf-8") as f:
+            for table in tables:
+                f.write(json.dumps(table) + "\n")
+
+        store = TableStore(table_file, cache_size=4)
+        assert os.path.exists(table_file + ".idx.npz"), "The offset index should be persisted"
+        assert len(store) == 20 and 7 in store and 99 not in store
+        assert store[7].to_dict() == tables[7] and store.get(99, {}) == {}, "Lookups should decode the right line"
+        for i in range(10):
+            store[i]
+        store[9]
+        print(f"Stats: {store.stats()}")
+        assert store.stats()["cached"] == 4 and store.hits == 1, "The LRU cache should be bounded"
+        assert pickle.loads(pickle.dumps(store))[19].to_dict() == tables[19], "Pickled stores should reopen the file"
+        assert [table_idx for table_idx, _ in store.items()] == store.keys()
+        store.close()
+
+        retrieval_file = os.path.join(tmp_dir, "toy_retrieved.jsonl")
+        with open(retrieval_file, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"query": "q", "retrieve_sub_table_idx": [4, 2], "retrieved_scores": [0.6, 0.4]}) + "\n")
+        record = next(iter_retrieval_results(retrieval_file, table_file))
+        assert [t["caption"] for t in record["retrieved_tables"]] == ["caption 4", "caption 2"], \
+            "Reference-format output should be resolved in rank order"
+
+        with open(table_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"table_idx": 20, "caption": "new"}) + "\n")
+        store = TableStore(table_file)
+        assert store[20]["caption"] == "new", "A changed table file should trigger an index rebuild"
+        store.close()
+
+    print("✓ Test 13 passed!")
+    return True
+
+
+def test_columnar_corpus():
+    """Test Arrow / Parquet corpus files against their JSONL originals"""
+    print("\n" + "="*60)
+    print("TEST 14: Columnar Corpus")
+    print("="*60)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        table_file = os.path.join(tmp_dir, "toy_table.jsonl")
+        tables = [{"table_idx": f"t{i}", "source_table_idx": i // 3, "caption": f"caption {i}",
+                   "table": {"header": ["a", "b"], "rows": [[i, "x"], [None, 1.5]]}} for i in range(9)]
+        write_records(table_file, tables)
+        assert read_columns(table_file, ["source_table_idx"])["source_table_idx"] == [i // 3 for i in range(9)], \
+            "JSONL files should be read when no columnar file exists"
+
+        for corpus_format in ["parquet", "arrow"]:
+            columnar_file = write_records(table_file, tables, corpus_format)
+            assert columnar_file.endswith("." + corpus_format)
+            assert list(iter_records(table_file)) == tables, f"{corpus_format} rows should round-trip"
+            columns = read_columns(table_file, ["caption", "table"])
+            assert columns["table"][4] == tables[4]["table"], "Mixed-type columns should be decoded back"
+            print(f"{corpus_format}: {os.path.getsize(columnar_file)} bytes")
+
+        store = TableStore(table_file, cache_size=2)
+        assert store.stats()["backend"] == "arrow" and not os.path.exists(table_file + ".idx.npz")
+        assert store["t5"].to_dict() == tables[5] and store.keys() == [t["table_idx"] for t in tables], \
+            "The table store should read rows from the memory-mapped Arrow file"
+        store.close()
+
+        # Regenerating the JSONL makes the columnar exports stale: readers fall back to the JSONL.
+        write_records(table_file, tables[:4])
+        with pytest.warns(UserWarning, match="Ignoring"):
+            assert len(list(iter_records(table_file))) == 4, "A stale columnar file should not shadow the JSONL"
+        with pytest.warns(UserWarning):
+            store = TableStore(table_file, cache_size=2)
+        assert store.stats()["backend"] == "jsonl" and len(store.keys()) == 4
+        store.close()
+        with pytest.raises(ValueError):
+            next(iter_records(table_file, columns=["caption"], record_type=TableRecord))
+
+    print("✓ Test 14 passed!")
+    return True
+
+
+def test_typed_records():
+    """Test msgspec record decoding, dict-style access, encoding and malformed-line errors"""
+    print("\n" + "="*60)
+    print("TEST 15: Typed Records")
+    print("="*60)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        retrieval_file = os.path.join(tmp_dir, "toy_retrieved.jsonl")
+        record = {"query": "q", "query_label": ["yes"], "source_table_idx": 3, "retrieve_sub_table_idx": [7, "t2"],
+                  "ground_truth_sub_table_idx": [7],
+                  "retrieved_tables": [{"split": "test", "source_table_idx": 3, "table_idx": 7, "caption": "c",
+                                        "table": {"header": ["a"], "rows": [[1], ["x"]]}}]}
+        with open(retrieval_file, "w", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n\n")
+            f.write(json.dumps({"query": "q2", "retrieve_sub_table_idx": [1], "retrieved_scores": [0.5]}) + "\n")
+            f.write('{"query": "q3", "retrieve_sub_table_idx": {"bad": 1}}\n')
+
+        records = iter_jsonl(retrieval_file, RetrievalResult)
+        result = next(records)
+        assert isinstance(result, RetrievalResult) and json.loads(encode_line(result)) == record, \
+            "Records should round-trip through the typed schema"
+        assert result["retrieved_tables"][0]["table"]["header"] == ["a"] and result.get("missing", 1) == 1
+        scores_only = next(records)
+        assert "retrieved_tables" not in scores_only and "retrieved_tables" not in json.loads(encode_line(scores_only)), \
+            "Unset optional fields should be left out when encoding"
+        try:
+            next(records)
+            assert False, "A malformed line should raise"
+        except RecordDecodeError as e:
+            print(f"Error: {e}")
+            assert e.line_no == 4 and "retrieve_sub_table_idx" in str(e), "The error should locate the line and field"
+
+        table = decode_line('{"table_idx": 1, "caption": "c"}', TableRecord)
+        assert table.get("caption", "") == "c" and table.get("table", {}) == {} and "table" not in table
+
+        # Both downstream output spellings decode into groundtruth / output.
+        v0 = decode_line('{"query": "q", "groundtruth": ["a"], "output": "<answer>a</answer>"}', LLMOutput)
+        v1 = decode_line('{"query": "q", "ground_truth": ["a"], "generated_text": "<answer>a</answer>", '
+                         '"decomposition": null}', LLMOutput)
+        assert v0 == v1 and v1["groundtruth"] == ["a"] and v1["output"] == "<answer>a</answer>", \
+            "call_llm_v1 field names should be accepted"
+        assert decode_line('{"query": "q"}', LLMOutput)["output"] is None, "Missing fields should decode as None"
+
+    # Reading JSONL through a leaf module must not import the heavy dependencies.
+    code = ("import sys; import retrieval_modules.records, retrieval_modules.table_store, retrieval_modules.column_stats; "
+            "print([m for m in ('torch', 'sklearn', 'pyarrow') if m in sys.modules])")
+    loaded = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout.strip()
+    assert loaded == "[]", f"Leaf modules loaded {loaded}"
+
+    print("✓ Test 15 passed!")
+    return True
+
+
+def test_stage_timer():
+    """Test stage spans, percentiles, per-query records and merging worker timings"""
+    print("\n" + "="*60)
+    print("TEST 16: Stage Timer")
+    print("="*60)
+
+    disabled = StageTimer(enabled=False)
+    assert disabled.span("ppr") is disabled.span("sort"), "A disabled timer should reuse one no-op span"
+    with disabled.span("ppr"):
+        pass
+    disabled.end_query(10)
+    assert not disabled.spans and not disabled.queries
+
+    worker = StageTimer()
+    with worker.span("similarity"):
+        pass
+    group_frame = worker.take_frame()
+    for n in range(2):
+        worker.add("ppr", 0.002 * (n + 1))
+        worker.end_query(50, shared=group_frame, group_size=2, batch_shared={"lexical": 0.004}, batch_size=4)
+    timer = StageTimer()
+    timer.merge(worker.drain())
+    assert not worker.spans and len(timer.queries) == 2, "Drained worker timings should move to the parent"
+    assert abs(timer.queries[1]["ms"]["ppr"] - 4.0) < 1e-9, "Per-query stage times should be kept"
+    assert timer.queries[0]["ms"]["similarity"] == timer.queries[1]["ms"]["similarity"], \
+        "Group stages should be shared evenly by the group's queries"
+    assert abs(timer.queries[0]["ms"]["lexical"] - 1.0) < 1e-9, "Batch stages should be shared by the batch's queries"
+
+    for ms in range(1, 101):
+        timer.add("write", ms / 1e3)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        summary = timer.write(os.path.join(tmp_dir, "timing.json"), run="toy")
+    write = summary["stages"]["write"]
+    print(timer.report())
+    assert write["count"] == 100 and abs(write["p50"] - 50.5) < 1e-6 and 98 < write["p99"] <= 100
+    assert sum(write["histogram"]["counts"]) == 100 and summary["candidate_sizes"]["p50"] == 50
+    assert summary["run"] == "toy"
+
+    print("✓ Test 16 passed!")
+    return True
+
+
+def test_benchmark():
+    """Test the synthetic-corpus benchmark report and baseline regression check"""
+    print("\n" + "="*60)
+    print("TEST 17: Offline Benchmark")
+    print("="*60)
+
+    encoder = StubEncoder(dim=16)
+    a, b = encoder(["alpha beta", "alpha beta"]), StubEncoder(dim=16)(["beta alpha"])
+    assert np.allclose(a[0], a[1]) and np.allclose(a[0], b[0]), "The stub encoder should be deterministic"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = run_benchmark(tmp_dir, n_tables=90, n_queries=12, dim=32, n_clusters=4, nprobe=2, knn_k=5,
+                               filter_topks=(20, 3), query_batch_size=4)
+        assert os.path.exists(os.path.join(tmp_dir, "synth90", "synth90_clustered_tables_stub.jsonl"))
+    print(json.dumps(report["quality"]))
+    assert report["config"]["n_queries"] == 12 and report["retrieval"]["qps"] > 0
+    assert set(report["stages"]) >= {"load_s", "clustering_s", "candidates_s", "retrieval_s"}
+    assert 0 <= report["quality"]["recall"] <= report["quality"]["candidate_recall"] <= 1
+
+    assert not any(row["regression"] for row in compare_reports(report, report)), "A report should match itself"
+    slower, baseline = json.loads(json.dumps(report)), json.loads(json.dumps(report))
+    slower["stages"]["retrieval_s"], baseline["stages"]["retrieval_s"] = 0.3, 0.1
+    baseline["retrieval"]["qps"] *= 3
+    flagged = {row["metric"] for row in compare_reports(slower, baseline) if row["regression"]}
+    assert flagged == {"stages.retrieval_s", "retrieval.qps"}, f"Unexpected regressions: {flagged}"
+
+    print("✓ Test 17 passed!")
+    return True
+
+
+def test_routing_tree():
+    """Test hierarchical routing: leaf coverage, beam search, persistence and the retriever hook"""
+    print("\n" + "="*60)
+    print("TEST 18: Routing Tree")
+    print("="*60)
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((12, 16)).astype(np.float32)
+    embeddings = np.repeat(centers, 40, axis=0) + 0.05 * rng.standard_normal((480, 16)).astype(np.float32)
+    tree = RoutingTree.build(embeddings, branching=4, leaf_size=50, typical_k=3)
+    stats = tree.stats()
+    print(stats)
+    leaves = np.nonzero(tree.is_leaf)[0]
+    covered = np.concatenate([tree.node_members(n) for n in leaves])
+    assert np.array_equal(np.sort(covered), np.arange(480)), "Leaves should partition the rows"
+    assert stats["depth"] >= 2 and stats["max_leaf_size"] <= 50
+
+    query = centers[5] / np.linalg.norm(centers[5])
+    routed = tree.route(query, beam_width=1)
+    assert set(range(200, 240)) >= set(routed["positions"].tolist()) and len(routed["positions"]) > 0, \
+        "A beam of one should end in a leaf of the query's blob"
+    assert routed["comparisons"] < len(leaves), "Routing should not score every leaf"
+    norms = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    assert tree.route(query, beam_width=1, score="typical", embeddings=norms)["leaves"] == routed["leaves"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "tree.npz")
+        tree.save(path)
+        loaded = RoutingTree.load(path)
+    assert np.array_equal(loaded.route(query, beam_width=3)["positions"], tree.route(query, beam_width=3)["positions"])
+
+    knn_graph = KnnTableGraph.build(list(range(480)), embeddings, k=5)
+    retriever = TableRetriever(knn_graph, lambda queries: np.stack([centers[5]] * len(queries)), filter_topks=[10],
+                               routing_tree=tree, beam_width=2, backend="numpy")
+    result = retriever.retrieve("blob five")
+    assert result["n_candidates"] == len(tree.route(query, beam_width=2)["positions"])
+    assert all(200 <= table_idx < 240 for table_idx in result["table_idx"])
+
+    print("✓ Test 18 passed!")
+    return True
+
+
+def test_bm25_prefilter():
+    """Test BM25 scoring, candidate pruning, persistence, personalization fusion and recall curves"""
+    print("\n" + "="*60)
+    print("TEST 19: BM25 Pre-filter")
+    print("="*60)
+
+    schemas = ["Caption: 2008 election results; Headers: ['party', 'votes'];",
+               "Caption: album sales; Headers: ['album', 'year'];",
+               "Caption: election turnout by city; Headers: ['city', 'turnout'];",
+               "Caption: football league; Headers: ['team', 'points'];"]
+    index = BM25Index.build(schemas, [10, 11, 12, 13])
+    scores = index.scores("how many votes did each party get in the election")
+    assert scores.argmax() == 0 and scores[2] > 0 and scores[1] == 0 and scores[3] == 0
+    assert index.prune("election turnout", [13, 12, 11, 10], 2) == [12, 10], "Pruning should keep candidate order"
+    assert index.prune("no match at all", [13, 12, 11], 2) == [13, 12], "Ties should keep the first candidates"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bm25.npz")
+        index.save(path)
+        loaded = BM25Index.load(path)
+    assert np.allclose(loaded.scores("album year"), index.scores("album year")) and loaded.table_ids == index.table_ids
+
+    batch = [decode_line(encode_line({"source_table_idx": 0, "query": "party votes", "label": None,
+                                      "clustered_tables": {"clustered_tables": [11, 10, 13], "size": 3}}),
+                         ClusteredQuery)]
+    pruned = prune_query_batch(batch, index, 1)
+    assert pruned[0]["clustered_tables"]["clustered_tables"] == [10] and pruned[0]["clustered_tables"]["size"] == 1
+    assert batch[0]["clustered_tables"]["size"] == 3, "The original record should be left as is"
+
+    # Queries are grouped by their pruned candidate sets, so a batch ranks exactly like its queries one at a time.
+    rng = np.random.default_rng(20)
+    words = ["election", "votes", "album", "sales", "league", "points", "city", "turnout", "party", "year"]
+    table_ids = list(range(40))
+    vocab_index = BM25Index.build([" ".join(rng.choice(words, size=4)) for _ in table_ids], table_ids)
+    embeddings = rng.normal(size=(40, 12)).astype(np.float32) + 0.5
+    graph = KnnTableGraph.build(table_ids, embeddings, k=8, similarity_threshold=0.0)
+    retriever = TableRetriever(graph, None, filter_topks=[12, 5], backend="numpy")
+    texts = ["election votes", "album sales year", "league points", "city turnout party", "election votes"]
+    queries = [decode_line(encode_line({"source_table_idx": 0, "query": text, "label": None,
+                                        "clustered_tables": {"clustered_tables": table_ids[:30], "size": 30}}),
+                           ClusteredQuery) for text in texts]
+    query_norms = embeddings[[0, 7, 14, 21, 0]] / np.linalg.norm(embeddings[[0, 7, 14, 21, 0]], axis=1, keepdims=True)
+
+    def rank(query_batch, norms):
+        ranked = {}
+        for group in group_by_candidate_set(query_batch):
+            positions = np.array(query_batch[group[0]]["clustered_tables"]["clustered_tables"])
+            for pos, result in zip(group, retriever.rank_group(norms[group], positions, [None] * len(group))):
+                ranked[pos] = result["table_idx"]
+        return [ranked[pos] for pos in range(len(query_batch))]
+
+    pruned = prune_query_batch(queries, vocab_index, 15)
+    batched = rank(pruned, query_norms)
+    one_by_one = [rank(pruned[pos:pos + 1], query_norms[pos:pos + 1])[0] for pos in range(len(pruned))]
+    assert len(group_by_candidate_set(pruned)) == 4, "Only queries left with the same candidates should share a group"
+    assert batched == one_by_one, "Rankings should not depend on the batch size"
+    for result, clustered_data in zip(batched, pruned):
+        assert set(result) <= set(clustered_data["clustered_tables"]["clustered_tables"]), \
+            "Pruned tables should not be ranked"
+
+    backend = NumpyBackend()
+    dense = np.full((3, 2), 1 / 3, dtype=np.float32)
+    lexical = np.array([[2.0, 0.0], [0.0, 0.0], [2.0, 0.0]], dtype=np.float32)
+    fused = fuse_personalization(backend, dense, lexical, 0.5)
+    assert np.allclose(fused.sum(axis=0), 1.0) and np.allclose(fused[:, 1], dense[:, 1])
+    assert fused[0, 0] > fused[1, 0], "Lexical matches should gain personalization mass"
+
+    curve = recall_curve(index, ["party votes", "album"], [[11, 12, 10], [13, 11]], [[10], [11]], [1, 2, 3])
+    print(curve)
+    recalls = [point["recall"] for point in curve["curve"]]
+    assert curve["unpruned"] == 1.0 and recalls == sorted(recalls) and recalls[0] == 1.0
+
+    print("✓ Test 19 passed!")
+    return True
+
+
+def test_cell_index():
+    """Test delta/varint postings, cell-phrase lookups, persistence and candidate updates"""
+    print("\n" + "="*60)
+    print("TEST 20: Cell-Value Index")
+    print("="*60)
+
+    rows = np.sort(np.random.default_rng(0).choice(10**6, size=300, replace=False))
+    encoded = encode_postings(rows)
+    assert np.array_equal(decode_postings(np.frombuffer(encoded, dtype=np.uint8)), rows)
+    assert len(encoded) < rows.nbytes / 2, "Delta-encoded postings should be smaller than int64 rows"
+
+    tables = [(20 + i, {"table": {"header": ["name", "year"],
+                                  "rows": [["Lionel Messi" if i == 3 else f"player {i}", "2008"], ["Spain", "yes"]]}})
+              for i in range(8)]
+    index = CellIndex.build(tables)
+    print(index.stats())
+    assert index.rows("lionel messi").tolist() == [3] and len(index.rows("spain")) == 8
+    matches = index.lookup("How many goals did Lionel Messi score for Spain in 2008?", top_e=3, max_df=4)
+    assert [table_idx for table_idx, _ in matches] == [23], "Phrases in too many tables should be ignored"
+    assert index.lookup("spain", max_df=8)[0][1] == 0.0, "A phrase in every table carries no weight"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "cells.npz")
+        index.save(path)
+        loaded = CellIndex.load(path)
+    assert loaded.lookup("lionel messi") == index.lookup("lionel messi")
+
+    batch = [{"query": "lionel messi goals", "clustered_tables": {"clustered_tables": [20, 21], "size": 2}},
+             {"query": "no cell here", "clustered_tables": {"clustered_tables": [20, 21], "size": 2}}]
+    added = cell_candidates(batch, index, top_e=5, mode="add")
+    restricted = cell_candidates(batch, index, top_e=5, mode="restrict")
+    assert added[0]["clustered_tables"]["clustered_tables"] == [20, 21, 23]
+    assert restricted[0]["clustered_tables"]["clustered_tables"] == [23] and restricted[1] is batch[1]
+    assert batch[0]["clustered_tables"]["size"] == 2, "The original record should be left as is"
+    # A matched table joins only its own query's graph: updated queries leave the shared group.
+    for updated in (added, restricted):
+        assert group_by_candidate_set(updated) == [[0], [1]], "Cell matches should not change another query's graph"
+
+    print("✓ Test 20 passed!")
+    return True
+
+
+def test_column_catalog():
+    """Test column statistics, query constraints and conservative pruning"""
+    print("\n" + "="*60)
+    print("TEST 21: Column Statistics Catalog")
+    print("="*60)
+
+    assert estimate_distinct(["a", "b", "a", "c"]) == 3, "Small inputs should be counted exactly"
+    estimate = estimate_distinct([str(i) for i in range(5000)])
+    assert 3000 < estimate < 8000, f"KMV estimate {estimate} is far from 5000"
+
+    constraints = extract_constraints("Which clubs won more than 1,500 games between 1990 and 2000?")
+    assert ("number", 1500.0, float("inf")) in constraints and ("year", 1990.0, 2000.0) in constraints
+    assert extract_constraints("Who won in 2008?") == [("year", 2008.0, 2008.0)]
+    assert extract_constraints("Who is the captain?") == []
+
+    tables = [(30, {"table": {"header": ["season", "wins", "club"],
+                              "rows": [["1995", "12", "Ajax"], ["1998", "20", "PSV"], ["1999", "1,204", "Ajax"]]}}),
+              (31, {"table": {"header": ["season", "club"], "rows": [["2010", "Ajax"], ["2012", "Feyenoord"]]}}),
+              (32, {"table": {"header": ["club", "city"], "rows": [["Ajax", "Amsterdam"]]}})]
+    catalog = ColumnCatalog.build(tables)
+    print(catalog.stats())
+    season, wins, club = catalog.columns(30)
+    assert season["is_year"] and (season["min"], season["max"]) == (1995.0, 1999.0)
+    assert wins["type"] == "real" and not wins["is_year"] and wins["max"] == 1204.0
+    assert club["type"] == "text" and "min" not in club and club["top_values"][0] == ("Ajax", 2)
+    assert "season (year, 3 values, 1995 to 1999)" in catalog.summary(30)
+
+    assert not catalog.can_satisfy(31, extract_constraints("champions between 1990 and 2000"))
+    assert catalog.can_satisfy(32, extract_constraints("champions between 1990 and 2000")), \
+        "Tables without year columns cannot be ruled out"
+    assert catalog.can_satisfy(99, extract_constraints("in 2008")), "Unknown tables should pass"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "catalog.npz")
+        catalog.save(path)
+        loaded = ColumnCatalog.load(path)
+    assert loaded.columns(30) == catalog.columns(30)
+
+    batch = [{"query": "clubs between 1990 and 2000", "clustered_tables": {"clustered_tables": [30, 31, 32], "size": 3}},
+             {"query": "clubs in 1850", "clustered_tables": {"clustered_tables": [30, 31], "size": 2}},
+             {"query": "clubs in Amsterdam", "clustered_tables": {"clustered_tables": [30, 31], "size": 2}}]
+    pruned = prune_by_constraints(batch, loaded)
+    assert pruned[0]["clustered_tables"]["clustered_tables"] == [30, 32]
+    assert pruned[1] is batch[1], "A query that would lose every candidate should be left as is"
+    assert pruned[2] is batch[2] and batch[0]["clustered_tables"]["size"] == 3
+    assert group_by_candidate_set(pruned) == [[0], [1, 2]], \
+        "A constraint-pruned query should get its own graph; unpruned queries keep sharing theirs"
+
+    print("✓ Test 21 passed!")
+    return True
+
+
+def test_score_cutoff():
+    """Test the adaptive final-table cutoff modes and the calibration fit"""
+    print("\n" + "="*60)
+    print("TEST 22: Score Cutoff")
+    print("="*60)
+
+    scores = [0.40, 0.30, 0.25, 0.02, 0.02, 0.01]
+    assert ScoreCutoff("gap").keep_count(scores) == 3, "gap should cut before the 0.25 -> 0.02 drop"
+    assert ScoreCutoff("gap", gap=0.01).keep_count(scores) == 6, "No drop is sharp enough: keep up to the cap"
+    assert ScoreCutoff("mass", mass=0.5).keep_count(scores) == 2
+    assert ScoreCutoff("mass", min_keep=4).keep_count(scores) == 4
+    assert ScoreCutoff("gap", max_keep=2).keep_count(scores) == 2
+    assert ScoreCutoff("mass").keep_count([0.5]) == 1 and ScoreCutoff("gap").keep_count([0.0, 0.0, 0.0]) == 3
+    with pytest.raises(ValueError):
+        ScoreCutoff("probability")
+
+    rng = np.random.default_rng(0)
+    score_lists, relevance_lists = [], []
+    for _ in range(200):
+        n_relevant = int(rng.integers(1, 4))
+        ranked = np.sort(np.concatenate([rng.uniform(0.2, 0.4, n_relevant), rng.uniform(0.0, 0.05, 10 - n_relevant)]))
+        score_lists.append(ranked[::-1].tolist())
+        relevance_lists.append([i < n_relevant for i in range(10)])
+    calibration = fit_calibration(score_lists, relevance_lists)
+    print(calibration)
+    assert calibration["slope"] > 0, "Higher score shares should mean higher relevance"
+    report = evaluate_cutoff(ScoreCutoff("probability", calibration=calibration), score_lists, relevance_lists,
+                             [sum(relevance) for relevance in relevance_lists])
+    print(report)
+    assert report["recall"] > 0.95 and report["mean"] < 4, "The calibrated cutoff should keep the relevant few"
+
+    summary = kept_count_report(Counter({2: 3, 5: 1}))
+    assert summary["queries"] == 4 and summary["mean"] == 2.75 and summary["histogram"] == {2: 3, 5: 1}
+
+    print("✓ Test 22 passed!")
+    return True
+
+
+def test_prefetch():
+    """Test the background prefetch of the streaming driver"""
+    print("\n" + "="*60)
+    print("TEST 23: Streaming Prefetch")
+    print("="*60)
+
+    assert list(prefetch(iter(range(100)), depth=3)) == list(range(100)), "Order should be preserved"
+    assert list(prefetch(iter(range(5)), depth=0)) == list(range(5))
+
+    produced = []
+
+    def slow_source():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+
+    for item in prefetch(slow_source(), depth=2):
+        if item == 3:
+            break
+    time.sleep(0.3)
+    assert len(produced) <= 3 + 2 + 2, f"The producer should stay within depth and stop early ({len(produced)})"
+    assert not any(thread.name == "prefetch" for thread in threading.enumerate()), "The producer should exit"
+
+    def failing_source():
+        yield 1
+        raise KeyError("bad record")
+
+    items = prefetch(failing_source(), depth=2)
+    assert next(items) == 1
+    with pytest.raises(KeyError):
+        next(items)
+
+    print("✓ Test 23 passed!")
+    return True
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("\n" + "="*70)
+    print("TABLE2GRAPH RETRIEVAL MODULE TESTS")
+    print("="*70)
+
+    tests = [
+        ("Embedding projector", test_projector_roundtrip),
+        ("Out-of-core KMeans", test_memmap_kmeans),
+        ("Global kNN graph", test_knn_graph_subgraph),
+        ("Sparse similarity graph", test_sparse_similarity_graph),
+        ("Batched PageRank", test_batched_pagerank),
+        ("PageRank solvers", test_pagerank_solvers),
+        ("Incremental shrinking", test_incremental_shrinking),
+        ("Graph backends", test_graph_backends),
+        ("Run journal", test_run_journal),
+        ("Retrieval service", test_retrieval_service),
+        ("Micro-batch scheduler", test_micro_batch_scheduler),
+        ("Shared index for workers", test_shared_index),
+        ("Table store", test_table_store),
+        ("Columnar corpus", test_columnar_corpus),
+        ("Typed records", test_typed_records),
+        ("Stage timer", test_stage_timer),
+        ("Offline benchmark", test_benchmark),
+        ("Routing tree", test_routing_tree),
+        ("BM25 pre-filter", test_bm25_prefilter),
+        ("Cell-value index", test_cell_index),
+        ("Column statistics catalog", test_column_catalog),
+        ("Score cutoff", test_score_cutoff),
+        ("Streaming prefetch", test_prefetch),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for name, test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+            else:
+                failed += 1
+                print(f"\n✗ {name} failed")
+        except Exception as e:
+            failed += 1
+            print(f"\n✗ {name} crashed: {e}")
+            import traceback
+            traceback.print_exc()
+
+    print("\n" + "="*70)
+    print("TEST SUMMARY")
+    print("="*70)
+    print(f"Passed: {passed}/{len(tests)}")
+    print(f"Failed: {failed}/{len(tests)}")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(run_all_tests())
@@ -1,10 +1,22 @@
 from huggingface_hub import hf_hub_download
+import argparse
 import shutil
 import os
+import sys
 import json
 import random 
 from collections import defaultdict
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from retrieval_modules.corpus import COLUMNAR_FORMATS, CORPUS_FORMATS, iter_records, read_records, write_records
+from retrieval_modules.records import ExampleQueryRecord, QueryRecord, SchemaRecord, TableRecord, encode_line
+
+parser = argparse.ArgumentParser(description="Download the MultiTableQA datasets and build schema / example-query files.")
+parser.add_argument("--corpus_format", type=str, default="jsonl", choices=CORPUS_FORMATS,
+                    help="Also write table, query, schema and example-query files as columnar "
+                         ".arrow (memory-mapped) or .parquet next to the JSONL files")
+args = parser.parse_args()
+
 datasets = ["TATQA", "TabFact", "HybridQA", "WTQ", "SQA"]
 
 for dataset in datasets:
@@ -36,10 +48,11 @@ for dataset in datasets:
     schema_output_file = f'./data/{dataset.lower()}/{dataset.lower()}_schema.jsonl'
     example_query_output_file = f'./data/{dataset.lower()}/{dataset.lower()}_example_query.jsonl'
     
-    with open(save_dir + table_file, 'r', encoding='utf-8') as f:
-        lines = [json.loads(line) for line in f]
+    lines = read_records(save_dir + table_file, record_type=TableRecord)
         
     num_lines = len(lines)
+    schema_records = []
+    example_query_records = []
 
     with open(schema_output_file, 'a', encoding='utf-8') as f:
         for i in range(num_lines):
@@ -47,12 +60,9 @@ for dataset in datasets:
             table_schema = f"Caption: {line_data['caption']}; Headers: {line_data['table']['header']};"
             source_table_idx = line_data['source_table_idx']
             table_idx = line_data['table_idx']
-            output = {
-                "table_schema": table_schema,
-                "source_table_idx": source_table_idx,
-                "table_idx": table_idx
-            }
-            f.write(json.dumps(output) + '\n')
+            output = SchemaRecord(table_schema=table_schema, source_table_idx=source_table_idx, table_idx=table_idx)
+            schema_records.append(output)
+            f.write(encode_line(output) + '\n')
         
         print(f"Processed table schema and saved to {schema_output_file}")
             
@@ -70,26 +80,28 @@ for dataset in datasets:
             source_table_idx = line_data['source_table_idx']
             table_idx = line_data['table_idx']
             
-            output = {
-                "example_query": example_query,
-                "source_table_idx": source_table_idx,
-                "table_idx": table_idx
-            }
-            f.write(json.dumps(output) + '\n')
+            output = ExampleQueryRecord(example_query=example_query, source_table_idx=source_table_idx,
+                                        table_idx=table_idx)
+            example_query_records.append(output)
+            f.write(encode_line(output) + '\n')
     
         print(f"Processed example queries and saved to {example_query_output_file}")
+
+    if args.corpus_format in COLUMNAR_FORMATS:
+        query_records = read_records(save_dir + query_file)
+        for path, records in [(save_dir + table_file, lines), (save_dir + query_file, query_records),
+                              (schema_output_file, schema_records), (example_query_output_file, example_query_records)]:
+            print(f"Saved {write_records(path, records, args.corpus_format)}")
     
     ## Step3: PROCESS SOURCE-SUB TABLE MATCH
     match_output_file = f'./data/{dataset.lower()}/{dataset.lower()}_table_match.json'
     table_mapping = defaultdict(set)
-    with open(save_dir + table_file, 'r', encoding='utf-8') as infile:
-        for line in infile:
-            data = json.loads(line.strip())
-            source_table_idx = int(data["source_table_idx"])
-            table_idx = data["table_idx"]
-        
-            # Add table_idx to the corresponding source_table_idx
-            table_mapping[source_table_idx].add(table_idx)
+    for data in iter_records(save_dir + table_file, record_type=TableRecord):
+        source_table_idx = int(data["source_table_idx"])
+        table_idx = data["table_idx"]
+    
+        # Add table_idx to the corresponding source_table_idx
+        table_mapping[source_table_idx].add(table_idx)
             
     output_data = {int(key): list(value) for key, value in table_mapping.items()}
 
@@ -1,4 +1,9 @@
-import json
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from retrieval_modules.records import RetrievalResult, iter_jsonl
 
 def acc_at_k(ground_truth, retrieved, k):
     """
@@ -18,13 +23,15 @@ def recall_at_k(ground_truth, retrieved, k):
     relevant_found = len(set(ground_truth) & top_k)
     return relevant_found / len(ground_truth)
 
-datasets = ['tabfact']
+def evaluate_retrieval(retrieved_file, ks=(10, 20, 50)):
+    """
+    Computes mean acc@k and recall@k over a retrieved-tables JSONL file.
+    Returns a dict mapping k -> {"acc": ..., "recall": ...}.
+    """
+    data = list(iter_jsonl(retrieved_file, RetrievalResult))
 
-for dataset in datasets:
-    with open(f'./data/contriever/{dataset}/{dataset}_retrieved_tables_schema_100_50_contriever.jsonl', 'r') as f2:
-        data = [json.loads(line) for line in f2]
-    
-    for k in [10, 20, 50]:
+    results = {}
+    for k in ks:
         acc = 0
         recall = 0
         n = 0
@@ -36,4 +43,27 @@ for dataset in datasets:
             acc += acc_at_k(ground_truth, retrieved, k)
             recall += recall_at_k(ground_truth, retrieved, k)
             n += 1
-        print(f"Dataset: {dataset}, k: {k}, acc@{k}: {acc/n:.4f}, recall@{k}: {recall/n:.4f}")
+        results[k] = {"acc": acc / n, "recall": recall / n}
+    return results
+
+parser = argparse.ArgumentParser(description="Evaluate retrieved tables.")
+parser.add_argument("--retrieved_file", type=str, default=None,
+                    help="Retrieved tables JSONL to evaluate (default: the tabfact contriever run)")
+parser.add_argument("--baseline_file", type=str, default=None,
+                    help="Optional baseline run (e.g. without dimensionality reduction) to report the acc@k impact against")
+args = parser.parse_args()
+
+if args.retrieved_file is None:
+    datasets = ['tabfact']
+    retrieved_files = {dataset: f'./data/contriever/{dataset}/{dataset}_retrieved_tables_schema_100_50_contriever.jsonl' for dataset in datasets}
+else:
+    retrieved_files = {os.path.basename(args.retrieved_file): args.retrieved_file}
+baseline = evaluate_retrieval(args.baseline_file) if args.baseline_file is not None else None
+
+for dataset, retrieved_file in retrieved_files.items():
+    results = evaluate_retrieval(retrieved_file)
+    for k, metrics in results.items():
+        print(f"Dataset: {dataset}, k: {k}, acc@{k}: {metrics['acc']:.4f}, recall@{k}: {metrics['recall']:.4f}")
+        if baseline is not None:
+            print(f"    vs baseline: acc@{k} {metrics['acc'] - baseline[k]['acc']:+.4f}, "
+                  f"recall@{k} {metrics['recall'] - baseline[k]['recall']:+.4f}")